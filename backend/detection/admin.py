@@ -1,21 +1,29 @@
 from django.contrib import admin
+from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import Image
-import csv
-from django.http import HttpResponse
+from .models import Image, InferenceJob, ObjectTag
+from .search import search
+from .export import export_response
 
 
 class ImageAdmin(admin.ModelAdmin):
-    list_display = ("id", "thumbnail", "upload_date", "short_description", "short_detected_objects", "text")  # Что показывать в списке
-    list_filter = ("upload_date",)  # Фильтр по дате
+    list_display = ("id", "thumbnail", "upload_date", "status", "short_description", "short_detected_objects", "text")  # Что показывать в списке
+    list_filter = ("upload_date", "status")  # Фильтр по дате и статусу обработки
     search_fields = ("description", "detected_objects", "text")  # Поиск по описанию, объектам и тексту
     readonly_fields = ("upload_date", "image_preview")  # Только для просмотра
-    actions = ["export_as_csv"]  # Добавляем экспорт в CSV
+    actions = ["export_as_csv", "export_as_jsonl"]  # Добавляем экспорт в CSV и JSONL
+
+    def get_search_results(self, request, queryset, search_term):
+        """Поиск через полнотекстовый индекс вместо LIKE по каждому полю."""
+        if not search_term.strip():
+            return queryset, False
+        return search(queryset, search_term), False
 
     def thumbnail(self, obj):
         """Превью изображений в списке."""
         if obj.image:
-            return mark_safe(f'<img src="{obj.image.url}" width="100" height="100" style="border-radius:5px;" />')
+            url = reverse("images-rendition", kwargs={"pk": obj.pk, "kind": "thumbnail"})
+            return mark_safe(f'<img src="{url}" width="100" height="100" style="border-radius:5px; object-fit:cover;" loading="lazy" />')
         return "No Image"
 
     thumbnail.short_description = "Preview"
@@ -35,22 +43,37 @@ class ImageAdmin(admin.ModelAdmin):
     def image_preview(self, obj):
         """Отображение полного изображения в детальном просмотре."""
         if obj.image:
-            return mark_safe(f'<img src="{obj.image.url}" width="300" style="border-radius:10px;"/>')
+            url = reverse("images-rendition", kwargs={"pk": obj.pk, "kind": "preview"})
+            return mark_safe(f'<a href="{obj.image.url}"><img src="{url}" width="300" style="border-radius:10px;"/></a>')
         return "No Image"
 
     image_preview.short_description = "Full Image Preview"
 
     def export_as_csv(self, request, queryset):
-        """Экспорт выбранных изображений в CSV."""
-        response = HttpResponse(content_type="text/csv")
-        response["Content-Disposition"] = 'attachment; filename="images.csv"'
-        writer = csv.writer(response)
-        writer.writerow(["ID", "Upload Date", "Description", "Detected Objects", "Text"])
-        for obj in queryset:
-            writer.writerow([obj.id, obj.upload_date, obj.description, obj.detected_objects, obj.text])
-        return response
+        """Экспорт выбранных изображений в CSV (потоково, без буферизации в памяти)."""
+        return export_response(queryset, "csv")
 
     export_as_csv.short_description = "Export selected to CSV"
 
+    def export_as_jsonl(self, request, queryset):
+        """Экспорт выбранных изображений в JSONL."""
+        return export_response(queryset, "jsonl")
+
+    export_as_jsonl.short_description = "Export selected to JSONL"
+
+
+class InferenceJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "image", "status", "attempts", "next_attempt_at", "updated_at")
+    list_filter = ("status",)
+    readonly_fields = ("created_at", "updated_at")
+
+
+class ObjectTagAdmin(admin.ModelAdmin):
+    list_display = ("name", "image_count")
+    search_fields = ("name",)
+    ordering = ("-image_count",)
+
 
 admin.site.register(Image, ImageAdmin)
+admin.site.register(InferenceJob, InferenceJobAdmin)
+admin.site.register(ObjectTag, ObjectTagAdmin)
@@ -1,6 +1,22 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
 
 
 class DetectionConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'detection'
+
+    def ready(self):
+        from .embeddings import remove_embedding
+        from .models import Image
+        from .search import ensure_search_index
+        from .similarity import remove_from_index, update_index
+        from .tags import release_image_tags
+
+        # Индекс FTS5 и триггеры создаются после миграций
+        post_migrate.connect(ensure_search_index, sender=self)
+        pre_delete.connect(release_image_tags, sender=Image)
+        # Индекс перцептивных хэшей обновляется инкрементально
+        post_save.connect(update_index, sender=Image)
+        post_delete.connect(remove_from_index, sender=Image)
+        post_delete.connect(remove_embedding, sender=Image)
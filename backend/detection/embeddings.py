@@ -0,0 +1,267 @@
+"""Векторный поиск по эмбеддингам изображений.
+
+Эмбеддинги (L2-нормированные, float16) лежат в ``EMBEDDINGS_DIR/vectors.f16``:
+строка номер ``id`` — вектор изображения с этим ``id``, строки без
+изображения заполнены нулями. Файл открывается через ``np.memmap`` без
+чтения и копирования, а новые векторы пишутся по смещению своей строки,
+поэтому API, воркеры и команды дописывают его без блокировок.
+
+Точный поиск перемножает запросы с матрицей по блокам (для нормированных
+векторов это косинусная близость) и держит лучшие ``k``. Для больших
+коллекций есть приближённый режим IVF: центроиды k-means в
+``ivf_centroids.npy`` и номер списка каждой строки в ``ivf_lists.i32``
+(номер + 1, ноль — строка не распределена); просматриваются только
+``nprobe`` ближайших к запросу списков.
+"""
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+VECTORS_FILE = "vectors.f16"
+LISTS_FILE = "ivf_lists.i32"
+CENTROIDS_FILE = "ivf_centroids.npy"
+META_FILE = "meta.json"
+SEARCH_MODES = ("auto", "exact", "ivf")
+
+
+def normalize(vectors):
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _pwrite(path, data, offset):
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.pwrite(fd, data, offset)
+    finally:
+        os.close(fd)
+
+
+def _top_k(scores, ids, k):
+    """Лучшие ``k`` по убыванию для каждой строки ``scores``."""
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+class EmbeddingStore:
+    """Матрица эмбеддингов в файле, выровненная по ``id`` изображений."""
+
+    def __init__(self, path):
+        self.path = path
+        self.dim = None
+        self.vectors = None
+        self.centroids = None
+        self._vectors_size = -1
+        self._lists_state = None
+        self._lists = None
+        self._checked_at = 0.0
+        self.lock = threading.RLock()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load_meta(self):
+        if self.dim is None and os.path.exists(self._file(META_FILE)):
+            with open(self._file(META_FILE)) as f:
+                self.dim = json.load(f)["dim"]
+
+    def _init_meta(self, dim):
+        self._load_meta()
+        if self.dim is None:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file(META_FILE), "w") as f:
+                json.dump({"dim": dim}, f)
+            self.dim = dim
+        elif self.dim != dim:
+            raise ValueError(f"Размерность эмбеддинга {dim} не совпадает с индексом ({self.dim})")
+
+    @property
+    def row_bytes(self):
+        return self.dim * 2
+
+    def open(self):
+        """Отображает файл векторов в память; повторно — только если файл вырос."""
+        with self.lock:
+            self._load_meta()
+            path = self._file(VECTORS_FILE)
+            size = os.path.getsize(path) if self.dim and os.path.exists(path) else 0
+            if size != self._vectors_size:
+                rows = size // self.row_bytes if size else 0
+                self.vectors = (
+                    np.memmap(path, dtype=np.float16, mode="r", shape=(rows, self.dim))
+                    if rows else np.empty((0, self.dim or 0), dtype=np.float16)
+                )
+                self._vectors_size = size
+                centroids = self._file(CENTROIDS_FILE)
+                self.centroids = np.load(centroids) if os.path.exists(centroids) else None
+            return self.vectors
+
+    def __len__(self):
+        return len(self.open())
+
+    def put(self, pk, vector):
+        """Записывает эмбеддинг изображения ``pk`` (и его список IVF, если индекс обучен)."""
+        vector = normalize(vector)[0]
+        with self.lock:
+            self._init_meta(len(vector))
+            _pwrite(self._file(VECTORS_FILE), vector.astype(np.float16).tobytes(), pk * self.row_bytes)
+            self.open()
+            if self.centroids is not None:
+                ivf_list = int(np.argmax(self.centroids @ vector)) + 1
+                _pwrite(self._file(LISTS_FILE), np.int32(ivf_list).tobytes(), pk * 4)
+
+    def get(self, pk):
+        """Эмбеддинг изображения float32 или ``None``, если его нет."""
+        vectors = self.open()
+        if pk >= len(vectors) or not vectors[pk].any():
+            return None
+        return vectors[pk].astype(np.float32)
+
+    def remove(self, pk):
+        with self.lock:
+            self._load_meta()
+            if self.dim is None or pk >= len(self.open()):
+                return
+            _pwrite(self._file(VECTORS_FILE), bytes(self.row_bytes), pk * self.row_bytes)
+            if os.path.exists(self._file(LISTS_FILE)):
+                _pwrite(self._file(LISTS_FILE), bytes(4), pk * 4)
+
+    def search(self, queries, k=20, mode="auto", nprobe=None, exclude=()):
+        """Ближайшие изображения для каждого запроса: списки пар ``(id, близость)``."""
+        queries = normalize(queries)
+        vectors = self.open()
+        if not len(vectors):
+            return [[] for _ in queries]
+        if mode == "auto":
+            use_ivf = self.centroids is not None and len(vectors) >= settings.EMBEDDING_IVF_MIN_ROWS
+            mode = "ivf" if use_ivf else "exact"
+        if mode == "ivf" and self.centroids is None:
+            raise ValueError("Индекс IVF не построен: выполните build_embedding_index")
+
+        fetch = k + len(exclude)
+        if mode == "ivf":
+            found = [self._search_ivf(vectors, query, fetch, nprobe or settings.EMBEDDING_IVF_NPROBE)
+                     for query in queries]
+        else:
+            found = self._search_exact(vectors, queries, fetch)
+        exclude = set(exclude)
+        return [
+            [(pk, round(score, 4)) for pk, score in zip(ids, scores) if pk not in exclude][:k]
+            for scores, ids in found
+        ]
+
+    def _search_exact(self, vectors, queries, k):
+        block = settings.EMBEDDING_SEARCH_BLOCK
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(vectors), block):
+            chunk = np.asarray(vectors[start:start + block], dtype=np.float32)
+            scores = queries @ chunk.T
+            scores[:, ~chunk.any(axis=1)] = -np.inf  # Строки без изображений
+            ids = np.broadcast_to(np.arange(start, start + len(chunk)), scores.shape)
+            best_scores, best_ids = _top_k(
+                np.concatenate([best_scores, scores], axis=1), np.concatenate([best_ids, ids], axis=1), k
+            )
+        return [
+            (row_scores[np.isfinite(row_scores)].tolist(), row_ids[np.isfinite(row_scores)].tolist())
+            for row_scores, row_ids in zip(best_scores, best_ids)
+        ]
+
+    def _inverted_lists(self):
+        """Строки каждого списка IVF и число охваченных строк; перестраиваются, если файл изменился."""
+        path = self._file(LISTS_FILE)
+        if time.monotonic() - self._checked_at < settings.EMBEDDING_INDEX_REFRESH and self._lists is not None:
+            return self._lists
+        stat = os.stat(path)
+        state = (stat.st_size, stat.st_mtime_ns)
+        if state != self._lists_state:
+            lists = np.memmap(path, dtype=np.int32, mode="r")
+            order = np.argsort(lists, kind="stable")
+            bounds = np.searchsorted(lists[order], np.arange(len(self.centroids) + 2))
+            self._lists = (order, bounds, len(lists))
+            self._lists_state = state
+        self._checked_at = time.monotonic()
+        return self._lists
+
+    def _search_ivf(self, vectors, query, k, nprobe):
+        order, bounds, covered = self._inverted_lists()
+        probes = np.argsort(-(self.centroids @ query))[:nprobe] + 1
+        # Строки, дописанные после построения списков, просматриваются целиком
+        rows = np.concatenate([order[bounds[p]:bounds[p + 1]] for p in probes] + [np.arange(covered, len(vectors))])
+        rows = rows[rows < len(vectors)]
+        if not len(rows):
+            return [], []
+        scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+        scores, ids = _top_k(scores[None, :], rows[None, :].astype(np.int64), k)
+        return scores[0].tolist(), ids[0].tolist()
+
+    def train_ivf(self, lists, sample_size=100000, iterations=20, seed=0):
+        """Обучает центроиды сферическим k-means на выборке и распределяет все строки по спискам."""
+        vectors = self.open()
+        block = settings.EMBEDDING_SEARCH_BLOCK
+        present = np.concatenate([
+            start + np.flatnonzero(np.asarray(vectors[start:start + block]).any(axis=1))
+            for start in range(0, len(vectors), block)
+        ] or [np.empty(0, dtype=np.int64)])
+        if len(present) < lists:
+            raise ValueError(f"Эмбеддингов {len(present)} меньше, чем списков IVF ({lists})")
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(vectors[np.sort(rng.choice(present, min(sample_size, len(present)), replace=False))],
+                            dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), lists, replace=False)]
+        for _ in range(iterations):
+            assigned = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(lists):
+                members = sample[assigned == i]
+                if len(members):
+                    centroids[i] = members.sum(axis=0)
+            centroids = normalize(centroids)
+
+        # Сначала списки, затем центроиды: пока центроиды старые, поиск по IVF ещё не включён
+        tmp = self._file(LISTS_FILE + ".tmp")
+        assignments = np.memmap(tmp, dtype=np.int32, mode="w+", shape=(len(vectors),))
+        for start in range(0, len(vectors), block):
+            chunk = np.asarray(vectors[start:start + block], dtype=np.float32)
+            assignments[start:start + len(chunk)] = np.where(
+                chunk.any(axis=1), np.argmax(chunk @ centroids.T, axis=1) + 1, 0
+            )
+        assignments.flush()
+        del assignments
+        os.replace(tmp, self._file(LISTS_FILE))
+        with open(self._file(CENTROIDS_FILE + ".tmp"), "wb") as f:
+            np.save(f, centroids)
+        os.replace(self._file(CENTROIDS_FILE + ".tmp"), self._file(CENTROIDS_FILE))
+        with self.lock:
+            self._vectors_size = -1
+            self._lists = None
+        return len(present)
+
+
+_stores = {}
+
+
+def get_store():
+    """Хранилище эмбеддингов процесса (одно на ``EMBEDDINGS_DIR``)."""
+    path = str(settings.EMBEDDINGS_DIR)
+    if path not in _stores:
+        _stores[path] = EmbeddingStore(path)
+    return _stores[path]
+
+
+def save_embedding(pk, vector):
+    """Сохраняет эмбеддинг из ответа сервиса инференса; без эмбеддинга ничего не делает."""
+    if vector is not None:
+        get_store().put(pk, vector)
+
+
+def remove_embedding(sender, instance, **kwargs):
+    """post_delete: строка удалённого изображения обнуляется."""
+    get_store().remove(instance.pk)
@@ -0,0 +1,68 @@
+"""Потоковый экспорт каталога изображений в CSV и JSONL.
+
+Строки читаются из БД порциями через ``.iterator()`` и сразу отдаются
+клиенту, поэтому расход памяти не зависит от размера выгрузки.
+"""
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+
+EXPORT_FIELDS = ("id", "upload_date", "description", "detected_objects", "text")
+CSV_HEADER = ["ID", "Upload Date", "Description", "Detected Objects", "Text"]
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+}
+CHUNK_SIZE = 2000  # Строк, читаемых из БД за раз и отдаваемых одним куском
+
+
+class Echo:
+    """Псевдофайл для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def iter_rows(queryset):
+    return queryset.order_by("id").values_list(*EXPORT_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def iter_csv(queryset):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    chunk = []
+    for row in iter_rows(queryset):
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def iter_jsonl(queryset):
+    chunk = []
+    for row in iter_rows(queryset):
+        record = dict(zip(EXPORT_FIELDS, row))
+        record["upload_date"] = record["upload_date"].isoformat() if record["upload_date"] else None
+        chunk.append(json.dumps(record, ensure_ascii=False) + "\n")
+        if len(chunk) >= CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def iter_export(queryset, export_format):
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат {export_format!r}, допустимы: {', '.join(EXPORT_FORMATS)}")
+    return iter_csv(queryset) if export_format == "csv" else iter_jsonl(queryset)
+
+
+def export_response(queryset, export_format="csv", filename="images"):
+    """Потоковый HTTP-ответ с выгрузкой в виде файла."""
+    response = StreamingHttpResponse(iter_export(queryset, export_format),
+                                     content_type=EXPORT_FORMATS[export_format])
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{export_format}"'
+    return response
@@ -0,0 +1,25 @@
+from rest_framework import filters
+
+from .search import search
+from .tags import filter_by_tags
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    """Параметр ``?search=`` через полнотекстовый индекс по описанию, объектам и тексту."""
+
+    def filter_queryset(self, request, queryset, view):
+        search_term = request.query_params.get(self.search_param, "").strip()
+        if not search_term:
+            return queryset
+        return search(queryset, search_term)
+
+
+class TagFilter(filters.BaseFilterBackend):
+    """Фильтр по тегам объектов: ``?tags=собака,кошка&tags_mode=and`` (по умолчанию ``or``)."""
+
+    def filter_queryset(self, request, queryset, view):
+        names = [name.strip() for name in request.query_params.get("tags", "").split(",") if name.strip()]
+        if not names:
+            return queryset
+        mode = "and" if request.query_params.get("tags_mode") == "and" else "or"
+        return filter_by_tags(queryset, names, mode)
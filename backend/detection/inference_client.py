@@ -0,0 +1,270 @@
+"""Клиент сервиса инференса для всех частей бэкенда.
+
+Запросы распределяются между репликами из ``INFERENCE_BACKENDS`` по
+наименьшему числу запросов в работе. У каждого вызова есть общий срок
+(deadline), в пределах которого выполняются повторы со случайной
+экспоненциальной задержкой — каждый раз на наименее загруженную реплику.
+Асинхронный клиент прерывает запрос точно по сроку. В синхронном срок
+проверяется перед каждой попыткой, а таймаут попытки ограничен оставшимся
+временем; requests применяет его к каждому чтению из сокета, поэтому
+сервер, отдающий ответ по частям, может растянуть попытку дольше срока.
+Реплика, подряд не ответившая ``INFERENCE_BREAKER_FAILURES`` раз,
+исключается (circuit breaker) на ``INFERENCE_BREAKER_RESET`` секунд, после
+чего получает один пробный запрос. Соединения держатся в пуле и
+переиспользуются.
+
+``InferenceClient`` — синхронный (requests), ``AsyncInferenceClient`` — для
+asyncio (httpx); логика выбора реплик у них общая.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+# Коды, при которых запрос повторяется на другой реплике
+RETRY_STATUSES = (502, 503, 504)
+
+
+class InferenceError(Exception):
+    """Сервис инференса недоступен или вернул ошибку (``status`` — код последнего ответа)."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self):
+        """Повтор может помочь: нет ответа, 429 или ошибка сервера; прочие 4xx — ошибка самого запроса."""
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class Backend:
+    """Реплика сервиса и состояние её circuit breaker."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.outstanding = 0  # Запросов в работе
+        self.failures = 0  # Ошибок подряд
+        self.opened_at = None  # Когда breaker разомкнулся
+        self.probing = False  # Идёт пробный запрос после паузы
+
+    def available(self, now, reset_after):
+        if self.opened_at is None:
+            return True
+        # Разомкнутый breaker после паузы пропускает один пробный запрос
+        return not self.probing and now - self.opened_at >= reset_after
+
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing else "open"
+
+
+class BackendPool:
+    """Выбор реплики по наименьшему числу запросов в работе с учётом circuit breaker."""
+
+    def __init__(self, urls, failure_threshold, reset_after):
+        if not urls:
+            raise InferenceError("Не настроено ни одной реплики сервиса инференса")
+        self.backends = [Backend(url) for url in urls]
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if b.available(now, self.reset_after)]
+            if not candidates:
+                raise InferenceError("Все реплики сервиса инференса временно исключены после ошибок")
+            least = min(b.outstanding for b in candidates)
+            backend = random.choice([b for b in candidates if b.outstanding == least])
+            if backend.opened_at is not None:
+                backend.probing = True
+            backend.outstanding += 1
+            return backend
+
+    def release(self, backend, ok):
+        """Возвращает реплику; ``ok=None`` — ответ не говорит о её исправности (перегрузка)."""
+        with self.lock:
+            backend.outstanding -= 1
+            backend.probing = False
+            if ok:
+                backend.failures = 0
+                backend.opened_at = None
+            elif ok is False:
+                backend.failures += 1
+                if backend.failures >= self.failure_threshold or backend.opened_at is not None:
+                    backend.opened_at = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            return {
+                b.url: {"outstanding": b.outstanding, "failures": b.failures, "state": b.state()}
+                for b in self.backends
+            }
+
+
+def _retry_delay(attempt, base, remaining):
+    """Экспоненциальная задержка с полным разбросом, не дальше срока вызова."""
+    return min(random.uniform(0, base * 2 ** attempt), max(0.0, remaining))
+
+
+def _rewind(files):
+    """Перематывает файловые объекты перед повторной отправкой."""
+    for value in (files.values() if isinstance(files, dict) else (v for _, v in files or ())):
+        fileobj = value[1] if isinstance(value, tuple) else value
+        if hasattr(fileobj, "seek"):
+            fileobj.seek(0)
+
+
+def _check(response):
+    if response.status_code != 200:
+        raise InferenceError(f"Ошибка API ({response.status_code}): {response.text[:500]}", response.status_code)
+    return response
+
+
+class _ClientBase:
+    def __init__(self, backends=None, pool_size=None, timeout=None, connect_timeout=None, retries=None,
+                 backoff=None, failure_threshold=None, reset_after=None):
+        self.pool = BackendPool(
+            backends or settings.INFERENCE_BACKENDS,
+            failure_threshold or settings.INFERENCE_BREAKER_FAILURES,
+            reset_after or settings.INFERENCE_BREAKER_RESET,
+        )
+        self.pool_size = pool_size or settings.INFERENCE_POOL_SIZE
+        self.timeout = timeout or settings.INFERENCE_TIMEOUT
+        self.connect_timeout = connect_timeout or settings.INFERENCE_CONNECT_TIMEOUT
+        self.retries = settings.INFERENCE_RETRIES if retries is None else retries
+        self.backoff = settings.INFERENCE_RETRY_BACKOFF if backoff is None else backoff
+
+    def stats(self):
+        return self.pool.stats()
+
+
+class InferenceClient(_ClientBase):
+    """Синхронный клиент с пулом соединений; потокобезопасен."""
+
+    def __init__(self, backends=None, **kwargs):
+        super().__init__(backends, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.pool.backends), pool_maxsize=self.pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, path, timeout=None, **kwargs):
+        """Запрос к наименее загруженной реплике с повторами, пока не истёк срок ``timeout`` секунд."""
+        deadline = time.monotonic() + (timeout or self.timeout)
+        error = None
+        for attempt in range(self.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            backend = self.pool.acquire()
+            ok = False
+            try:
+                _rewind(kwargs.get("files"))
+                response = self.session.request(
+                    method, backend.url + path, timeout=(min(self.connect_timeout, remaining), remaining), **kwargs
+                )
+                if response.status_code not in RETRY_STATUSES:
+                    ok = True
+                    return response
+                # 503 — отказ по переполнению очереди: реплика исправна, просто занята
+                ok = None if response.status_code == 503 else False
+                error = InferenceError(f"Ошибка API ({response.status_code}) на {backend.url}", response.status_code)
+            except requests.RequestException as e:
+                error = InferenceError(f"API недоступно ({backend.url}): {e}")
+            finally:
+                self.pool.release(backend, ok)
+            if attempt < self.retries:
+                time.sleep(_retry_delay(attempt, self.backoff, deadline - time.monotonic()))
+        raise error or InferenceError("Истёк срок запроса к сервису инференса")
+
+    def upload(self, image, options=None, timeout=None):
+        """Обрабатывает одно изображение (файл, байты или кортеж requests) и возвращает ответ."""
+        return _check(self.request("POST", "/upload/", files={"image": image}, params=options or {},
+                                   timeout=timeout)).json()
+
+    def upload_batch(self, images, options=None, timeout=None):
+        """Пакетная обработка: ``images`` — список ``(имя, файл)``; возвращает строки NDJSON."""
+        files = [("images", image) for image in images]
+        response = _check(self.request("POST", "/upload/batch/", files=files, params=options or {},
+                                       timeout=timeout or self.timeout * max(1, len(images))))
+        return [json.loads(line) for line in response.text.splitlines() if line]
+
+    def versions(self):
+        return _check(self.request("GET", "/versions/")).json()
+
+
+class AsyncInferenceClient(_ClientBase):
+    """Клиент для asyncio на httpx: те же балансировка, повторы и circuit breaker."""
+
+    def __init__(self, backends=None, **kwargs):
+        import httpx
+
+        super().__init__(backends, **kwargs)
+        self._httpx = httpx
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        )
+
+    async def request(self, method, path, timeout=None, **kwargs):
+        deadline = time.monotonic() + (timeout or self.timeout)
+        error = None
+        for attempt in range(self.retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            backend = self.pool.acquire()
+            ok = False
+            try:
+                _rewind(kwargs.get("files"))
+                response = await asyncio.wait_for(self.client.request(
+                    method, backend.url + path,
+                    timeout=self._httpx.Timeout(remaining, connect=min(self.connect_timeout, remaining)), **kwargs
+                ), remaining)
+                if response.status_code not in RETRY_STATUSES:
+                    ok = True
+                    return response
+                ok = None if response.status_code == 503 else False
+                error = InferenceError(f"Ошибка API ({response.status_code}) на {backend.url}", response.status_code)
+            except self._httpx.HTTPError as e:
+                error = InferenceError(f"API недоступно ({backend.url}): {e}")
+            except asyncio.TimeoutError:
+                error = InferenceError(f"Истёк срок запроса к {backend.url}")
+            finally:
+                self.pool.release(backend, ok)
+            if attempt < self.retries:
+                await asyncio.sleep(_retry_delay(attempt, self.backoff, deadline - time.monotonic()))
+        raise error or InferenceError("Истёк срок запроса к сервису инференса")
+
+    async def upload(self, image, options=None, timeout=None):
+        response = await self.request("POST", "/upload/", files={"image": image}, params=options or {},
+                                      timeout=timeout)
+        return _check(response).json()
+
+    async def versions(self):
+        return _check(await self.request("GET", "/versions/")).json()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Общий синхронный клиент процесса."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InferenceClient()
+    return _client
@@ -0,0 +1,229 @@
+"""Очередь задач инференса в базе данных.
+
+Загрузка через API только создаёт ``InferenceJob``, а обращение к сервису
+инференса выполняет воркер ``python manage.py process_jobs``.
+"""
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .embeddings import get_store, save_embedding
+from .inference_client import InferenceError, get_client
+from .metadata import write_metadata
+from .models import ImageTag, InferenceJob, ProcessingStatus
+from .renditions import ensure_renditions
+from .tags import set_image_tags, tags_from_response
+
+
+# Параметры запроса, которые клиент может передать в сервис инференса
+INFERENCE_OPTIONS = ("stages", "translate", "spelling", "text_lang")
+
+# Поле модели и стадия сервиса инференса, которая его заполняет
+FIELD_STAGES = {"description": "caption", "detected_objects": "detection", "text": "ocr"}
+
+
+def inference_options(params):
+    """Выбирает из параметров запроса те, что относятся к инференсу."""
+    return {key: str(params[key]) for key in INFERENCE_OPTIONS if params.get(key) not in (None, "")}
+
+
+def post_image(image_file, options=None):
+    """Отправляет файл изображения в сервис инференса и возвращает его ответ."""
+    return get_client().upload(image_file, options)
+
+
+def request_metadata(image_path, options=None):
+    """Отправляет изображение с диска в сервис инференса и возвращает его ответ."""
+    with open(image_path, "rb") as img_file:
+        return post_image(img_file, options)
+
+
+def assign_metadata(instance, data):
+    """Переносит в модель результаты выполненных стадий и их версии.
+
+    Поля пропущенных по запросу стадий остаются без изменений. Возвращает
+    список изменённых полей для ``save(update_fields=...)`` или ``bulk_update``.
+    """
+    defaults = {
+        "description": "No description received",
+        "detected_objects": "No objects detected",
+        "text": "No translated text",
+    }
+    skipped = set(data.get("skipped", []))
+    updated = [field for field, stage in FIELD_STAGES.items() if stage not in skipped]
+    for field in updated:
+        setattr(instance, field, data.get(field, defaults[field]))
+    versions = {stage: version for stage, version in (data.get("model_versions") or {}).items()
+                if stage not in skipped}
+    instance.model_versions = {**(instance.model_versions or {}), **versions}
+    instance.status = ProcessingStatus.DONE
+    return updated + ["model_versions", "status"]
+
+
+def store_tags(instance, data):
+    """Обновляет теги изображения, если стадия детекции выполнялась."""
+    if "detection" not in set(data.get("skipped", [])):
+        set_image_tags(instance, tags_from_response(data))
+
+
+def store_files(instance, data):
+    """Пишет то, что лежит вне БД: эмбеддинг и метаданные в файле изображения.
+
+    Вызывается после фиксации транзакции: откат не вернёт файлы назад, а
+    медленная запись не должна держать блокировку БД.
+    """
+    try:
+        save_embedding(instance.pk, data.get("embedding"))
+    except (OSError, ValueError):
+        pass  # Без эмбеддинга изображение не найдётся только векторным поиском
+
+    write_metadata(
+        instance.image.path,
+        instance.description,
+        instance.detected_objects,
+        instance.text
+    )
+
+
+def store_results(instance, data):
+    """Сохраняет то, что лежит вне строки изображения: теги, эмбеддинг и метаданные файла."""
+    store_tags(instance, data)
+    store_files(instance, data)
+
+
+def source_tags(source):
+    """Теги изображения в формате ``tags_from_response``."""
+    return {
+        name: (count, confidence)
+        for name, count, confidence in ImageTag.objects.filter(image=source)
+        .values_list("tag__name", "count", "confidence")
+    }
+
+
+def reuse_metadata(instance, source):
+    """Копирует метаданные почти-дубликата ``source`` вместо обращения к нейросети."""
+    with transaction.atomic():
+        for field in FIELD_STAGES:
+            setattr(instance, field, getattr(source, field))
+        instance.model_versions = source.model_versions
+        instance.status = ProcessingStatus.DONE
+        instance.save(update_fields=list(FIELD_STAGES) + ["model_versions", "status"])
+        set_image_tags(instance, source_tags(source))
+    try:
+        save_embedding(instance.pk, get_store().get(source.pk))
+    except (OSError, ValueError):
+        pass
+
+    write_metadata(
+        instance.image.path,
+        instance.description,
+        instance.detected_objects,
+        instance.text
+    )
+
+
+def enqueue(instance, options=None):
+    """Ставит изображение в очередь на обработку с параметрами инференса ``options``."""
+    instance.status = ProcessingStatus.PENDING
+    instance.save(update_fields=["status"])
+    InferenceJob.objects.update_or_create(
+        image=instance,
+        defaults={"status": ProcessingStatus.PENDING, "attempts": 0, "options": options or {},
+                  "next_attempt_at": timezone.now(), "last_error": ""},
+    )
+
+
+def claim_job():
+    """Забирает одну готовую к выполнению задачу; ``None``, если задач нет.
+
+    Захват — условный UPDATE по статусу, поэтому несколько воркеров не
+    возьмут одну задачу даже на SQLite, где нет SELECT ... FOR UPDATE.
+    """
+    candidates = (
+        InferenceJob.objects
+        .filter(status=ProcessingStatus.PENDING, next_attempt_at__lte=timezone.now())
+        .order_by("next_attempt_at")
+        .values_list("pk", flat=True)[:10]
+    )
+    for pk in candidates:
+        claimed = InferenceJob.objects.filter(pk=pk, status=ProcessingStatus.PENDING).update(
+            status=ProcessingStatus.PROCESSING, updated_at=timezone.now()
+        )
+        if claimed:
+            return InferenceJob.objects.select_related("image").get(pk=pk)
+    return None
+
+
+def requeue_stale_jobs():
+    """Возвращает в очередь задачи, зависшие в работе после падения воркера."""
+    stale_before = timezone.now() - timedelta(seconds=settings.INFERENCE_JOB_STALE_AFTER)
+    return InferenceJob.objects.filter(
+        status=ProcessingStatus.PROCESSING, updated_at__lt=stale_before
+    ).update(status=ProcessingStatus.PENDING, next_attempt_at=timezone.now())
+
+
+def backoff_delay(attempts):
+    """Экспоненциальная задержка перед повтором со случайным разбросом."""
+    delay = min(settings.INFERENCE_JOB_BACKOFF * 2 ** (attempts - 1), settings.INFERENCE_JOB_MAX_BACKOFF)
+    return timedelta(seconds=delay * random.uniform(0.5, 1.5))
+
+
+def fail_job(job, error, retry=True):
+    """Планирует повтор задачи с задержкой или, если попытки кончились, помечает её проваленной.
+
+    ``retry=False`` — повтор ничего не изменит (сервис отклонил сам запрос), задача проваливается сразу.
+    """
+    image = job.image
+    job.last_error = error
+    if not retry or job.attempts >= settings.INFERENCE_JOB_MAX_ATTEMPTS:
+        job.status = ProcessingStatus.FAILED
+        image.status = ProcessingStatus.FAILED
+    else:
+        job.status = ProcessingStatus.PENDING
+        job.next_attempt_at = timezone.now() + backoff_delay(job.attempts)
+        image.status = ProcessingStatus.PENDING
+    job.save(update_fields=["status", "attempts", "last_error", "next_attempt_at", "updated_at"])
+    image.save(update_fields=["status"])
+
+
+def run_job(job):
+    """Выполняет задачу; при ошибке планирует повтор или помечает её проваленной.
+
+    Любое исключение считается неудачной попыткой. Если не удалось записать
+    даже это (например, БД заблокирована), исключение уходит воркеру, а
+    задача остаётся «в работе» до ``requeue_stale_jobs``.
+    """
+    image = job.image
+    job.attempts += 1
+    try:
+        image.status = ProcessingStatus.PROCESSING
+        image.save(update_fields=["status"])
+        data = request_metadata(image.image.path, job.options)
+        with transaction.atomic():
+            image.save(update_fields=assign_metadata(image, data))
+            store_tags(image, data)
+            job.status = ProcessingStatus.DONE
+            job.last_error = ""
+            job.save(update_fields=["status", "attempts", "last_error", "updated_at"])
+    except InferenceError as e:
+        fail_job(job, str(e), retry=e.retryable)
+        return False
+    except Exception as e:
+        fail_job(job, f"{type(e).__name__}: {e}")
+        return False
+
+    try:
+        store_files(image, data)
+    except (OSError, ValueError) as e:
+        # Строка в БД уже обновлена; метаданные файла допишет повторная обработка
+        job.last_error = f"Метаданные файла не записаны: {e}"
+        job.save(update_fields=["last_error", "updated_at"])
+    try:
+        # Превью создаются заранее, чтобы первый просмотр списка не ждал их
+        ensure_renditions(image)
+    except (OSError, ValueError):
+        pass  # Не критично: превью будет создано при первом запросе
+    return True
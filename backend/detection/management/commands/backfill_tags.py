@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from detection.models import Image, ImageTag
+from detection.tags import add_tags_bulk, parse_detected_objects, recount_tags
+
+
+class Command(BaseCommand):
+    help = "Заполняет теги объектов по строке detected_objects у существующих изображений"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Изображений в одной транзакции")
+        parser.add_argument("--reset", action="store_true", help="Удалить существующие теги перед заполнением")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["reset"]:
+            with transaction.atomic():
+                ImageTag.objects.all().delete()
+                recount_tags()
+            images = Image.objects.all()
+        else:
+            # Только изображения, у которых ещё нет тегов
+            images = Image.objects.exclude(id__in=ImageTag.objects.values("image_id"))
+
+        rows = images.exclude(detected_objects__isnull=True).values_list("id", "detected_objects")
+        batch = []
+        processed = 0
+        for image_id, detected_objects in rows.iterator(chunk_size=batch_size):
+            batch.append((image_id, parse_detected_objects(detected_objects)))
+            if len(batch) >= batch_size:
+                add_tags_bulk(batch, batch_size)
+                processed += len(batch)
+                batch = []
+                self.stdout.write(f"⏳ Обработано изображений: {processed}")
+        add_tags_bulk(batch, batch_size)
+        processed += len(batch)
+
+        # Счётчики могли разойтись из-за удалений в обход сигналов — пересчитываем
+        recount_tags()
+        self.stdout.write(self.style.SUCCESS(f"🎉 Теги заполнены для {processed} изображений"))
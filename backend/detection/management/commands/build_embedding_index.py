@@ -0,0 +1,31 @@
+import math
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.embeddings import get_store
+
+
+class Command(BaseCommand):
+    help = "Обучает приближённый индекс IVF для векторного поиска по эмбеддингам"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lists", type=int, help="Число списков IVF (по умолчанию ~4·√N)")
+        parser.add_argument("--sample", type=int, default=100000, help="Эмбеддингов в выборке для k-means")
+        parser.add_argument("--iterations", type=int, default=20, help="Итераций k-means")
+
+    def handle(self, *args, **options):
+        store = get_store()
+        rows = len(store)
+        if not rows:
+            raise CommandError("Эмбеддингов пока нет")
+        lists = options["lists"] or max(1, int(4 * math.sqrt(rows)))
+
+        started = time.perf_counter()
+        try:
+            indexed = store.train_ivf(lists, options["sample"], options["iterations"])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"🎉 Индекс IVF построен: {indexed} эмбеддингов, списков: {lists}, "
+            f"за {time.perf_counter() - started:.1f} с"))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from detection.models import Image
+from detection.similarity import dhash, to_db
+
+
+class Command(BaseCommand):
+    help = "Считает перцептивные хэши изображений, загруженных до их появления"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Изображений в одном bulk_update")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        images = Image.objects.filter(perceptual_hash__isnull=True).only("id", "image").order_by("id")
+        batch = []
+        processed = failed = 0
+        for image in images.iterator(chunk_size=batch_size):
+            try:
+                image.perceptual_hash = to_db(dhash(image.image.path))
+            except (OSError, ValueError) as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"❌ {image.image.name}: {e}"))
+                continue
+            batch.append(image)
+            if len(batch) >= batch_size:
+                Image.objects.bulk_update(batch, ["perceptual_hash"])
+                processed += len(batch)
+                batch = []
+                self.stdout.write(f"⏳ Обработано изображений: {processed}")
+        Image.objects.bulk_update(batch, ["perceptual_hash"])
+        processed += len(batch)
+
+        # Работающие процессы увидят хэши старых изображений после перезапуска
+        self.stdout.write(self.style.SUCCESS(f"🎉 Хэши посчитаны для {processed} изображений, ошибок: {failed}"))
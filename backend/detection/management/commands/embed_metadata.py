@@ -0,0 +1,55 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from detection.metadata import write_metadata
+from detection.models import Image, ProcessingStatus
+
+
+CHUNK_SIZE = 1000  # Файлов в памяти и задач в очереди пула одновременно
+
+
+def embed(item):
+    """Выполняется в отдельном процессе: записывает метаданные в один файл."""
+    path, description, detected_objects, text = item
+    try:
+        write_metadata(path, description, detected_objects or "", text)
+        return None
+    except (OSError, ValueError) as e:
+        return f"{path}: {e}"
+
+
+class Command(BaseCommand):
+    help = "Заново записывает метаданные из БД в файлы существующих изображений"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Процессов для записи")
+        parser.add_argument("--ids", help="Только изображения с этими id через запятую")
+
+    def handle(self, *args, **options):
+        images = Image.objects.filter(status=ProcessingStatus.DONE).only(
+            "id", "image", "description", "detected_objects", "text"
+        )
+        if options["ids"]:
+            images = images.filter(id__in=[int(i) for i in options["ids"].split(",")])
+
+        items = (
+            (image.image.path, image.description, image.detected_objects, image.text)
+            for image in images.iterator(chunk_size=CHUNK_SIZE)
+            if image.image
+        )
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options["workers"]) as pool:
+            # map забирает всё итерируемое сразу, поэтому задачи отдаются порциями
+            for chunk in iter(lambda: list(islice(items, CHUNK_SIZE)), []):
+                for error in pool.map(embed, chunk, chunksize=64):
+                    if error:
+                        failed += 1
+                        self.stdout.write(self.style.ERROR(f"❌ {error}"))
+                    else:
+                        done += 1
+                        if done % 1000 == 0:
+                            self.stdout.write(f"⏳ Обработано: {done}")
+
+        self.stdout.write(self.style.SUCCESS(f"🎉 Метаданные записаны: {done}, ошибок: {failed}"))
@@ -0,0 +1,50 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from detection.export import EXPORT_FORMATS, iter_export
+from detection.models import Image
+from detection.search import search
+from detection.tags import filter_by_tags
+
+
+class Command(BaseCommand):
+    help = "Выгружает каталог изображений в CSV или JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+        parser.add_argument("--output", help="Файл для выгрузки (по умолчанию stdout)")
+        parser.add_argument("--status", help="Только изображения с этим статусом обработки")
+        parser.add_argument("--search", help="Полнотекстовый запрос по описанию, объектам и тексту")
+        parser.add_argument("--tags", help="Теги объектов через запятую")
+        parser.add_argument("--tags-mode", choices=["or", "and"], default="or")
+        parser.add_argument("--since", help="Загружены не раньше даты (YYYY-MM-DD)")
+        parser.add_argument("--until", help="Загружены раньше даты (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        queryset = Image.objects.all()
+        if options["status"]:
+            queryset = queryset.filter(status=options["status"])
+        if options["since"]:
+            queryset = queryset.filter(upload_date__date__gte=options["since"])
+        if options["until"]:
+            queryset = queryset.filter(upload_date__date__lt=options["until"])
+        if options["tags"]:
+            names = [name.strip() for name in options["tags"].split(",") if name.strip()]
+            queryset = filter_by_tags(queryset, names, options["tags_mode"])
+        if options["search"]:
+            queryset = search(queryset, options["search"])
+
+        try:
+            output = open(options["output"], "w", encoding="utf-8", newline="") if options["output"] else sys.stdout
+        except OSError as e:
+            raise CommandError(f"Не удалось открыть {options['output']}: {e}")
+        try:
+            for chunk in iter_export(queryset, options["format"]):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        if options["output"]:
+            self.stdout.write(self.style.SUCCESS(f"🎉 Выгрузка сохранена в {options['output']}"))
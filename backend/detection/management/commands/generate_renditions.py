@@ -0,0 +1,43 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from detection.models import Image
+from detection.renditions import ensure_renditions
+
+
+CHUNK_SIZE = 1000  # Изображений в памяти и задач в очереди пула одновременно
+
+
+class Command(BaseCommand):
+    help = "Создаёт превью для существующих изображений"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Потоков для обработки")
+        parser.add_argument("--force", action="store_true", help="Пересоздать уже существующие превью")
+
+    def handle(self, *args, **options):
+        images = Image.objects.only("id", "image").iterator(chunk_size=CHUNK_SIZE)
+        done = failed = 0
+
+        def process(image):
+            try:
+                ensure_renditions(image, force=options["force"])
+                return None
+            except (OSError, ValueError) as e:
+                return f"{image.image.name}: {e}"
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            # map забирает всё итерируемое сразу, поэтому задачи отдаются порциями
+            for chunk in iter(lambda: list(islice(images, CHUNK_SIZE)), []):
+                for error in pool.map(process, chunk):
+                    if error:
+                        failed += 1
+                        self.stdout.write(self.style.ERROR(f"❌ {error}"))
+                    else:
+                        done += 1
+                        if done % 1000 == 0:
+                            self.stdout.write(f"⏳ Обработано: {done}")
+
+        self.stdout.write(self.style.SUCCESS(f"🎉 Превью готовы: {done}, ошибок: {failed}"))
@@ -1,52 +1,208 @@
+import hashlib
 import os
-import requests
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import BytesIO
+
 from django.core.management.base import BaseCommand
 from django.conf import settings
+from django.db import transaction
+
+from detection.embeddings import get_store, save_embedding
+from detection.inference_client import InferenceClient, InferenceError
+from detection.jobs import FIELD_STAGES, inference_options, source_tags
 from detection.models import Image
+from detection.similarity import dhash, find_duplicate, from_db, get_index, to_db
+from detection.tags import add_tags_bulk, tags_from_response
 
-FASTAPI_URL = "http://127.0.0.1:8001/upload/"  # URL FastAPI сервиса
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
 
 
 class Command(BaseCommand):
     help = "Обрабатывает изображения из папки dataset/ и добавляет их в базу данных"
 
-    def handle(self, *args, **kwargs):
-        dataset_path = os.path.join(settings.BASE_DIR, "dataset")  # Папка с датасетом
+    def add_arguments(self, parser):
+        parser.add_argument("--path", default=os.path.join(settings.BASE_DIR, "dataset"),
+                            help="Папка с датасетом")
+        parser.add_argument("--backends", help="Реплики сервиса инференса через запятую (по умолчанию INFERENCE_BACKENDS)")
+        parser.add_argument("--workers", type=int, default=4, help="Одновременных запросов к сервису")
+        parser.add_argument("--batch-size", type=int, default=100, help="Записей в одной транзакции bulk_create")
+        parser.add_argument("--recursive", action="store_true", help="Обходить вложенные папки")
+        parser.add_argument("--stages", help="Стадии инференса через запятую, например caption,ocr")
+        parser.add_argument("--no-translate", action="store_true", help="Не переводить описание и объекты")
+        parser.add_argument("--no-spelling", action="store_true", help="Не исправлять орфографию текста")
+        parser.add_argument("--text-lang", help="Язык текста на изображениях для исправления орфографии")
+        parser.add_argument("--reuse-distance", type=int, default=settings.PHASH_REUSE_DISTANCE,
+                            help="Порог расстояния dHash для переиспользования метаданных копий; -1 — выключено")
+
+    def handle(self, *args, **options):
+        dataset_path = options["path"]  # Папка с датасетом
 
         if not os.path.exists(dataset_path):
             self.stdout.write(self.style.ERROR(f"Папка {dataset_path} не найдена!"))
             return
 
-        images = [f for f in os.listdir(dataset_path) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        images = self.scan(dataset_path, options["recursive"])
 
         if not images:
-            self.stdout.write(self.style.WARNING("В папке dataset/ нет изображений"))
+            self.stdout.write(self.style.WARNING(f"В папке {dataset_path} нет изображений"))
+            return
+
+        self.prefix = self.storage_prefix(dataset_path)
+        # Чекпоинт: пропускаем файлы, уже загруженные в прошлых запусках
+        known_paths = set(Image.objects.filter(image__startswith=self.prefix).values_list("image", flat=True))
+        self.known_hashes = set(Image.objects.exclude(content_hash="").values_list("content_hash", flat=True))
+        pending = [name for name in images if self.prefix + name not in known_paths]
+        self.stdout.write(f"📷 Найдено изображений: {len(images)}, уже в БД: {len(images) - len(pending)}")
+
+        backends = options["backends"].split(",") if options["backends"] else None
+        self.client = InferenceClient(backends, pool_size=options["workers"])
+        self.params = inference_options({
+            "stages": options["stages"],
+            "translate": "false" if options["no_translate"] else None,
+            "spelling": "false" if options["no_spelling"] else None,
+            "text_lang": options["text_lang"],
+        })
+        # Метаданные копий переиспользуются только при обработке с параметрами по умолчанию
+        self.reuse_distance = options["reuse_distance"] if not self.params else -1
+        self.batch = []
+        self.batch_size = options["batch_size"]
+        self.created = self.skipped = self.failed = self.reused = 0
+        started = time.perf_counter()
+
+        try:
+            with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+                window = options["workers"] * 4  # Не держим в памяти задачи на весь датасет
+                names = iter(pending)
+                running = set()
+                done_count = 0
+                while True:
+                    for name in names:
+                        running.add(pool.submit(self.process, dataset_path, name))
+                        if len(running) >= window:
+                            break
+                    if not running:
+                        break
+
+                    finished, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self.collect(future.result())
+                        done_count += 1
+                        if done_count % self.batch_size == 0:
+                            self.report(done_count, len(pending), started)
+        finally:
+            # Уже обработанное сохраняется и при прерывании (Ctrl+C, ошибка БД)
+            self.flush()
+        self.report(len(pending), len(pending), started)
+        self.stdout.write(self.style.SUCCESS(
+            f"🎉 Обработка завершена! Добавлено: {self.created} (из них копий: {self.reused}), "
+            f"дубликатов: {self.skipped}, ошибок: {self.failed}"))
+
+    def scan(self, dataset_path, recursive):
+        """Относительные пути изображений в папке датасета."""
+        if not recursive:
+            return sorted(f for f in os.listdir(dataset_path) if f.lower().endswith(IMAGE_EXTENSIONS))
+
+        images = []
+        for root, _, files in os.walk(dataset_path):
+            for f in files:
+                if f.lower().endswith(IMAGE_EXTENSIONS):
+                    images.append(os.path.relpath(os.path.join(root, f), dataset_path).replace(os.sep, "/"))
+        return sorted(images)
+
+    @staticmethod
+    def storage_prefix(dataset_path):
+        """Префикс имён файлов в БД: путь от MEDIA_ROOT или, вне его, имя папки датасета."""
+        dataset_path = os.path.abspath(dataset_path)
+        media_root = os.path.abspath(settings.MEDIA_ROOT)
+        if os.path.commonpath([dataset_path, media_root]) == media_root and dataset_path != media_root:
+            relative = os.path.relpath(dataset_path, media_root)
+        else:
+            relative = os.path.basename(dataset_path.rstrip(os.sep))
+        return relative.replace(os.sep, "/") + "/"
+
+    def process(self, dataset_path, img_name):
+        """Выполняется в потоке пула; ошибка одного файла не прерывает обработку остальных."""
+        try:
+            return self.process_file(dataset_path, img_name)
+        except InferenceError as e:
+            return img_name, None, None, None, str(e)
+        except Exception as e:
+            return img_name, None, None, None, f"{type(e).__name__}: {e}"
+
+    def process_file(self, dataset_path, img_name):
+        """Читает файл, считает хэши и запрашивает метаданные.
+
+        Для почти-дубликата уже обработанного изображения метаданные берутся
+        из БД без обращения к сервису.
+        """
+        with open(os.path.join(dataset_path, img_name), "rb") as img_file:
+            content = img_file.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash in self.known_hashes:
+            return img_name, content_hash, None, None, None
+
+        try:
+            phash = dhash(BytesIO(content))
+        except (OSError, ValueError):
+            phash = None  # Файл не разобрался локально — решит сервис инференса
+        if phash is not None and self.reuse_distance >= 0:
+            source = find_duplicate(phash, self.reuse_distance)
+            if source is not None:
+                data = {field: getattr(source, field) for field in FIELD_STAGES}
+                data["model_versions"] = source.model_versions
+                data.update(tags=source_tags(source), embedding=get_store().get(source.pk))
+                return img_name, content_hash, phash, data, None
+
+        data = self.client.upload((os.path.basename(img_name), content), self.params)
+        return img_name, content_hash, phash, data, None
+
+    def collect(self, result):
+        img_name, content_hash, phash, data, error = result
+        if error:
+            self.failed += 1
+            self.stdout.write(self.style.ERROR(f"❌ {img_name}: {error}"))
+            return
+        if data is None or content_hash in self.known_hashes:
+            self.skipped += 1
+            return
+
+        self.known_hashes.add(content_hash)
+        if "tags" in data:
+            self.reused += 1
+            tags = data["tags"]
+        else:
+            tags = tags_from_response(data)
+        self.batch.append((Image(
+            image=self.prefix + img_name,  # Сохраняем путь относительно MEDIA_ROOT
+            description=data.get("description", ""),
+            detected_objects=data.get("detected_objects", ""),
+            text=data.get("text", ""),
+            content_hash=content_hash,
+            perceptual_hash=to_db(phash) if phash is not None else None,
+            model_versions=data.get("model_versions") or {},
+        ), tags, data.get("embedding")))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
             return
+        with transaction.atomic():
+            created = Image.objects.bulk_create([image for image, _, _ in self.batch], batch_size=self.batch_size)
+            add_tags_bulk([(image.pk, tags) for image, (_, tags, _) in zip(created, self.batch)])
+        for image, (_, _, embedding) in zip(created, self.batch):
+            save_embedding(image.pk, embedding)
+        # bulk_create не отправляет post_save, поэтому индекс хэшей пополняется здесь
+        index = get_index()
+        for image in created:
+            if image.perceptual_hash is not None:
+                index.add(image.pk, from_db(image.perceptual_hash))
+        self.created += len(self.batch)
+        self.batch = []
 
-        for img_name in images:
-            img_path = os.path.join(dataset_path, img_name)
-            self.stdout.write(f"📷 Обрабатываю: {img_name}")
-
-            with open(img_path, "rb") as img_file:
-                files = {"image": img_file}
-                try:
-                    response = requests.post(FASTAPI_URL, files=files)
-                    if response.status_code == 200:
-                        data = response.json()
-
-                        # Создаём запись в БД
-                        Image.objects.create(
-                            image=f"dataset/{img_name}",  # Сохраняем относительный путь
-                            description=data.get("description", ""),
-                            detected_objects=data.get("detected_objects", ""),
-                            text=data.get("text", "")
-                        )
-
-                        self.stdout.write(self.style.SUCCESS(f"✅ Добавлено в БД: {img_name}"))
-                    else:
-                        self.stdout.write(
-                            self.style.ERROR(f"❌ Ошибка FastAPI ({response.status_code}): {response.text}"))
-                except requests.RequestException as e:
-                    self.stdout.write(self.style.ERROR(f"❌ Ошибка запроса: {e}"))
-
-        self.stdout.write(self.style.SUCCESS("🎉 Обработка завершена!"))
+    def report(self, done, total, started):
+        elapsed = time.perf_counter() - started
+        rate = done / elapsed if elapsed else 0.0
+        eta = (total - done) / rate if rate else 0.0
+        self.stdout.write(f"⏳ {done}/{total} ({rate:.1f} изобр./с, осталось ~{eta:.0f} с)")
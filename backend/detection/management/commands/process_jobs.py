@@ -0,0 +1,80 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from detection.jobs import claim_job, requeue_stale_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = "Воркер очереди: отправляет загруженные изображения в сервис инференса"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=settings.INFERENCE_WORKER_CONCURRENCY,
+                            help="Сколько изображений обрабатывать одновременно")
+        parser.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Пауза в секундах, когда очередь пуста")
+        parser.add_argument("--once", action="store_true",
+                            help="Обработать текущую очередь и завершиться")
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"]
+        self.requeue()
+        self.stdout.write(f"🚀 Воркер запущен, потоков: {concurrency}")
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            workers = {pool.submit(self.work, options) for _ in range(concurrency)}
+            # Пока потоки работают, основной периодически возвращает в очередь зависшие задачи
+            while workers:
+                done, workers = wait(workers, timeout=settings.INFERENCE_JOB_REQUEUE_INTERVAL,
+                                     return_when=FIRST_COMPLETED)
+                for worker in done:
+                    worker.result()
+                if workers:
+                    self.requeue()
+        self.stdout.write(self.style.SUCCESS("🎉 Очередь обработана!"))
+
+    def requeue(self):
+        try:
+            requeued = requeue_stale_jobs()
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f"❌ Не удалось вернуть зависшие задачи: {type(e).__name__}: {e}"))
+            return
+        finally:
+            close_old_connections()
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"♻️ Возвращено в очередь зависших задач: {requeued}"))
+
+    def work(self, options):
+        try:
+            while True:
+                try:
+                    job = claim_job()
+                except Exception as e:
+                    # Например, «database is locked» на SQLite: пробуем снова после паузы
+                    self.stdout.write(self.style.ERROR(f"❌ Не удалось взять задачу: {type(e).__name__}: {e}"))
+                    close_old_connections()
+                    time.sleep(options["poll_interval"])
+                    continue
+                if job is None:
+                    if options["once"]:
+                        return
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                try:
+                    ok = run_job(job)
+                except Exception as e:
+                    # Не удалось даже записать неудачу: задачу вернёт в очередь requeue_stale_jobs
+                    self.stdout.write(self.style.ERROR(
+                        f"❌ Изображение {job.image_id}: {type(e).__name__}: {e}"))
+                    close_old_connections()
+                    continue
+                if ok:
+                    self.stdout.write(self.style.SUCCESS(f"✅ Обработано изображение {job.image_id}"))
+                else:
+                    self.stdout.write(self.style.ERROR(
+                        f"❌ Изображение {job.image_id}, попытка {job.attempts}: {job.last_error}"))
+        finally:
+            close_old_connections()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from detection.search import is_supported, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Перестраивает полнотекстовый индекс по описанию, объектам и тексту изображений"
+
+    def handle(self, *args, **kwargs):
+        if not is_supported():
+            self.stdout.write(self.style.WARNING("Полнотекстовый индекс FTS5 доступен только для SQLite"))
+            return
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("🎉 Индекс перестроен!"))
@@ -0,0 +1,234 @@
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from detection.inference_client import InferenceClient, InferenceError
+from detection.jobs import FIELD_STAGES, assign_metadata, store_results
+from detection.models import Image, ProcessingStatus
+
+OVERLOAD_PAUSE = 5  # Секунд паузы после отказа перегруженного сервиса
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает только устаревшие стадии изображений после обновления моделей сервиса инференса"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--backends", help="Реплики сервиса инференса через запятую (по умолчанию INFERENCE_BACKENDS)")
+        parser.add_argument("--stages", help="Рассматривать только эти стадии, через запятую")
+        parser.add_argument("--batch-size", type=int, default=16, help="Изображений в одном запросе /upload/batch/")
+        parser.add_argument("--workers", type=int, default=4, help="Максимум одновременных запросов")
+        parser.add_argument("--max-batch-seconds", type=float, default=30,
+                            help="Целевое время запроса: дольше — число одновременных запросов уменьшается")
+        parser.add_argument("--max-rate", type=float, default=0, help="Максимум изображений в секунду; 0 — без ограничения")
+        parser.add_argument("--after-id", type=int, default=0, help="Начать с изображений с id больше указанного")
+        parser.add_argument("--max-retries", type=int, default=5,
+                            help="Повторов изображения после отказа перегруженного сервиса")
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать устаревшие стадии")
+
+    def handle(self, *args, **options):
+        backends = options["backends"].split(",") if options["backends"] else None
+        self.client = InferenceClient(backends, pool_size=options["workers"])
+        current = self.current_versions(options["stages"])
+        self.stdout.write("🔖 Версии стадий: " + ", ".join(f"{stage}={version}" for stage, version in current.items()))
+
+        images = (
+            Image.objects.filter(status=ProcessingStatus.DONE, id__gt=options["after_id"])
+            .only("id", "image", "model_versions", *FIELD_STAGES).order_by("id")
+        )
+        if options["dry_run"]:
+            self.dry_run(images, current)
+            return
+
+        self.batch_size = options["batch_size"]
+        self.max_batch_seconds = options["max_batch_seconds"]
+        self.window = self.max_window = options["workers"]
+        self.max_rate = options["max_rate"]
+        self.max_retries = options["max_retries"]
+        self.groups = defaultdict(list)  # Набор устаревших стадий -> изображения, ждущие отправки
+        self.retry = []
+        self.updated = self.failed = self.sent = 0
+        self.started = time.perf_counter()
+
+        self.scanned_id = options["after_id"]
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            self.running = {}
+            for image in self.scan(images):
+                self.scanned_id = image.id
+                stale = self.stale_stages(image, current)
+                if not stale:
+                    continue
+                group = self.groups[stale]
+                group.append(image)
+                if len(group) >= self.batch_size:
+                    self.submit(pool, stale, self.groups.pop(stale))
+            # Досылаем неполные группы и повторы после перегрузки сервиса
+            while self.groups or self.retry or self.running:
+                if self.retry:
+                    self.submit(pool, *self.retry.pop())
+                elif self.groups:
+                    self.submit(pool, *self.groups.popitem())
+                else:
+                    self.wait_one()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"🎉 Пересчёт завершён! Обновлено: {self.updated}, ошибок: {self.failed}"))
+
+    def current_versions(self, stages):
+        try:
+            current = self.client.versions()
+        except InferenceError as e:
+            raise CommandError(f"Не удалось получить версии стадий сервиса: {e}")
+        if stages:
+            selected = {stage.strip() for stage in stages.split(",") if stage.strip()}
+            unknown = selected - set(current)
+            if unknown:
+                raise CommandError(f"Сервис не выполняет стадии: {', '.join(sorted(unknown))}")
+            current = {stage: version for stage, version in current.items() if stage in selected}
+        return current
+
+    @staticmethod
+    def scan(images, page_size=1000):
+        """Обход по страницам ключа ``id``: между страницами команда пишет в ту же БД."""
+        last_id = 0
+        while True:
+            page = list(images.filter(id__gt=last_id)[:page_size])
+            yield from page
+            if len(page) < page_size:
+                return
+            last_id = page[-1].id
+
+    @staticmethod
+    def stale_stages(image, current):
+        versions = image.model_versions or {}
+        return tuple(sorted(stage for stage, version in current.items() if versions.get(stage) != version))
+
+    def dry_run(self, images, current):
+        counts = defaultdict(int)
+        total = 0
+        for image in self.scan(images):
+            total += 1
+            stale = self.stale_stages(image, current)
+            if stale:
+                counts[stale] += 1
+        stage_runs = sum(len(stale) * count for stale, count in counts.items())
+        for stale, count in sorted(counts.items(), key=lambda item: -item[1]):
+            self.stdout.write(f"  {','.join(stale)}: {count}")
+        share = stage_runs / (total * len(current)) if total and current else 0.0
+        self.stdout.write(self.style.SUCCESS(
+            f"🎉 Изображений: {total}, требуют пересчёта: {sum(counts.values())}, "
+            f"это {share:.0%} от полного прогона"))
+
+    def submit(self, pool, stale, images, attempt=0):
+        while len(self.running) >= self.window:
+            self.wait_one()
+        if self.max_rate:
+            # Не отправляем быстрее --max-rate изображений в секунду
+            delay = self.sent / self.max_rate - (time.perf_counter() - self.started)
+            if delay > 0:
+                time.sleep(delay)
+        self.sent += len(images)
+        self.running[pool.submit(self.send, stale, images)] = (stale, images, attempt)
+
+    def send(self, stale, images):
+        """Выполняется в потоке пула: отправляет батч и возвращает ``(код, результаты, секунды)``."""
+        files = []
+        try:
+            for image in images:
+                files.append((image.image.name, open(image.image.path, "rb")))
+            started = time.perf_counter()
+            results = self.client.upload_batch(files, {"stages": ",".join(stale)})
+            return 200, results, time.perf_counter() - started
+        except InferenceError as e:
+            return e.status, str(e), 0.0
+        except OSError as e:
+            return None, str(e), 0.0
+        finally:
+            for _, f in files:
+                f.close()
+
+    def wait_one(self):
+        done, _ = wait(self.running, return_when=FIRST_COMPLETED)
+        for future in done:
+            stale, images, attempt = self.running.pop(future)
+            status, results, seconds = future.result()
+            if status == 503:
+                self.overloaded(stale, images, attempt)
+                continue
+            if status != 200:
+                self.failed += len(images)
+                self.stdout.write(self.style.ERROR(f"❌ Батч из {len(images)} изображений: {results}"))
+                continue
+
+            rejected = self.apply(images, results)
+            if rejected:
+                # Часть изображений не принята из-за переполнения очереди — та же перегрузка, что и 503
+                self.overloaded(stale, rejected, attempt)
+            elif seconds > self.max_batch_seconds:
+                self.window = max(1, self.window // 2)
+            elif self.window < self.max_window:
+                self.window += 1
+            self.report()
+
+    def overloaded(self, stale, images, attempt):
+        """Сервис перегружен: вдвое меньше параллельных запросов и повтор после паузы."""
+        self.window = max(1, self.window // 2)
+        if attempt >= self.max_retries:
+            self.failed += len(images)
+            self.stdout.write(self.style.ERROR(
+                f"❌ {len(images)} изображений не обработаны: сервис перегружен после {attempt} повторов"))
+            return
+        self.retry.append((stale, images, attempt + 1))
+        time.sleep(OVERLOAD_PAUSE)
+
+    def apply(self, images, results):
+        """Обновляет изображения батча одним bulk_update; теги, эмбеддинги и файлы — по одному.
+
+        Возвращает изображения, которые сервис не принял из-за перегрузки.
+        """
+        done = []
+        rejected = []
+        fields = set()
+        for result in results:
+            image = images[result["index"]]
+            if result.get("status") == 503:
+                rejected.append(image)
+                continue
+            if "error" in result:
+                self.failed += 1
+                self.stdout.write(self.style.ERROR(f"❌ {image.image.name}: {result['error']}"))
+                continue
+            fields.update(assign_metadata(image, result))
+            done.append((image, result))
+        if not done:
+            return rejected
+
+        with transaction.atomic():
+            Image.objects.bulk_update([image for image, _ in done], sorted(fields))
+        for image, result in done:
+            try:
+                store_results(image, result)
+            except (OSError, ValueError) as e:
+                self.stdout.write(self.style.WARNING(f"⚠️ {image.image.name}: метаданные файла не записаны: {e}"))
+        self.updated += len(done)
+        return rejected
+
+    def checkpoint(self):
+        """Все изображения с id не больше этого уже обработаны: значение для ``--after-id``."""
+        unfinished = [
+            image.id
+            for batch in [*self.groups.values(), *(images for _, images, _ in self.retry),
+                          *(images for _, images, _ in self.running.values())]
+            for image in batch
+        ]
+        return min(unfinished) - 1 if unfinished else self.scanned_id
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.updated / elapsed if elapsed else 0.0
+        self.stdout.write(
+            f"⏳ Обновлено: {self.updated}, ошибок: {self.failed} ({rate:.1f} изобр./с, "
+            f"параллельных запросов: {self.window}, продолжить можно с --after-id {self.checkpoint()})"
+        )
@@ -0,0 +1,200 @@
+"""Запись метаданных в файл изображения без перекодирования пикселей.
+
+Для JPEG заменяется только сегмент APP1 (EXIF), для PNG — текстовый чанк
+``ImageDescription``; остальные сегменты (в том числе APP0 JFIF с
+плотностью пикселей) и скан-данные копируются байт в байт. Файл
+подменяется атомарно через временный файл в той же папке. Прочие форматы
+по-прежнему пересохраняются через PIL.
+"""
+import os
+import struct
+import tempfile
+import zlib
+
+import piexif
+from PIL import Image
+
+JPEG_SIGNATURE = b'\xff\xd8'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_TEXT_KEY = b'ImageDescription'
+MAX_EXIF_SIZE = 65533  # Максимальный размер данных сегмента APP1
+
+
+def format_metadata(description, list_of_objects, text):
+    if list_of_objects is None:
+        list_of_objects = []  # Детекция не выполнялась
+    elif isinstance(list_of_objects, str):
+        list_of_objects = [list_of_objects]  # Приводим к списку, если строка
+
+    return (
+        f"description: {description}\n"
+        f"objects: {', '.join(list_of_objects)}\n"
+        f"text: {text if text else 'No text detected'}"
+    )
+
+
+def atomic_write(path, data):
+    """Записывает файл целиком во временный файл и подменяет им исходный."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def jpeg_with_description(data, description):
+    """Возвращает JPEG с новым ImageDescription в EXIF; скан-данные не меняются."""
+    try:
+        exif_dict = piexif.load(data)
+    except (ValueError, struct.error):
+        exif_dict = {'0th': {}, 'Exif': {}, 'GPS': {}, 'Interop': {}, '1st': {}, 'thumbnail': None}
+
+    encoded = description.encode('utf-8')
+    exif_dict['0th'][piexif.ImageIFD.ImageDescription] = encoded
+    exif_bytes = piexif.dump(exif_dict)
+    if len(exif_bytes) > MAX_EXIF_SIZE:
+        # Не помещается в один сегмент: обрезаем описание и убираем миниатюру EXIF
+        exif_dict['thumbnail'] = None
+        exif_dict['1st'] = {}
+        overflow = len(piexif.dump(exif_dict)) - MAX_EXIF_SIZE
+        if overflow > 0:
+            exif_dict['0th'][piexif.ImageIFD.ImageDescription] = (
+                encoded[:len(encoded) - overflow].decode('utf-8', 'ignore').encode('utf-8'))
+        exif_bytes = piexif.dump(exif_dict)
+
+    return splice_app1(data, exif_bytes)
+
+
+def jpeg_segments(data):
+    """Сегменты JPEG до начала скан-данных: список ``(маркер, байты сегмента)`` и смещение SOS."""
+    segments = []
+    pos = len(JPEG_SIGNATURE)
+    while pos < len(data):
+        if data[pos] != 0xFF:
+            raise ValueError("Повреждённый JPEG: ожидался маркер сегмента")
+        marker = data[pos + 1] if pos + 1 < len(data) else None
+        if marker == 0xFF:  # Байт-заполнитель перед маркером
+            pos += 1
+            continue
+        if marker in (0xDA, 0xD9) or marker is None:  # SOS, EOI: дальше копируем как есть
+            return segments, pos
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # Маркеры без длины
+            segments.append((marker, data[pos:pos + 2]))
+            pos += 2
+            continue
+        if pos + 4 > len(data):
+            raise ValueError("Повреждённый JPEG: обрезан заголовок сегмента")
+        length, = struct.unpack('>H', data[pos + 2:pos + 4])
+        end = pos + 2 + length
+        if length < 2 or end > len(data):
+            raise ValueError("Повреждённый JPEG: неверная длина сегмента")
+        segments.append((marker, data[pos:end]))
+        pos = end
+    return segments, pos
+
+
+def is_exif_segment(marker, segment):
+    return marker == 0xE1 and segment[4:10] == b'Exif\x00\x00'
+
+
+def splice_app1(data, exif_bytes):
+    """Заменяет (или вставляет после APP0) сегмент APP1 EXIF; остальные байты не меняются."""
+    segments, scan_start = jpeg_segments(data)
+    app1 = b'\xff\xe1' + struct.pack('>H', len(exif_bytes) + 2) + exif_bytes
+    output = [JPEG_SIGNATURE]
+    replaced = False
+    for marker, segment in segments:
+        if is_exif_segment(marker, segment):
+            if not replaced:
+                output.append(app1)
+                replaced = True
+            continue  # Лишние копии EXIF удаляются, чтобы описание было однозначным
+        output.append(segment)
+    if not replaced:
+        # По JFIF сегмент APP0 идёт первым, поэтому EXIF ставится сразу за ним
+        position = 1
+        for marker, _ in segments:
+            if marker != 0xE0:
+                break
+            position += 1
+        output.insert(position, app1)
+    output.append(data[scan_start:])
+    return b''.join(output)
+
+
+def png_text_chunk(keyword, text):
+    """Чанк iTXt с несжатым текстом в UTF-8."""
+    body = keyword + b'\x00' + b'\x00\x00' + b'\x00' + b'\x00' + text.encode('utf-8')
+    return struct.pack('>I', len(body)) + b'iTXt' + body + struct.pack('>I', zlib.crc32(b'iTXt' + body))
+
+
+def png_with_description(data, description):
+    """Возвращает PNG с новым текстовым чанком ImageDescription; IDAT не меняются."""
+    chunks = [PNG_SIGNATURE]
+    pos = len(PNG_SIGNATURE)
+    inserted = False
+    while pos < len(data):
+        if pos + 12 > len(data):
+            raise ValueError("Повреждённый PNG: обрезан заголовок чанка")
+        length, = struct.unpack('>I', data[pos:pos + 4])
+        chunk_type = data[pos + 4:pos + 8]
+        end = pos + 12 + length
+        if end > len(data):
+            raise ValueError(f"Повреждённый PNG: чанк {chunk_type!r} выходит за конец файла")
+        chunk = data[pos:end]
+        chunk_data = data[pos + 8:pos + 8 + length]
+        is_old_description = (
+            chunk_type in (b'tEXt', b'iTXt', b'zTXt')
+            and chunk_data.split(b'\x00', 1)[0] == PNG_TEXT_KEY
+        )
+        if not is_old_description:
+            chunks.append(chunk)
+        if chunk_type == b'IHDR' and not inserted:
+            chunks.append(png_text_chunk(PNG_TEXT_KEY, description))
+            inserted = True
+        pos = end
+        if chunk_type == b'IEND':
+            break
+    if not inserted:
+        raise ValueError("Повреждённый PNG: нет чанка IHDR")
+    return b''.join(chunks)
+
+
+def write_metadata(image_path, description, list_of_objects, text):
+    """Записывает метаданные в EXIF (JPEG) или текстовый чанк (PNG) изображения."""
+    combined_metadata = format_metadata(description, list_of_objects, text)
+
+    with open(image_path, 'rb') as f:
+        data = f.read()
+
+    if data.startswith(JPEG_SIGNATURE):
+        atomic_write(image_path, jpeg_with_description(data, combined_metadata))
+    elif data.startswith(PNG_SIGNATURE):
+        atomic_write(image_path, png_with_description(data, combined_metadata))
+    else:
+        write_metadata_reencode(image_path, combined_metadata)
+
+
+def write_metadata_reencode(image_path, combined_metadata):
+    """Запись через пересохранение PIL для форматов без поддержки вставки (TIFF и др.)."""
+    img = Image.open(image_path)
+    img_format = img.format
+
+    try:
+        if img_format == 'TIFF':
+            exif_dict = piexif.load(img.info.get('exif', b''))
+            exif_dict['0th'][piexif.ImageIFD.ImageDescription] = combined_metadata.encode('utf-8')
+            exif_bytes = piexif.dump(exif_dict)
+            img.save(image_path, exif=exif_bytes, format=img_format)
+
+        else:
+            img.info['ImageDescription'] = combined_metadata
+            img.save(image_path, format=img_format)
+
+    finally:
+        img.close()
@@ -1,11 +1,67 @@
 from django.db import models
 
+
+class ProcessingStatus(models.TextChoices):
+    PENDING = 'pending', 'В очереди'
+    PROCESSING = 'processing', 'Обрабатывается'
+    DONE = 'done', 'Готово'
+    FAILED = 'failed', 'Ошибка'
+
+
 class Image(models.Model):
     image = models.ImageField(upload_to='images/')  # Файл изображения
     upload_date = models.DateTimeField(auto_now_add=True)  # Автоматическая дата загрузки
     description = models.TextField(blank=True, null=True)  # Описание изображения
     detected_objects = models.TextField(blank=True, null=True)  # Обнаруженные объекты
     text = models.TextField(blank=True, null=True)  # Переведённый текст
+    status = models.CharField(
+        max_length=16, choices=ProcessingStatus.choices, default=ProcessingStatus.DONE, db_index=True
+    )  # Статус обработки нейросетью
+    content_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)  # SHA-256 файла
+    perceptual_hash = models.BigIntegerField(null=True, blank=True, db_index=True)  # dHash для поиска похожих
+    model_versions = models.JSONField(blank=True, default=dict)  # Стадия -> версия моделей, давшая результат
+    tags = models.ManyToManyField('ObjectTag', through='ImageTag', related_name='images', blank=True)
+
+    def __str__(self):
+        return f"Image {self.id} uploaded on {self.upload_date}"
+
+
+class ObjectTag(models.Model):
+    """Класс объекта, найденный детектором (название как в ``detected_objects``)."""
+    name = models.CharField(max_length=100, unique=True)
+    image_count = models.PositiveIntegerField(default=0)  # Денормализованное число изображений с тегом
+
+    def __str__(self):
+        return self.name
+
+
+class ImageTag(models.Model):
+    """Связь изображения с классом объекта: сколько найдено и с какой уверенностью."""
+    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='image_tags')
+    tag = models.ForeignKey(ObjectTag, on_delete=models.CASCADE, related_name='image_tags')
+    count = models.PositiveIntegerField(default=1)  # Количество объектов этого класса
+    confidence = models.FloatField(null=True, blank=True)  # Максимальная уверенность детектора
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['image', 'tag'], name='unique_image_tag')]
+        indexes = [models.Index(fields=['tag', 'image'])]
+
+
+class InferenceJob(models.Model):
+    """Задача на получение метаданных изображения от сервиса инференса."""
+    image = models.OneToOneField(Image, on_delete=models.CASCADE, related_name='job')
+    status = models.CharField(
+        max_length=16, choices=ProcessingStatus.choices, default=ProcessingStatus.PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)  # Сколько раз уже пытались обработать
+    next_attempt_at = models.DateTimeField(auto_now_add=True)  # Не брать в работу раньше этого времени
+    last_error = models.TextField(blank=True, default='')
+    options = models.JSONField(blank=True, default=dict)  # Параметры инференса: stages, translate, ...
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
 
     def __str__(self):
-        return f"Image {self.id} uploaded on {self.upload_date}"
\ No newline at end of file
+        return f"Job for image {self.image_id}: {self.status}"
@@ -0,0 +1,40 @@
+from django.conf import settings
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+
+class ImageCursorPagination(CursorPagination):
+    """Keyset-пагинация по ``id``: без COUNT(*) и OFFSET, глубина страницы не влияет на скорость."""
+    ordering = "id"
+    page_size = settings.REST_FRAMEWORK["PAGE_SIZE"]
+    page_size_query_param = "page_size"
+    max_page_size = settings.IMAGES_MAX_PAGE_SIZE
+
+
+class ImagePageNumberPagination(PageNumberPagination):
+    page_size_query_param = "page_size"
+    max_page_size = settings.IMAGES_MAX_PAGE_SIZE
+
+
+class ImagePagination(BasePagination):
+    """По умолчанию курсорная пагинация (``?cursor=``).
+
+    Номера страниц (``?page=``) оставлены для совместимости. Они же
+    используются при поиске (``?search=``), чтобы сохранить сортировку по
+    релевантности.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if "page" in request.query_params or request.query_params.get("search"):
+            self.paginator = ImagePageNumberPagination()
+        else:
+            self.paginator = ImageCursorPagination()
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return ImageCursorPagination().get_paginated_response_schema(schema)
+
+    def get_schema_operation_parameters(self, view):
+        return ImageCursorPagination().get_schema_operation_parameters(view)
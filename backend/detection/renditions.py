@@ -0,0 +1,56 @@
+"""Уменьшенные копии изображений (превью для списков и детального просмотра).
+
+Копии лежат рядом с оригиналами в ``MEDIA_ROOT/images/<вид>/`` и создаются
+при обработке изображения или лениво при первом запросе.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+
+def rendition_name(image_name, kind):
+    """Путь копии относительно MEDIA_ROOT; хэш пути исключает коллизии одинаковых имён."""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    digest = hashlib.sha1(image_name.encode("utf-8")).hexdigest()[:8]
+    return f"images/{kind}/{stem}-{digest}.jpg"
+
+
+def rendition_path(image_name, kind):
+    return os.path.join(settings.MEDIA_ROOT, rendition_name(image_name, kind))
+
+
+def create_rendition(source_path, target_path, size):
+    """Создаёт JPEG-копию не больше ``size``; запись атомарная через временный файл."""
+    with Image.open(source_path) as img:
+        # Для JPEG декодер сразу уменьшает изображение в 2–8 раз (draft mode)
+        img.draft("RGB", size)
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail(size)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                img.save(tmp, format="JPEG", quality=settings.RENDITION_QUALITY, optimize=True)
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def ensure_rendition(image, kind, force=False):
+    """Возвращает путь к копии вида ``kind``, создавая её при необходимости."""
+    target = rendition_path(image.image.name, kind)
+    source = image.image.path
+    if force or not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source):
+        create_rendition(source, target, settings.IMAGE_RENDITIONS[kind])
+    return target
+
+
+def ensure_renditions(image, force=False):
+    for kind in settings.IMAGE_RENDITIONS:
+        ensure_rendition(image, kind, force)
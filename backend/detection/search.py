@@ -0,0 +1,113 @@
+"""Полнотекстовый поиск по изображениям на SQLite FTS5.
+
+Индекс ``detection_image_fts`` хранит только токены (external content) и
+синхронизируется с таблицей ``detection_image`` триггерами, поэтому
+обновляется при любом сохранении, включая ``bulk_create``. На других СУБД
+поиск откатывается к ``icontains`` по тем же полям.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .models import Image
+
+SEARCH_FIELDS = ("description", "detected_objects", "text")
+FTS_TABLE = "detection_image_fts"
+
+# Окончания, которые отбрасываются у русских слов запроса; остаток ищется по префиксу
+RU_ENDINGS = sorted(
+    [
+        "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ах", "ях", "ов", "ев",
+        "ая", "яя", "ое", "ее", "ые", "ие", "ой", "ей", "ий", "ый", "ом", "ем", "ам", "ям",
+        "ию", "ью", "ия", "ья", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+    ],
+    key=len,
+    reverse=True,
+)
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+CYRILLIC_RE = re.compile(r"[а-яё]")
+
+
+def is_supported():
+    return connection.vendor == "sqlite"
+
+
+def ensure_search_index(using=None, **kwargs):
+    """Создаёт таблицу FTS5 и триггеры синхронизации, если их ещё нет."""
+    if not is_supported():
+        return
+    table = Image._meta.db_table
+    columns = ", ".join(SEARCH_FIELDS)
+    new_values = ", ".join(f"new.{field}" for field in SEARCH_FIELDS)
+    old_values = ", ".join(f"old.{field}" for field in SEARCH_FIELDS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"{columns}, content='{table}', content_rowid='id', "
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+        )
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+            f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_values}); END"
+        )
+
+
+def rebuild_search_index():
+    """Перестраивает индекс по текущему содержимому таблицы изображений."""
+    ensure_search_index()
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def stem(token):
+    """Упрощённый стемминг: отбрасывает типичное окончание русского слова."""
+    if not CYRILLIC_RE.search(token) or len(token) <= 4:
+        return token
+    for ending in RU_ENDINGS:
+        if token.endswith(ending) and len(token) - len(ending) >= 3:
+            return token[:-len(ending)]
+    return token
+
+
+def build_match_query(search_term):
+    """Превращает пользовательский запрос в выражение MATCH: все слова, поиск по префиксу."""
+    tokens = [stem(token) for token in TOKEN_RE.findall(search_term.lower())]
+    return " AND ".join(f'"{token}"*' for token in tokens if token)
+
+
+def search(queryset, search_term):
+    """Фильтрует queryset по запросу и, на SQLite, сортирует по релевантности (BM25)."""
+    if not is_supported():
+        condition = Q()
+        for word in search_term.split():
+            word_condition = Q()
+            for field in SEARCH_FIELDS:
+                word_condition |= Q(**{f"{field}__icontains": word})
+            condition &= word_condition
+        return queryset.filter(condition)
+
+    match = build_match_query(search_term)
+    if not match:
+        return queryset
+    table = Image._meta.db_table
+    return queryset.filter(
+        id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+    ).annotate(
+        search_rank=RawSQL(
+            f"SELECT bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND {FTS_TABLE}.rowid = {table}.id",
+            (match,),
+        )
+    ).order_by("search_rank", "id")
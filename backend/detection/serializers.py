@@ -1,8 +1,57 @@
 import requests
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import serializers
 from .models import Image
 
-class ImageSerializer(serializers.ModelSerializer):
+
+class SparseFieldsMixin:
+    """Оставляет в ответе только поля из параметра запроса ``?fields=id,description``."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.requested_fields(self.context.get("request"))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+    @classmethod
+    def requested_fields(cls, request):
+        if request is None or request.method != "GET" or not request.query_params.get("fields"):
+            return None
+        names = {name.strip() for name in request.query_params["fields"].split(",")}
+        return names & set(cls.Meta.fields) or None
+
+    @classmethod
+    def model_fields(cls, request):
+        """Поля модели для ``.only()``: сами запрошенные поля и то, из чего они вычисляются."""
+        requested = cls.requested_fields(request)
+        if requested is None:
+            return None
+        sources = getattr(cls.Meta, "field_sources", {})
+        return sorted({source for name in requested for source in sources.get(name, (name,))})
+
+
+class ImageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    thumbnail_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+
     class Meta:
         model = Image
-        fields = ('id', 'image', 'upload_date', 'description', 'detected_objects', 'text')
+        fields = ('id', 'image', 'upload_date', 'description', 'detected_objects', 'text', 'status',
+                  'thumbnail_url', 'preview_url')
+        read_only_fields = ('status',)
+        field_sources = {'thumbnail_url': ('image',), 'preview_url': ('image',)}
+
+    def rendition_url(self, obj, kind):
+        if not obj.image or kind not in settings.IMAGE_RENDITIONS:
+            return None
+        url = reverse('images-rendition', kwargs={'pk': obj.pk, 'kind': kind})
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_thumbnail_url(self, obj):
+        return self.rendition_url(obj, 'thumbnail')
+
+    def get_preview_url(self, obj):
+        return self.rendition_url(obj, 'preview')
@@ -0,0 +1,263 @@
+"""Перцептивные хэши изображений и поиск почти-дубликатов.
+
+dHash (64 бита) устойчив к пересжатию, изменению размера и небольшой
+цветокоррекции: у копий одного снимка расстояние Хэмминга между хэшами
+мало. Хэши лежат в ``Image.perceptual_hash``, а поиск идёт по индексу в
+памяти процесса (multi-index hashing): 64 бита делятся на 3 части, и если
+расстояние не больше ``r``, то хотя бы одна часть отличается не больше чем
+на ``r // 3`` бит. Кандидаты — изображения, у которых одна из частей
+совпадает с запросом с точностью до нескольких перевёрнутых бит; их ищут
+бинарным поиском по отсортированным массивам и проверяют только их.
+"""
+import threading
+import time
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+from django.conf import settings
+from PIL import Image as PILImage
+
+from .models import Image, ProcessingStatus
+
+HASH_BITS = 64
+# Ширины частей хэша: около log2 от числа изображений, чтобы корзины были маленькими
+CHUNK_WIDTHS = (22, 21, 21)
+CHUNK_SHIFTS = (0, 22, 43)
+# Сколько изменений копится в словаре, прежде чем массивы индекса перестраиваются
+MERGE_THRESHOLD = 2000
+# Число единичных битов в каждом байте — для NumPy < 2.0, где нет bitwise_count
+BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """Число единичных битов в каждом элементе массива uint64."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return BYTE_POPCOUNT[np.ascontiguousarray(values).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def dhash(source):
+    """dHash изображения (путь или файловый объект) как беззнаковое 64-битное число."""
+    with PILImage.open(source) as img:
+        # Для JPEG декодер сразу уменьшает изображение в 8 раз
+        img.draft("L", (64, 64))
+        pixels = list(img.convert("L").resize((9, 8), PILImage.Resampling.BOX).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            value = (value << 1) | (left > pixels[row * 9 + col + 1])
+    return value
+
+
+def to_db(value):
+    """Беззнаковый хэш в знаковое значение для ``BigIntegerField``."""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def from_db(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(width, radius):
+    """Маски, переворачивающие в части ширины ``width`` не больше ``radius`` бит."""
+    return np.array([
+        sum(1 << bit for bit in bits)
+        for flips in range(radius + 1)
+        for bits in combinations(range(width), flips)
+    ], dtype=np.uint64)
+
+
+class HashIndex:
+    """Индекс хэшей в памяти процесса.
+
+    Основная часть — неизменяемые массивы NumPy: хэши, id и для каждой части
+    хэша отсортированные значения с перестановкой. Новые и изменённые
+    изображения сначала попадают в словарь ``recent`` (он просматривается
+    целиком), удалённые — в ``removed``; когда изменений набирается
+    ``MERGE_THRESHOLD``, массивы перестраиваются.
+    """
+
+    def __init__(self):
+        self.ids = np.empty(0, dtype=np.int64)
+        self.values = np.empty(0, dtype=np.uint64)
+        self.keys = []
+        self.orders = []
+        self.recent = {}
+        self._recent_arrays = None  # Копия recent в массивах для векторного поиска
+        self.removed = set()
+        self.max_id = 0
+        self.refreshed_at = 0.0
+        self.lock = threading.RLock()
+        self._build(self.ids, self.values)
+
+    def __len__(self):
+        return len(self.ids) - len(self.removed) + len(self.recent)
+
+    def _build(self, ids, values):
+        # id держатся отсортированными, чтобы проверять наличие бинарным поиском
+        by_id = np.argsort(ids, kind="stable")
+        self.ids, self.values = ids[by_id], values[by_id]
+        self.keys, self.orders = [], []
+        for width, shift in zip(CHUNK_WIDTHS, CHUNK_SHIFTS):
+            chunk = (self.values >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+            order = np.argsort(chunk, kind="stable").astype(np.int32)
+            self.keys.append(chunk[order])
+            self.orders.append(order)
+
+    def _merge(self):
+        removed = np.fromiter(self.removed, dtype=np.int64, count=len(self.removed))
+        keep = ~np.isin(self.ids, removed)
+        ids = np.fromiter(self.recent, dtype=np.int64, count=len(self.recent))
+        values = np.fromiter(self.recent.values(), dtype=np.uint64, count=len(self.recent))
+        self.recent, self.removed, self._recent_arrays = {}, set(), None
+        self._build(np.concatenate([self.ids[keep], ids]), np.concatenate([self.values[keep], values]))
+
+    def _in_base(self, pk):
+        i = np.searchsorted(self.ids, pk)
+        return i < len(self.ids) and self.ids[i] == pk
+
+    def _add(self, pk, value):
+        if self._in_base(pk):
+            self.removed.add(pk)
+        self.recent[pk] = value
+        self._recent_arrays = None
+        self.max_id = max(self.max_id, pk)
+
+    def add(self, pk, value):
+        with self.lock:
+            self._add(pk, value)
+            if len(self.recent) + len(self.removed) >= MERGE_THRESHOLD:
+                self._merge()
+
+    def load(self, rows):
+        """Добавляет пары ``(id, хэш)`` пачкой и сразу перестраивает массивы."""
+        pairs = np.fromiter(rows, dtype=np.dtype([("id", np.int64), ("value", np.uint64)]))
+        if not len(pairs):
+            return
+        with self.lock:
+            for pk in pairs["id"].tolist():
+                self.recent.pop(pk, None)
+            self.removed.update(pairs["id"][np.isin(pairs["id"], self.ids)].tolist())
+            self._merge()
+            self._build(np.concatenate([self.ids, pairs["id"]]), np.concatenate([self.values, pairs["value"]]))
+            self.max_id = max(self.max_id, int(pairs["id"].max()))
+
+    def remove(self, pk):
+        with self.lock:
+            self.recent.pop(pk, None)
+            self._recent_arrays = None
+            if self._in_base(pk):
+                self.removed.add(pk)
+
+    def search(self, value, max_distance, limit=None, exclude=None):
+        """Пары ``(id, расстояние)`` не дальше ``max_distance``, ближайшие первыми."""
+        radius = max_distance // len(CHUNK_WIDTHS)
+        query = np.uint64(value)
+        with self.lock:
+            positions = []
+            for width, shift, keys, order in zip(CHUNK_WIDTHS, CHUNK_SHIFTS, self.keys, self.orders):
+                chunk = (query >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+                probes = chunk ^ _flip_masks(width, radius)
+                lo = np.searchsorted(keys, probes, side="left")
+                counts = np.searchsorted(keys, probes, side="right") - lo
+                hit = counts > 0
+                if hit.any():
+                    # Склеиваем диапазоны [lo, lo + count) всех найденных корзин без цикла
+                    lo, counts = lo[hit], counts[hit]
+                    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                    positions.append(order[np.repeat(lo, counts) + offsets])
+
+            matches = []
+            if positions:
+                candidates = np.unique(np.concatenate(positions))
+                matches += [
+                    (distance, pk) for distance, pk in self._close(
+                        self.ids[candidates], self.values[candidates], query, max_distance
+                    ) if pk not in self.removed
+                ]
+            if self.recent:
+                if self._recent_arrays is None:
+                    self._recent_arrays = (
+                        np.fromiter(self.recent, dtype=np.int64, count=len(self.recent)),
+                        np.fromiter(self.recent.values(), dtype=np.uint64, count=len(self.recent)),
+                    )
+                matches += self._close(*self._recent_arrays, query, max_distance)
+        matches = sorted((distance, pk) for distance, pk in matches if pk != exclude)
+        return [(pk, distance) for distance, pk in matches[:limit]]
+
+    @staticmethod
+    def _close(ids, values, query, max_distance):
+        """Пары ``(расстояние, id)`` для хэшей не дальше ``max_distance`` от запроса."""
+        distances = popcount(values ^ query)
+        close = distances <= max_distance
+        return list(zip(distances[close].tolist(), ids[close].tolist()))
+
+    def refresh(self):
+        """Догружает изображения, добавленные другими процессами (воркеры, команды).
+
+        Берутся только строки с ``id`` больше уже известного: хэши, посчитанные
+        задним числом для старых изображений, попадут в индекс после перезапуска.
+        """
+        with self.lock:
+            rows = (
+                Image.objects.filter(id__gt=self.max_id, perceptual_hash__isnull=False)
+                .order_by("id").values_list("id", "perceptual_hash")
+            )
+            self.load((pk, from_db(value)) for pk, value in rows.iterator(chunk_size=10000))
+            self.refreshed_at = time.monotonic()
+
+
+_index = HashIndex()
+
+
+def get_index():
+    """Индекс процесса; при первом обращении загружается из БД, затем догружается периодически."""
+    if time.monotonic() - _index.refreshed_at > settings.PHASH_INDEX_REFRESH:
+        _index.refresh()
+    return _index
+
+
+def update_index(sender, instance, **kwargs):
+    """post_save: хэш нового или изменённого изображения сразу попадает в индекс."""
+    update_fields = kwargs.get("update_fields")
+    if update_fields is not None and "perceptual_hash" not in update_fields:
+        return
+    if "perceptual_hash" not in instance.get_deferred_fields() and instance.perceptual_hash is not None:
+        _index.add(instance.pk, from_db(instance.perceptual_hash))
+
+
+def remove_from_index(sender, instance, **kwargs):
+    _index.remove(instance.pk)
+
+
+def ensure_hash(instance):
+    """Хэш изображения; считается и сохраняется, если ещё не посчитан."""
+    if instance.perceptual_hash is None:
+        instance.perceptual_hash = to_db(dhash(instance.image.path))
+        instance.save(update_fields=["perceptual_hash"])
+    return from_db(instance.perceptual_hash)
+
+
+def find_duplicate(value, max_distance=None, exclude=None):
+    """Ближайшее изображение в пределах порога, обработанное всеми стадиями, или ``None``."""
+    if max_distance is None:
+        max_distance = settings.PHASH_REUSE_DISTANCE
+    matches = get_index().search(value, max_distance, limit=20, exclude=exclude)
+    if not matches:
+        return None
+    done = set(
+        Image.objects.filter(
+            id__in=[pk for pk, _ in matches], status=ProcessingStatus.DONE, description__isnull=False,
+            detected_objects__isnull=False, text__isnull=False,
+        ).values_list("id", flat=True)
+    )
+    for pk, _ in matches:
+        if pk in done:
+            source = Image.objects.filter(pk=pk).first()
+            if source is not None:
+                return source
+    return None
@@ -0,0 +1,118 @@
+"""Нормализованные теги объектов: заполнение, фильтрация и фасеты."""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import ImageTag, ObjectTag
+
+# Строки-заглушки, которые раньше писались в detected_objects вместо списка
+PLACEHOLDERS = {"", "No objects detected"}
+
+
+def parse_detected_objects(text):
+    """Разбирает строку ``detected_objects`` («собака, кошка») в счётчик тегов."""
+    if not text or text in PLACEHOLDERS:
+        return {}
+    return {name: (1, None) for name in (part.strip() for part in text.split(",")) if name}
+
+
+def tags_from_response(data):
+    """Теги из ответа сервиса инференса: ``{название: (количество, уверенность)}``."""
+    objects = data.get("objects")
+    if objects is None:
+        return parse_detected_objects(data.get("detected_objects"))
+
+    counts = Counter()
+    confidence = {}
+    for obj in objects:
+        name = obj.get("label_ru") or obj.get("label")
+        counts[name] += 1
+        confidence[name] = max(confidence.get(name, 0.0), obj.get("confidence") or 0.0)
+    return {name: (count, confidence[name]) for name, count in counts.items()}
+
+
+def get_or_create_tags(names):
+    """Возвращает ``{название: ObjectTag}``, создавая недостающие теги одним запросом."""
+    names = set(names)
+    ObjectTag.objects.bulk_create([ObjectTag(name=name) for name in names], ignore_conflicts=True)
+    return {tag.name: tag for tag in ObjectTag.objects.filter(name__in=names)}
+
+
+def add_tags_bulk(items, batch_size=1000):
+    """Добавляет теги новым изображениям: ``items`` — пары ``(image_id, теги)``.
+
+    Счётчики увеличиваются на число созданных связей без пересчёта по всей
+    таблице, поэтому у изображений ещё не должно быть тегов: повторная связь
+    даст ``IntegrityError`` вместо расхождения счётчиков.
+    """
+    items = [(image_id, tag_data) for image_id, tag_data in items if tag_data]
+    if not items:
+        return
+    tags = get_or_create_tags(name for _, tag_data in items for name in tag_data)
+    links = [
+        ImageTag(image_id=image_id, tag=tags[name], count=count, confidence=confidence)
+        for image_id, tag_data in items
+        for name, (count, confidence) in tag_data.items()
+    ]
+    with transaction.atomic():
+        ImageTag.objects.bulk_create(links, batch_size=batch_size)
+        added = Counter(link.tag_id for link in links)
+        # Одно обновление на каждое значение прироста, а не на каждый тег
+        by_amount = {}
+        for tag_id, amount in added.items():
+            by_amount.setdefault(amount, []).append(tag_id)
+        for amount, tag_ids in by_amount.items():
+            ObjectTag.objects.filter(id__in=tag_ids).update(image_count=F("image_count") + amount)
+
+
+def set_image_tags(image, tag_data):
+    """Заменяет теги изображения, поддерживая счётчики ``image_count``."""
+    with transaction.atomic():
+        old_ids = set(ImageTag.objects.filter(image=image).values_list("tag_id", flat=True))
+        ImageTag.objects.filter(image=image).delete()
+        tags = get_or_create_tags(tag_data)
+        ImageTag.objects.bulk_create([
+            ImageTag(image=image, tag=tags[name], count=count, confidence=confidence)
+            for name, (count, confidence) in tag_data.items()
+        ])
+        new_ids = {tag.id for tag in tags.values()}
+        ObjectTag.objects.filter(id__in=old_ids - new_ids).update(image_count=F("image_count") - 1)
+        ObjectTag.objects.filter(id__in=new_ids - old_ids).update(image_count=F("image_count") + 1)
+
+
+def release_image_tags(sender, instance, **kwargs):
+    """Перед удалением изображения уменьшает счётчики его тегов."""
+    ObjectTag.objects.filter(image_tags__image=instance).update(image_count=F("image_count") - 1)
+
+
+def recount_tags():
+    """Пересчитывает ``image_count`` всех тегов по таблице связей."""
+    counts = ImageTag.objects.filter(tag=OuterRef("pk")).values("tag").annotate(n=Count("id")).values("n")
+    ObjectTag.objects.update(image_count=Coalesce(Subquery(counts), Value(0)))
+
+
+def filter_by_tags(queryset, names, mode="or"):
+    """Изображения, содержащие хотя бы один (``or``) или все (``and``) теги."""
+    links = ImageTag.objects.filter(tag__name__in=names)
+    if mode == "and":
+        links = links.values("image_id").annotate(n=Count("tag_id")).filter(n=len(set(names)))
+    return queryset.filter(id__in=links.values("image_id"))
+
+
+def tag_facets(queryset=None, limit=100):
+    """Число изображений и объектов по тегам; без ``queryset`` — по денормализованным счётчикам."""
+    if queryset is None:
+        return [
+            {"tag": name, "images": count}
+            for name, count in ObjectTag.objects.filter(image_count__gt=0)
+            .order_by("-image_count", "name").values_list("name", "image_count")[:limit]
+        ]
+    rows = (
+        ImageTag.objects.filter(image_id__in=queryset.order_by().values("id"))
+        .values("tag__name")
+        .annotate(images=Count("image_id"), objects=Sum("count"))
+        .order_by("-images", "tag__name")[:limit]
+    )
+    return [{"tag": row["tag__name"], "images": row["images"], "objects": row["objects"]} for row in rows]
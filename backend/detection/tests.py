@@ -1,3 +1,664 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import piexif
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+
+from . import export, jobs, similarity
+from .management.commands import reprocess_stale
+from .embeddings import EmbeddingStore
+from .inference_client import AsyncInferenceClient, BackendPool, InferenceClient, InferenceError
+from .metadata import jpeg_segments, jpeg_with_description, png_with_description, write_metadata
+from .models import Image, InferenceJob, ObjectTag, ProcessingStatus
+from .search import build_match_query, search, stem
+from .similarity import HashIndex
+from .tags import add_tags_bulk, set_image_tags
+
+
+def make_image(image_format, size=(64, 48), color="red", **save_options):
+    buffer = io.BytesIO()
+    PILImage.new("RGB", size, color).save(buffer, image_format, **save_options)
+    return buffer.getvalue()
+
+
+def png_chunks(data):
+    """Типы и данные чанков PNG по порядку."""
+    chunks, pos = [], 8
+    while pos < len(data):
+        length, = struct.unpack(">I", data[pos:pos + 4])
+        chunks.append((data[pos + 4:pos + 8], data[pos + 8:pos + 8 + length]))
+        pos += 12 + length
+    return chunks
+
+
+class FakeReplica(BaseHTTPRequestHandler):
+    """Реплика сервиса инференса: отвечает по сценарию ``server.script`` — ``(код, задержка)``."""
+
+    def do_GET(self):
+        self.server.hits += 1
+        status, delay = self.server.script.pop(0) if self.server.script else (200, 0)
+        body = json.dumps({"caption": "blip"}).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            for byte in body:
+                time.sleep(delay)  # Ответ отдаётся по байту: таймаут чтения каждый раз сбрасывается
+                self.wfile.write(bytes([byte]))
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Клиент ушёл по сроку
+
+    def log_message(self, *args):
+        pass
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        overrides = override_settings(
+            MEDIA_ROOT=media, EMBEDDINGS_DIR=f"{media}/embeddings",
+            INFERENCE_JOB_MAX_ATTEMPTS=2, INFERENCE_JOB_STALE_AFTER=60,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.image = Image.objects.create(image=ContentFile(make_image("JPEG"), name="cat.jpg"))
+        jobs.enqueue(self.image, {"translate": "false"})
+
+    def response(self):
+        return {
+            "description": "кот", "detected_objects": "кот", "text": "",
+            "objects": [{"label": "cat", "label_ru": "кот", "confidence": 0.9}],
+            "skipped": [], "model_versions": {"caption": "blip", "detection": "yolo", "ocr": "easyocr"},
+        }
+
+    def test_claim_once(self):
+        job = jobs.claim_job()
+        self.assertEqual(job.status, ProcessingStatus.PROCESSING)
+        self.assertEqual(job.options, {"translate": "false"})
+        self.assertIsNone(jobs.claim_job())
+
+    def test_success(self):
+        with mock.patch.object(jobs, "request_metadata", return_value=self.response()) as request:
+            self.assertTrue(jobs.run_job(jobs.claim_job()))
+        request.assert_called_once_with(self.image.image.path, {"translate": "false"})
+
+        job = InferenceJob.objects.get(image=self.image)
+        self.image.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ProcessingStatus.DONE, 1))
+        self.assertEqual(self.image.status, ProcessingStatus.DONE)
+        self.assertEqual(self.image.description, "кот")
+        self.assertEqual(self.image.model_versions["detection"], "yolo")
+        self.assertEqual(list(self.image.tags.values_list("name", flat=True)), ["кот"])
+        with open(self.image.image.path, "rb") as f:
+            self.assertIn("кот", piexif.load(f.read())["0th"][piexif.ImageIFD.ImageDescription].decode())
+
+    def test_skipped_detection(self):
+        response = self.response()
+        for key in ("detected_objects", "objects"):
+            del response[key]
+        response["skipped"] = ["detection"]
+        with mock.patch.object(jobs, "request_metadata", return_value=response):
+            self.assertTrue(jobs.run_job(jobs.claim_job()))
+
+        job = InferenceJob.objects.get(image=self.image)
+        self.assertEqual((job.status, job.last_error), (ProcessingStatus.DONE, ""))
+        self.image.refresh_from_db()
+        self.assertIsNone(self.image.detected_objects)
+        with open(self.image.image.path, "rb") as f:
+            description = piexif.load(f.read())["0th"][piexif.ImageIFD.ImageDescription].decode()
+        self.assertIn("description: кот\nobjects: \n", description)
+
+    def test_retry_then_fail(self):
+        for attempt, error in enumerate([InferenceError("нет ответа"), RuntimeError("сбой")], start=1):
+            InferenceJob.objects.update(next_attempt_at=timezone.now())
+            with mock.patch.object(jobs, "request_metadata", side_effect=error):
+                self.assertFalse(jobs.run_job(jobs.claim_job()))
+            job = InferenceJob.objects.get(image=self.image)
+            self.assertEqual(job.attempts, attempt)
+
+            if attempt == 1:
+                self.assertEqual(job.status, ProcessingStatus.PENDING)
+                self.assertGreater(job.next_attempt_at, timezone.now())
+                self.assertIsNone(jobs.claim_job())  # Повтор — только после задержки
+        self.assertEqual(job.status, ProcessingStatus.FAILED)
+        self.assertEqual(job.last_error, "RuntimeError: сбой")
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.status, ProcessingStatus.FAILED)
+
+    def test_rejected_request_fails_at_once(self):
+        error = InferenceError("Ошибка API (413): слишком большое изображение", 413)
+        with mock.patch.object(jobs, "request_metadata", side_effect=error):
+            self.assertFalse(jobs.run_job(jobs.claim_job()))
+        job = InferenceJob.objects.get(image=self.image)
+        self.assertEqual((job.status, job.attempts), (ProcessingStatus.FAILED, 1))
+
+        jobs.enqueue(self.image)
+        with mock.patch.object(jobs, "request_metadata", side_effect=InferenceError("Ошибка API (429)", 429)):
+            self.assertFalse(jobs.run_job(jobs.claim_job()))
+        self.assertEqual(InferenceJob.objects.get(image=self.image).status, ProcessingStatus.PENDING)
+
+    def test_file_error_keeps_result(self):
+        with mock.patch.object(jobs, "request_metadata", return_value=self.response()), \
+                mock.patch.object(jobs, "write_metadata", side_effect=OSError("диск")):
+            self.assertTrue(jobs.run_job(jobs.claim_job()))
+        job = InferenceJob.objects.get(image=self.image)
+        self.assertEqual(job.status, ProcessingStatus.DONE)
+        self.assertIn("диск", job.last_error)
+
+    def test_requeue_stale(self):
+        jobs.claim_job()
+        self.assertEqual(jobs.requeue_stale_jobs(), 0)
+        InferenceJob.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        self.assertIsNotNone(jobs.claim_job())
+
+
+class SearchQueryTests(SimpleTestCase):
+    def test_stem(self):
+        self.assertEqual(stem("собаками"), "собак")
+        self.assertEqual(stem("кошки"), "кошк")
+        self.assertEqual(stem("рыжие"), "рыж")
+        self.assertEqual(stem("кот"), "кот")  # Короткие слова не трогаем
+        self.assertEqual(stem("dogs"), "dogs")
+
+    def test_build_match_query(self):
+        self.assertEqual(build_match_query('Рыжие "кошки"!'), '"рыж"* AND "кошк"*')
+        self.assertEqual(build_match_query("?!"), "")
+
+
+class FullTextSearchTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        overrides = override_settings(MEDIA_ROOT=media, EMBEDDINGS_DIR=f"{media}/embeddings")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.cat = Image.objects.create(image="images/cat.jpg", description="рыжая кошка на диване")
+        self.dog = Image.objects.create(image="images/dog.jpg", description="собака в парке", text="ПАРК")
+
+    def found(self, term):
+        return list(search(Image.objects.all(), term).values_list("id", flat=True))
+
+    def test_word_forms(self):
+        self.assertEqual(self.found("кошки"), [self.cat.pk])
+        self.assertEqual(self.found("собаками в парке"), [self.dog.pk])
+        self.assertEqual(self.found("кошка парк"), [])  # Все слова запроса обязательны
+
+    def test_triggers_follow_changes(self):
+        Image.objects.filter(pk=self.cat.pk).update(description="пустой диван")
+        self.assertEqual(self.found("кошка"), [])
+        self.assertEqual(self.found("диван"), [self.cat.pk])
+
+        self.dog.delete()
+        self.assertEqual(self.found("собака"), [])
+
+        Image.objects.bulk_create([Image(image="images/bird.jpg", detected_objects="птица")])
+        self.assertEqual(self.found("птицы"), [Image.objects.get(detected_objects="птица").pk])
+
+    def test_api_search(self):
+        response = APIClient(HTTP_HOST="localhost").get("/api/images/", {"search": "диваны", "fields": "id"})
+        self.assertEqual([item["id"] for item in response.data["results"]], [self.cat.pk])
+
+
+class TagTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        overrides = override_settings(MEDIA_ROOT=media, EMBEDDINGS_DIR=f"{media}/embeddings")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.images = [Image.objects.create(image=f"images/{i}.jpg") for i in range(3)]
+        self.client = APIClient(HTTP_HOST="localhost")
+
+    def counts(self):
+        return dict(ObjectTag.objects.values_list("name", "image_count"))
+
+    def test_set_image_tags_keeps_counts(self):
+        first, second, _ = self.images
+        set_image_tags(first, {"кот": (2, 0.9), "собака": (1, 0.8)})
+        set_image_tags(second, {"кот": (1, 0.7)})
+        self.assertEqual(self.counts(), {"кот": 2, "собака": 1})
+
+        set_image_tags(first, {"птица": (1, 0.6)})
+        self.assertEqual(self.counts(), {"кот": 1, "собака": 0, "птица": 1})
+        second.delete()
+        self.assertEqual(self.counts()["кот"], 0)
+
+    def test_add_tags_bulk_increments(self):
+        add_tags_bulk([(image.pk, {"кот": (1, None)}) for image in self.images[:2]])
+        add_tags_bulk([(self.images[2].pk, {"кот": (1, None), "собака": (3, None)})])
+        self.assertEqual(self.counts(), {"кот": 3, "собака": 1})
+        with self.assertRaises(IntegrityError):
+            add_tags_bulk([(self.images[0].pk, {"кот": (1, None)})])  # Только для изображений без тегов
+        self.assertEqual(self.counts(), {"кот": 3, "собака": 1})
+
+    def test_filter_and_facets(self):
+        first, second, third = self.images
+        set_image_tags(first, {"кот": (2, None), "собака": (1, None)})
+        set_image_tags(second, {"кот": (1, None)})
+        set_image_tags(third, {"собака": (1, None)})
+
+        def ids(params):
+            response = self.client.get("/api/images/", {"fields": "id", **params})
+            return [item["id"] for item in response.data["results"]]
+
+        self.assertEqual(ids({"tags": "кот,собака"}), [first.pk, second.pk, third.pk])
+        self.assertEqual(ids({"tags": "кот,собака", "tags_mode": "and"}), [first.pk])
+
+        facets = self.client.get("/api/images/facets/").data["facets"]
+        self.assertEqual(facets, [{"tag": "кот", "images": 2}, {"tag": "собака", "images": 2}])
+        facets = self.client.get("/api/images/facets/", {"tags": "кот"}).data["facets"]
+        self.assertEqual(facets, [
+            {"tag": "кот", "images": 2, "objects": 3},
+            {"tag": "собака", "images": 1, "objects": 1},
+        ])
+        self.assertEqual(self.client.get("/api/images/facets/", {"limit": "много"}).status_code, 400)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        overrides = override_settings(MEDIA_ROOT=media, EMBEDDINGS_DIR=f"{media}/embeddings")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.ids = [
+            Image.objects.create(image=f"images/{i}.jpg", description=f"изображение {i}").pk for i in range(7)
+        ]
+        self.client = APIClient(HTTP_HOST="localhost")
+
+    def test_walks_all_pages(self):
+        url, seen = "/api/images/?page_size=3&fields=id", []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("count", response.data)
+            seen += [item["id"] for item in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(seen, self.ids)
+
+    def test_previous_page(self):
+        first = self.client.get("/api/images/?page_size=3").data
+        second = self.client.get(first["next"]).data
+        self.assertEqual(self.client.get(second["previous"]).data["results"], first["results"])
+
+    def test_page_numbers_still_supported(self):
+        response = self.client.get("/api/images/?page=2&page_size=3")
+        self.assertEqual(response.data["count"], 7)
+        self.assertEqual([item["id"] for item in response.data["results"]], self.ids[3:6])
+
+
+class RenditionTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        overrides = override_settings(MEDIA_ROOT=media, EMBEDDINGS_DIR=f"{media}/embeddings")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.image = Image.objects.create(image=ContentFile(make_image("JPEG", size=(1000, 600)), name="cat.jpg"))
+        self.url = f"/api/images/{self.image.pk}/rendition/thumbnail/"
+        self.client = APIClient(HTTP_HOST="localhost")
+
+    def test_etag_and_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("max-age=", response["Cache-Control"])
+        with PILImage.open(io.BytesIO(b"".join(response.streaming_content))) as thumbnail:
+            self.assertEqual(thumbnail.size, (200, 120))
+
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached["ETag"], response["ETag"])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"old"').status_code, 200)
+
+    def test_unknown_kind(self):
+        self.assertEqual(self.client.get(f"/api/images/{self.image.pk}/rendition/huge/").status_code, 404)
+        with override_settings(IMAGE_RENDITIONS={"thumbnail": (200, 200)}):
+            self.assertEqual(self.client.get(f"/api/images/{self.image.pk}/rendition/preview/").status_code, 404)
+            data = self.client.get(f"/api/images/{self.image.pk}/").data
+        self.assertIsNone(data["preview_url"])
+        self.assertTrue(data["thumbnail_url"].endswith(self.url))
+
+
+class MetadataTests(SimpleTestCase):
+    def test_jpeg_keeps_other_segments(self):
+        data = make_image("JPEG", dpi=(300, 300))
+        result = jpeg_with_description(data, "описание")
+
+        before, scan_before = jpeg_segments(data)
+        after, scan_after = jpeg_segments(result)
+        self.assertEqual(after[0], before[0])  # APP0 JFIF на месте и не изменён
+        self.assertEqual([s for s in after if s[0] != 0xE1], before)
+        self.assertEqual(result[scan_after:], data[scan_before:])
+
+        with PILImage.open(io.BytesIO(result)) as img:
+            self.assertEqual(img.info["dpi"], (300, 300))
+        exif = piexif.load(result)
+        self.assertEqual(exif["0th"][piexif.ImageIFD.ImageDescription].decode(), "описание")
+
+    def test_jpeg_replaces_existing_exif(self):
+        exif = piexif.dump({"0th": {piexif.ImageIFD.Make: b"camera"}})
+        data = make_image("JPEG", exif=exif)
+        result = jpeg_with_description(jpeg_with_description(data, "первое"), "второе")
+
+        self.assertEqual(result.count(b"Exif\x00\x00"), 1)
+        loaded = piexif.load(result)["0th"]
+        self.assertEqual(loaded[piexif.ImageIFD.ImageDescription].decode(), "второе")
+        self.assertEqual(loaded[piexif.ImageIFD.Make], b"camera")
+
+    def test_jpeg_truncated(self):
+        with self.assertRaises(ValueError):
+            jpeg_with_description(make_image("JPEG")[:30], "описание")
+
+    def test_png_round_trip(self):
+        data = make_image("PNG")
+        result = png_with_description(png_with_description(data, "первое"), "второе")
+
+        chunks = png_chunks(result)
+        self.assertEqual([c for c in chunks if c[0] != b"iTXt"], png_chunks(data))
+        self.assertEqual(chunks[1][0], b"iTXt")  # Сразу после IHDR
+        with PILImage.open(io.BytesIO(result)) as img:
+            self.assertEqual(img.text["ImageDescription"], "второе")
+
+    def test_png_corrupt(self):
+        data = make_image("PNG")
+        for broken in (data[:20], data[:-7]):
+            with self.assertRaises(ValueError):
+                png_with_description(broken, "описание")
+
+    def test_write_metadata(self):
+        with tempfile.NamedTemporaryFile(suffix=".jpg") as f:
+            f.write(make_image("JPEG"))
+            f.flush()
+            write_metadata(f.name, "кот", ["кот", "диван"], "")
+            with open(f.name, "rb") as result:
+                description = piexif.load(result.read())["0th"][piexif.ImageIFD.ImageDescription].decode()
+        self.assertEqual(description, "description: кот\nobjects: кот, диван\ntext: No text detected")
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        overrides = override_settings(MEDIA_ROOT=media, EMBEDDINGS_DIR=f"{media}/embeddings")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.images = [
+            Image.objects.create(image=f"images/{i}.jpg", description=f"кот номер {i}, \"рыжий\"",
+                                 status=ProcessingStatus.DONE if i % 2 else ProcessingStatus.PENDING)
+            for i in range(5)
+        ]
+        self.client = APIClient(HTTP_HOST="localhost")
+
+    def download(self, params):
+        response = self.client.get("/api/images/export/", params)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_csv(self):
+        response, content = self.download({"status": ProcessingStatus.DONE})
+        self.assertEqual(response["Content-Disposition"], 'attachment; filename="images.csv"')
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], export.CSV_HEADER)
+        self.assertEqual([int(row[0]) for row in rows[1:]], [self.images[1].pk, self.images[3].pk])
+        self.assertEqual(rows[1][2], 'кот номер 1, "рыжий"')
+
+    def test_jsonl(self):
+        response, content = self.download({"export_format": "jsonl"})
+        self.assertTrue(response["Content-Type"].startswith("application/x-ndjson"))
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([r["id"] for r in records], [image.pk for image in self.images])
+        self.assertEqual(set(records[0]), set(export.EXPORT_FIELDS))
+
+    def test_streams_in_chunks(self):
+        with mock.patch.object(export, "CHUNK_SIZE", 2):
+            chunks = list(export.iter_export(Image.objects.all(), "jsonl"))
+        self.assertEqual([chunk.count("\n") for chunk in chunks], [2, 2, 1])
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get("/api/images/export/", {"export_format": "xml"}).status_code, 400)
+
+
+class HashIndexTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.values = [int(v) for v in rng.integers(0, 2 ** 63, 500, dtype=np.uint64) * 2 + 1]
+        self.index = HashIndex()
+        self.index.load(enumerate(self.values, start=1))
+
+    def brute_force(self, query, max_distance, exclude=None):
+        distances = [(bin(v ^ query).count("1"), pk) for pk, v in enumerate(self.values, start=1)]
+        return [(pk, d) for d, pk in sorted(distances) if d <= max_distance and pk != exclude]
+
+    def test_matches_brute_force(self):
+        for pk in (1, 50, 400):
+            query = self.values[pk - 1] ^ 0b1011  # Три перевёрнутых бита
+            for distance in (0, 3, 8):
+                self.assertEqual(self.index.search(query, distance), self.brute_force(query, distance))
+
+    def test_exclude_and_limit(self):
+        query = self.values[9]
+        self.assertEqual(self.index.search(query, 0, exclude=10), [])
+        self.assertEqual(self.index.search(query, 64, limit=3), self.brute_force(query, 64)[:3])
+
+    def test_add_replace_remove(self):
+        self.index.add(1000, 0)
+        self.index.add(2, 1)  # Новое значение для уже проиндексированного id
+        self.assertEqual(self.index.search(0, 1), [(1000, 0), (2, 1)])
+        self.index.remove(2)
+        self.index.remove(1000)
+        self.assertEqual(self.index.search(0, 1), [])
+        self.assertEqual(len(self.index), 499)
+
+    def test_merge_keeps_results(self):
+        with mock.patch.object(similarity, "MERGE_THRESHOLD", 3):
+            for pk in range(1000, 1005):
+                self.index.add(pk, pk)
+        self.assertEqual(self.index.recent, {1003: 1003, 1004: 1004})
+        self.assertEqual([pk for pk, _ in self.index.search(1000, 0)], [1000])
+        self.assertEqual([pk for pk, _ in self.index.search(1004, 0)], [1004])
+
+    def test_popcount_fallback(self):
+        values = np.array(self.values, dtype=np.uint64)
+        expected = [bin(v).count("1") for v in self.values]
+        with mock.patch.dict(np.__dict__):
+            np.__dict__.pop("bitwise_count", None)  # Как в NumPy < 2.0
+            self.assertEqual(similarity.popcount(values).tolist(), expected)
+        self.assertEqual(similarity.popcount(values).tolist(), expected)
+
+
+@override_settings(EMBEDDING_SEARCH_BLOCK=64, EMBEDDING_IVF_MIN_ROWS=100, EMBEDDING_INDEX_REFRESH=0)
+class EmbeddingStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.store = EmbeddingStore(self.path)
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(size=(300, 16)).astype(np.float32)
+        for pk, vector in enumerate(self.vectors, start=1):
+            if pk % 10:  # Каждая десятая строка остаётся пустой
+                self.store.put(pk, vector)
+
+    def expected(self, query, k, exclude=()):
+        vectors = self.vectors / np.linalg.norm(self.vectors, axis=1, keepdims=True)
+        scores = vectors @ (query / np.linalg.norm(query))
+        ranked = [pk for pk in np.argsort(-scores) + 1 if pk % 10 and pk not in exclude]
+        return [int(pk) for pk in ranked[:k]]
+
+    def ids(self, found):
+        return [pk for pk, _ in found]
+
+    def test_exact_search(self):
+        query = self.vectors[4]
+        found = self.store.search([query], k=5, mode="exact")[0]
+        self.assertEqual(self.ids(found), self.expected(query, 5))
+        self.assertEqual(found[0][0], 5)
+        self.assertAlmostEqual(found[0][1], 1.0, places=2)
+        self.assertEqual(self.ids(self.store.search([query], k=5, exclude=[5])[0]), self.expected(query, 5, [5]))
+
+    def test_get_and_remove(self):
+        self.assertIsNone(self.store.get(10))
+        np.testing.assert_allclose(self.store.get(5), self.vectors[4] / np.linalg.norm(self.vectors[4]), atol=1e-3)
+        self.store.remove(5)
+        self.assertIsNone(self.store.get(5))
+        self.assertNotIn(5, self.ids(self.store.search([self.vectors[4]], k=5, mode="exact")[0]))
+
+    def test_ivf_search(self):
+        with self.assertRaises(ValueError):
+            self.store.search([self.vectors[0]], mode="ivf")
+        self.store.train_ivf(lists=4, iterations=5)
+        # Все списки просмотрены — результат совпадает с точным поиском
+        for pk in (1, 77, 299):
+            query = self.vectors[pk - 1]
+            found = self.store.search([query], k=5, mode="ivf", nprobe=4)[0]
+            self.assertEqual(self.ids(found), self.expected(query, 5))
+
+        # Строки, добавленные после обучения, находятся и в режиме auto (IVF)
+        self.store.put(500, self.vectors[0] * -1)
+        found = self.store.search([self.vectors[0] * -1], k=1, nprobe=1)[0]
+        self.assertEqual(self.ids(found), [500])
+
+    def test_dimension_mismatch(self):
+        with self.assertRaises(ValueError):
+            self.store.put(1, np.ones(8))
+
+
+class ReprocessStaleTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        overrides = override_settings(MEDIA_ROOT=media, EMBEDDINGS_DIR=f"{media}/embeddings")
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        for name in ("a.jpg", "b.jpg", "c.jpg"):
+            Image.objects.create(image=ContentFile(make_image("JPEG"), name=name), status=ProcessingStatus.DONE,
+                                 model_versions={"caption": "old"})
+        for patcher in (mock.patch.object(reprocess_stale, "OVERLOAD_PAUSE", 0),
+                        mock.patch.object(reprocess_stale, "InferenceClient")):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = reprocess_stale.InferenceClient.return_value
+        self.client.versions.return_value = {"caption": "new"}
+
+    def run_command(self, **options):
+        out = io.StringIO()
+        call_command("reprocess_stale", workers=2, max_retries=2, stdout=out, **options)
+        return out.getvalue()
+
+    def test_rejected_items_are_retried(self):
+        def upload_batch(files, options):
+            if self.client.upload_batch.call_count == 1:
+                # Очередь сервиса заполнена: последнее изображение не принято
+                return [{"index": 0, "description": "кот", "model_versions": {"caption": "new"}},
+                        {"index": 1, "description": "кот", "model_versions": {"caption": "new"}},
+                        {"index": 2, "error": "Очередь переполнена", "status": 503}]
+            return [{"index": i, "description": "пёс", "model_versions": {"caption": "new"}}
+                    for i in range(len(files))]
+
+        self.client.upload_batch.side_effect = upload_batch
+        output = self.run_command()
+        self.assertIn("Обновлено: 3, ошибок: 0", output)
+        self.assertEqual([len(call.args[0]) for call in self.client.upload_batch.call_args_list], [3, 1])
+        self.assertEqual(Image.objects.filter(model_versions__caption="new").count(), 3)
+
+    def test_overload_retries_are_capped(self):
+        self.client.upload_batch.side_effect = InferenceError("Ошибка API (503)", 503)
+        output = self.run_command()
+        self.assertEqual(self.client.upload_batch.call_count, 3)
+        self.assertIn("Обновлено: 0, ошибок: 3", output)
+
+
+class InferenceClientTests(SimpleTestCase):
+    def replica(self, *script):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), FakeReplica)
+        server.daemon_threads = True
+        server.script, server.hits = list(script), 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def make_client(self, *servers, **kwargs):
+        urls = [f"http://127.0.0.1:{server.server_port}" for server in servers]
+        return InferenceClient(urls, retries=2, backoff=0.01, **kwargs)
+
+    def test_least_outstanding(self):
+        pool = BackendPool(["http://a", "http://b"], failure_threshold=3, reset_after=30)
+        first = pool.acquire()
+        second = pool.acquire()
+        self.assertNotEqual(first, second)
+        pool.release(first, True)
+        self.assertIs(pool.acquire(), first)
+
+    def test_circuit_breaker(self):
+        pool = BackendPool(["http://a"], failure_threshold=2, reset_after=0.05)
+        for _ in range(2):
+            pool.release(pool.acquire(), False)
+        self.assertEqual(pool.stats()["http://a"]["state"], "open")
+        with self.assertRaises(InferenceError):
+            pool.acquire()
+
+        time.sleep(0.06)
+        probe = pool.acquire()  # После паузы — один пробный запрос
+        self.assertEqual(pool.stats()["http://a"]["state"], "half_open")
+        with self.assertRaises(InferenceError):
+            pool.acquire()
+        pool.release(probe, True)
+        self.assertEqual(pool.stats()["http://a"]["state"], "closed")
+
+    def test_retries_overload_and_server_errors(self):
+        server = self.replica((503, 0), (502, 0))
+        client = self.make_client(server)
+        self.assertEqual(client.versions(), {"caption": "blip"})
+        self.assertEqual(server.hits, 3)
+        stats, = client.stats().values()
+        self.assertEqual(stats["failures"], 0)  # Успешный ответ сбросил счётчик ошибок
+
+    def test_client_error_not_retried(self):
+        server = self.replica((413, 0))
+        with self.assertRaises(InferenceError) as raised:
+            self.make_client(server).versions()
+        self.assertEqual((raised.exception.status, raised.exception.retryable), (413, False))
+        self.assertEqual(server.hits, 1)
+
+    def test_deadline(self):
+        server = self.replica((200, 1.0))
+        started = time.monotonic()
+        with self.assertRaises(InferenceError):
+            self.make_client(server, timeout=0.3).request("GET", "/versions/", timeout=0.3).json()
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    def test_async_deadline_covers_slow_body(self):
+        server = self.replica((200, 0.05))
+
+        async def main():
+            client = AsyncInferenceClient([f"http://127.0.0.1:{server.server_port}"], retries=0)
+            try:
+                return await client.versions()
+            finally:
+                await client.aclose()
+
+        with override_settings(INFERENCE_TIMEOUT=0.3):
+            started = time.monotonic()
+            with self.assertRaises(InferenceError):
+                asyncio.run(main())
+        self.assertLess(time.monotonic() - started, 0.6)  # Ответ целиком занял бы около секунды
@@ -1,92 +1,187 @@
-import requests
-import piexif
-from PIL import Image, PngImagePlugin
+import os
+
 from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.shortcuts import get_object_or_404
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
-from requests.exceptions import RequestException
-from rest_framework import status, viewsets, filters
-from rest_framework.pagination import PageNumberPagination
+from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
+from .embeddings import SEARCH_MODES, get_store
+from .export import EXPORT_FORMATS, export_response
+from .filters import FullTextSearchFilter, TagFilter
+from .jobs import InferenceError, enqueue, inference_options, post_image, reuse_metadata
+from .metadata import write_metadata  # noqa: F401 - оставлено для обратной совместимости импорта
 from .models import Image as ImageModel
+from .pagination import ImagePagination
+from .renditions import ensure_rendition
 from .serializers import ImageSerializer
-
-API_URL = settings.METADATA_API_URL
+from .similarity import ensure_hash, find_duplicate, get_index
+from .tags import tag_facets
 
 
 class ImageViewSet(viewsets.ModelViewSet):
     queryset = ImageModel.objects.all().order_by("id")
     serializer_class = ImageSerializer
-    pagination_class = PageNumberPagination
+    pagination_class = ImagePagination
 
     # Добавляем поддержку поиска
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
-    filterset_fields = ['description']
-    search_fields = ['description']
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, TagFilter]
+    filterset_fields = ['description', 'status']
+    search_fields = ['description', 'detected_objects', 'text']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # Для ?fields= читаем из БД только нужные колонки
+        only = self.get_serializer_class().model_fields(self.request)
+        if only and self.action in ("list", "retrieve", "similar", "nearest", "nearest_by_image"):
+            queryset = queryset.only(*only)
+        return queryset
 
     def perform_create(self, serializer):
-        """При создании изображения получаем метаданные, записываем их в модель и обновляем EXIF изображения."""
-        instance = serializer.save()  # Сохраняем изображение в БД
+        """Сохраняет изображение и ставит его в очередь на получение метаданных.
 
-        try:
-            # Отправляем изображение на API нейронки
-            with open(instance.image.path, "rb") as img_file:
-                files = {"image": img_file}
-                response = requests.post(API_URL, files=files)
-
-            if response.status_code == 200:
-                data = response.json()
-
-                # Записываем полученные метаданные в БД
-                instance.description = data.get("description", "No description received")
-                instance.detected_objects = data.get("detected_objects", "No objects detected")
-                instance.text = data.get("text", "No translated text")
-                instance.save()
-
-                # Записываем метаданные в EXIF изображения
-                write_metadata(
-                    instance.image.path,
-                    instance.description,
-                    instance.detected_objects,
-                    instance.text
-                )
-
-        except RequestException as e:
-            return Response(
-                {"error": f"API недоступно: {str(e)}"},
-                status=status.HTTP_503_SERVICE_UNAVAILABLE
-            )
-
-
-def write_metadata(image_path, description, list_of_objects, text):
-    """Записывает метаданные в EXIF изображения."""
-    img = Image.open(image_path)
-    img_format = img.format
-
-    if isinstance(list_of_objects, str):
-        list_of_objects = [list_of_objects]  # Приводим к списку, если строка
-
-    combined_metadata = (
-        f"description: {description}\n"
-        f"objects: {', '.join(list_of_objects)}\n"
-        f"text: {text if text else 'No text detected'}"
-    )
-
-    try:
-        if img_format in ['JPEG', 'TIFF']:
-            exif_dict = piexif.load(img.info.get('exif', b''))
-            exif_dict['0th'][piexif.ImageIFD.ImageDescription] = combined_metadata.encode('utf-8')
-            exif_bytes = piexif.dump(exif_dict)
-            img.save(image_path, exif=exif_bytes, format=img_format)
-
-        elif img_format == 'PNG':
-            pnginfo = PngImagePlugin.PngInfo()
-            pnginfo.add_text('ImageDescription', combined_metadata)
-            img.save(image_path, pnginfo=pnginfo, format=img_format)
+        Обращение к нейросети выполняет воркер ``process_jobs``, поэтому
+        ответ возвращается сразу со статусом ``pending``. Параметры
+        ``stages``, ``translate``, ``spelling`` и ``text_lang`` из query-строки
+        или формы передаются сервису инференса.
 
+        Если без особых параметров загружена копия уже обработанного
+        изображения (пересжатая, уменьшенная), её метаданные берутся у
+        оригинала и нейросеть не вызывается.
+        """
+        instance = serializer.save()  # Сохраняем изображение в БД
+        options = {**inference_options(self.request.data), **inference_options(self.request.query_params)}
+        source = None
+        try:
+            value = ensure_hash(instance)
+            if not options and settings.PHASH_REUSE_DISTANCE >= 0:
+                source = find_duplicate(value, exclude=instance.pk)
+        except (OSError, ValueError):
+            pass  # Файл не удалось разобрать: его обработает воркер и сообщит об ошибке
+        if source is not None:
+            reuse_metadata(instance, source)
         else:
-            img.info['ImageDescription'] = combined_metadata
-            img.save(image_path, format=img_format)
-
-    finally:
-        img.close()
+            enqueue(instance, options)
+
+    @action(detail=False, methods=["get"], url_path="status")
+    def bulk_status(self, request):
+        """Статусы обработки для списка id: ``?ids=1,2,3``."""
+        ids = [int(i) for i in request.query_params.get("ids", "").split(",") if i.strip().isdigit()]
+        statuses = ImageModel.objects.filter(id__in=ids).values_list("id", "status")
+        return Response({str(pk): image_status for pk, image_status in statuses})
+
+    @action(detail=False, methods=["get"])
+    def facets(self, request):
+        """Число изображений по тегам объектов для текущих фильтров (``?limit=`` — сколько тегов)."""
+        try:
+            limit = int(request.query_params.get("limit", 100))
+        except ValueError:
+            return Response({"error": "limit должен быть целым числом"}, status=400)
+        limit = max(1, min(limit, 1000))
+        filtered = set(request.query_params) - {"limit", "format", "page", "cursor", "page_size", "fields"}
+        queryset = self.filter_queryset(self.get_queryset()) if filtered else None
+        return Response({"facets": tag_facets(queryset, limit)})
+
+    @action(detail=True, methods=["get"])
+    def similar(self, request, pk=None):
+        """Похожие изображения по перцептивному хэшу: ``?distance=`` (порог Хэмминга) и ``?limit=``."""
+        instance = get_object_or_404(ImageModel.objects.only("id", "image", "perceptual_hash"), pk=pk)
+        try:
+            distance = int(request.query_params.get("distance", settings.SIMILAR_DEFAULT_DISTANCE))
+            limit = int(request.query_params.get("limit", 20))
+        except ValueError:
+            return Response({"error": "distance и limit должны быть целыми числами"}, status=400)
+        distance = max(0, min(distance, settings.SIMILAR_MAX_DISTANCE))
+        limit = max(1, min(limit, 100))
+        try:
+            value = ensure_hash(instance)
+        except (OSError, ValueError):
+            raise Http404
+
+        matches = get_index().search(value, distance, limit=limit, exclude=instance.pk)
+        return self.ranked_response(matches, "distance")
+
+    def ranked_response(self, matches, key):
+        """Ответ со списком изображений по парам ``(id, оценка)``; оценка кладётся в поле ``key``."""
+        # Изображения, удалённые другими процессами, ещё могут быть в индексе
+        images = self.get_queryset().in_bulk([image_id for image_id, _ in matches])
+        found = [(images[image_id], value) for image_id, value in matches if image_id in images]
+        data = self.get_serializer([image for image, _ in found], many=True).data
+        return Response({"results": [{**item, key: value} for item, (_, value) in zip(data, found)]})
+
+    def vector_search(self, request, vector, exclude=()):
+        """Поиск по эмбеддингу: ``?limit=``, ``?mode=auto|exact|ivf``, ``?nprobe=``."""
+        try:
+            limit = max(1, min(int(request.query_params.get("limit", 20)), 100))
+            nprobe = int(request.query_params["nprobe"]) if "nprobe" in request.query_params else None
+        except ValueError:
+            return Response({"error": "limit и nprobe должны быть целыми числами"}, status=400)
+        mode = request.query_params.get("mode", "auto")
+        if mode not in SEARCH_MODES:
+            return Response({"error": f"Допустимые режимы: {', '.join(SEARCH_MODES)}"}, status=400)
+        try:
+            matches = get_store().search(vector, k=limit, mode=mode, nprobe=nprobe, exclude=exclude)[0]
+        except ValueError as e:
+            return Response({"error": str(e)}, status=400)
+        return self.ranked_response(matches, "score")
+
+    @action(detail=True, methods=["get"])
+    def nearest(self, request, pk=None):
+        """Изображения, похожие по содержанию (косинусная близость эмбеддингов)."""
+        vector = get_store().get(int(pk)) if str(pk).isdigit() else None
+        if vector is None:
+            raise Http404("Для изображения нет эмбеддинга")
+        return self.vector_search(request, vector, exclude=(int(pk),))
+
+    @action(detail=False, methods=["post"], url_path="nearest")
+    def nearest_by_image(self, request):
+        """Поиск по загруженному файлу ``image``: эмбеддинг считает сервис инференса."""
+        upload = request.FILES.get("image")
+        if upload is None:
+            return Response({"error": "Не передан файл image"}, status=400)
+        try:
+            data = post_image((upload.name, upload.read()), {"stages": "embedding"})
+        except InferenceError as e:
+            return Response({"error": str(e)}, status=502)
+        if not data.get("embedding"):
+            return Response({"error": "Сервис инференса не вернул эмбеддинг"}, status=502)
+        return self.vector_search(request, data["embedding"])
+
+    @action(detail=False, methods=["get"])
+    def export(self, request):
+        """Потоковая выгрузка с текущими фильтрами: ``?export_format=csv|jsonl``."""
+        export_format = request.query_params.get("export_format", "csv")
+        if export_format not in EXPORT_FORMATS:
+            return Response({"error": f"Допустимые форматы: {', '.join(EXPORT_FORMATS)}"}, status=400)
+        return export_response(self.filter_queryset(self.get_queryset()), export_format)
+
+    @action(detail=True, methods=["get"], url_path=r"rendition/(?P<kind>[\w-]+)")
+    def rendition(self, request, pk=None, kind=None):
+        """Уменьшенная копия изображения с ETag и Cache-Control; создаётся при первом запросе."""
+        if kind not in settings.IMAGE_RENDITIONS:
+            raise Http404  # Виды задаются настройкой IMAGE_RENDITIONS
+        instance = ImageModel.objects.only("id", "image").filter(pk=pk).first()
+        if instance is None or not instance.image:
+            raise Http404
+        try:
+            path = ensure_rendition(instance, kind)
+        except (OSError, ValueError):
+            raise Http404
+
+        stat = os.stat(path)
+        etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": f"public, max-age={settings.RENDITION_CACHE_SECONDS}",
+            "Last-Modified": http_date(stat.st_mtime),
+        }
+        if request.headers.get("If-None-Match") == etag:
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(path, "rb"), content_type="image/jpeg")
+        for header, value in headers.items():
+            response[header] = value
+        return response
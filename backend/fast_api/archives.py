@@ -0,0 +1,43 @@
+import tarfile
+import threading
+import zipfile
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+
+class ArchiveError(Exception):
+    """Архив повреждён или имеет неподдерживаемый формат."""
+
+
+def archive_members(fileobj, filename):
+    """Возвращает список ``(имя, функция чтения)`` изображений из zip или tar архива.
+
+    Содержимое читается по требованию, чтобы не держать весь архив в памяти.
+    Функции чтения можно вызывать из разных потоков: доступ к файлу архива
+    сериализуется блокировкой.
+    """
+    lock = threading.Lock()
+
+    def locked(read):
+        def wrapper():
+            with lock:
+                return read()
+        return wrapper
+
+    try:
+        if filename.lower().endswith(".zip"):
+            archive = zipfile.ZipFile(fileobj)
+            return [
+                (info.filename, locked(lambda info=info: archive.read(info)))
+                for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+            ]
+
+        archive = tarfile.open(fileobj=fileobj, mode="r:*")
+        return [
+            (member.name, locked(lambda member=member: archive.extractfile(member).read()))
+            for member in archive.getmembers()
+            if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise ArchiveError(f"Не удалось прочитать архив {filename}: {e}") from e
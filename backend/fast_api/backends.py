@@ -0,0 +1,92 @@
+"""Бэкенды инференса для CPU.
+
+* ``torch`` — исходные модели PyTorch в fp32;
+* ``quantized`` — динамическое int8-квантование линейных слоёв BLIP и
+  Marian, YOLO экспортируется в ONNX и квантуется в int8;
+* ``onnx`` — Marian и YOLO выполняются в ONNX Runtime. Генерация BLIP
+  через ONNX Runtime не поддерживается, поэтому BLIP квантуется в int8.
+
+Экспортированные модели сохраняются в ``config.ONNX_CACHE_DIR`` и при
+следующем запуске загружаются с диска.
+"""
+import os
+
+import config
+
+BACKENDS = ("torch", "quantized", "onnx")
+
+
+def _check(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд {backend!r}, допустимы: {', '.join(BACKENDS)}")
+
+
+def quantize_dynamic(model):
+    """Динамическое int8-квантование линейных слоёв модели PyTorch."""
+    import torch
+
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_blip(backend):
+    from transformers import BlipProcessor, BlipForConditionalGeneration
+
+    _check(backend)
+    processor = BlipProcessor.from_pretrained(config.BLIP_MODEL)
+    model = BlipForConditionalGeneration.from_pretrained(config.BLIP_MODEL)
+    model.eval()
+    if backend != "torch":
+        model = quantize_dynamic(model)
+    return processor, model
+
+
+def load_marian(backend):
+    from transformers import MarianMTModel, MarianTokenizer
+
+    _check(backend)
+    tokenizer = MarianTokenizer.from_pretrained(config.TRANSLATION_MODEL)
+    if backend == "onnx":
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+        export_dir = os.path.join(config.ONNX_CACHE_DIR, config.TRANSLATION_MODEL.replace("/", "--"))
+        if os.path.isdir(export_dir):
+            model = ORTModelForSeq2SeqLM.from_pretrained(export_dir)
+        else:
+            model = ORTModelForSeq2SeqLM.from_pretrained(config.TRANSLATION_MODEL, export=True)
+            model.save_pretrained(export_dir)
+        return tokenizer, model
+
+    model = MarianMTModel.from_pretrained(config.TRANSLATION_MODEL)
+    model.eval()
+    if backend == "quantized":
+        model = quantize_dynamic(model)
+    return tokenizer, model
+
+
+def _export_yolo_onnx(quantized):
+    from ultralytics import YOLO
+
+    stem = os.path.splitext(os.path.basename(config.YOLO_MODEL))[0]
+    fp32_path = os.path.join(config.ONNX_CACHE_DIR, f"{stem}.onnx")
+    if not os.path.exists(fp32_path):
+        os.makedirs(config.ONNX_CACHE_DIR, exist_ok=True)
+        exported = YOLO(config.YOLO_MODEL).export(format="onnx", dynamic=True)
+        os.replace(exported, fp32_path)
+    if not quantized:
+        return fp32_path
+
+    int8_path = os.path.join(config.ONNX_CACHE_DIR, f"{stem}-int8.onnx")
+    if not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic as ort_quantize_dynamic
+
+        ort_quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QUInt8)
+    return int8_path
+
+
+def load_yolo(backend):
+    from ultralytics import YOLO
+
+    _check(backend)
+    if backend == "torch":
+        return YOLO(config.YOLO_MODEL)
+    return YOLO(_export_yolo_onnx(quantized=backend == "quantized"), task="detect")
@@ -0,0 +1,98 @@
+import asyncio
+import time
+from collections import deque
+
+
+class QueueFullError(Exception):
+    """Очередь планировщика переполнена."""
+
+
+class MicroBatcher:
+    """Собирает запросы в батчи и выполняет их одним вызовом модели.
+
+    Запросы копятся, пока не наберётся ``max_batch_size`` элементов или не
+    истечёт окно ``max_wait_ms`` с момента прихода первого из них. Затем
+    ``batch_fn`` получает список входов и должна вернуть список результатов
+    той же длины; каждый вызывающий получает свой результат.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=20, max_queue_size=256, executor=None):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue_size = max_queue_size
+        self.executor = executor
+        self._queue = None
+        self._worker = None
+        self._batch_sizes = deque(maxlen=1000)
+        self._latencies = deque(maxlen=1000)
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, item):
+        """Ставит вход в очередь и ждёт результат его обработки."""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((item, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError("Очередь планировщика переполнена")
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            inputs = [item for item, _, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, inputs)
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            now = time.perf_counter()
+            self.batches += 1
+            self.items += len(batch)
+            self._batch_sizes.append(len(batch))
+            for (_, future, queued_at), result in zip(batch, results):
+                self._latencies.append(now - queued_at)
+                if not future.done():
+                    future.set_result(result)
+
+    def metrics(self):
+        """Текущие настройки и статистика планировщика."""
+        latencies = sorted(self._latencies)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] if latencies else 0.0
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "max_queue_size": self.max_queue_size,
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "batches": self.batches,
+            "items": self.items,
+            "rejected": self.rejected,
+            "avg_batch_size": sum(self._batch_sizes) / len(self._batch_sizes) if self._batch_sizes else 0.0,
+            "p99_latency_ms": p99 * 1000,
+        }
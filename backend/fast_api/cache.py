@@ -0,0 +1,103 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Кэш результатов инференса по хэшу содержимого изображения.
+
+    Первый уровень — LRU в памяти, ограниченный числом записей и объёмом в
+    байтах. Второй — таблица SQLite, переживающая перезапуск сервиса. Каждая
+    запись хранит версию моделей; записи другой версии считаются промахом и
+    удаляются.
+    """
+
+    def __init__(self, version, max_items=10000, max_bytes=64 * 1024 * 1024, db_path=None):
+        self.version = version
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, version TEXT NOT NULL, value TEXT NOT NULL)"
+            )
+            # Устаревшие после обновления моделей записи больше не нужны
+            self._db.execute("DELETE FROM results WHERE version != ?", (version,))
+            self._db.commit()
+
+    @staticmethod
+    def key(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items.move_to_end(key)
+                self.memory_hits += 1
+                return json.loads(entry)
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value FROM results WHERE key = ? AND version = ?", (key, self.version)
+                ).fetchone()
+                if row:
+                    self.disk_hits += 1
+                    self._remember(key, row[0])
+                    return json.loads(row[0])
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        encoded = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, encoded)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, version, value) VALUES (?, ?, ?)",
+                    (key, self.version, encoded),
+                )
+                self._db.commit()
+
+    def _remember(self, key, encoded):
+        if key in self._items:
+            self._bytes -= len(self._items.pop(key))
+        self._items[key] = encoded
+        self._bytes += len(encoded)
+        while self._items and (len(self._items) > self.max_items or self._bytes > self.max_bytes):
+            _, evicted = self._items.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def metrics(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "version": self.version,
+            "items": len(self._items),
+            "bytes": self._bytes,
+            "max_items": self.max_items,
+            "max_bytes": self.max_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+def models_version(*parts):
+    """Строит отпечаток версий моделей для инвалидации кэша."""
+    return hashlib.sha1("|".join(map(str, parts)).encode()).hexdigest()[:16]
@@ -0,0 +1,91 @@
+"""Сравнение точности и скорости бэкенда инференса с эталоном fp32.
+
+Пример:
+    python compare_backends.py --images ../dataset --backend quantized --limit 50
+"""
+import argparse
+import os
+import time
+
+from PIL import Image
+
+import backends
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def jaccard(a, b):
+    a, b = set(a), set(b)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def run_backend(backend, images):
+    """Прогоняет изображения через модели бэкенда и замеряет время стадий."""
+    processor, blip = backends.load_blip(backend)
+    tokenizer, marian = backends.load_marian(backend)
+    yolo = backends.load_yolo(backend)
+    outputs = {"captions": [], "translations": [], "labels": []}
+    seconds = {"caption": 0.0, "translation": 0.0, "detection": 0.0}
+
+    for img in images:
+        start = time.perf_counter()
+        caption = processor.decode(blip.generate(**processor(images=img, return_tensors="pt"))[0],
+                                   skip_special_tokens=True)
+        seconds["caption"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        tokens = tokenizer([caption], return_tensors="pt", padding=True)
+        translation = tokenizer.decode(marian.generate(**tokens)[0], skip_special_tokens=True)
+        seconds["translation"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        labels = {yolo.names[int(cls)] for res in yolo(img, verbose=False) for cls in res.boxes.cls.tolist()}
+        seconds["detection"] += time.perf_counter() - start
+
+        outputs["captions"].append(caption)
+        outputs["translations"].append(translation)
+        outputs["labels"].append(labels)
+
+    return outputs, {stage: total / len(images) * 1000 for stage, total in seconds.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Папка с примерами изображений")
+    parser.add_argument("--backend", required=True, choices=[b for b in backends.BACKENDS if b != "torch"])
+    parser.add_argument("--limit", type=int, default=100, help="Максимум изображений для сравнения")
+    args = parser.parse_args()
+
+    names = sorted(f for f in os.listdir(args.images) if f.lower().endswith(IMAGE_EXTENSIONS))[:args.limit]
+    if not names:
+        parser.error(f"В папке {args.images} нет изображений")
+    images = [Image.open(os.path.join(args.images, name)).convert("RGB") for name in names]
+
+    baseline, baseline_ms = run_backend("torch", images)
+    candidate, candidate_ms = run_backend(args.backend, images)
+
+    def mean(values):
+        return sum(values) / len(values)
+
+    print(f"Изображений: {len(images)}, бэкенд: {args.backend}")
+    for field in ("captions", "translations"):
+        pairs = list(zip(baseline[field], candidate[field]))
+        exact = mean([a == b for a, b in pairs])
+        overlap = mean([jaccard(a.lower().split(), b.lower().split()) for a, b in pairs])
+        print(f"{field}: точное совпадение {exact:.1%}, пересечение слов {overlap:.1%}")
+    print(f"labels: пересечение классов {mean([jaccard(a, b) for a, b in zip(baseline['labels'], candidate['labels'])]):.1%}")
+
+    print("Среднее время на изображение, мс:")
+    for stage in baseline_ms:
+        speedup = baseline_ms[stage] / candidate_ms[stage] if candidate_ms[stage] else 0.0
+        print(f"  {stage}: torch {baseline_ms[stage]:.1f}, {args.backend} {candidate_ms[stage]:.1f} (x{speedup:.2f})")
+
+    for name, a, b in zip(names, baseline["captions"], candidate["captions"]):
+        if a != b:
+            print(f"  {name}: {a!r} -> {b!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Настройки сервиса инференса, читаются из переменных окружения."""
+import os
+
+
+def _int(name, default):
+    return int(os.getenv(name, default))
+
+
+def _float(name, default):
+    return float(os.getenv(name, default))
+
+
+# Предобработка: изображение декодируется один раз в рабочем разрешении
+MAX_IMAGE_PIXELS = _int('MAX_IMAGE_PIXELS', 50_000_000)  # Больше — ответ 413
+PREPROCESS_MAX_SIDE = _int('PREPROCESS_MAX_SIDE', 1600)  # Длинная сторона рабочего буфера
+CAPTION_INPUT_SIZE = _int('CAPTION_INPUT_SIZE', 384)  # Сторона входа BLIP
+DETECTION_INPUT_SIZE = _int('DETECTION_INPUT_SIZE', 640)  # Длинная сторона входа YOLO
+OCR_MAX_SIDE = _int('OCR_MAX_SIDE', PREPROCESS_MAX_SIDE)  # Длинная сторона входа EasyOCR
+
+# Микро-батчинг генерации описаний BLIP
+CAPTION_BATCH_SIZE = _int('CAPTION_BATCH_SIZE', 8)  # Максимальный размер батча
+CAPTION_BATCH_WAIT_MS = _float('CAPTION_BATCH_WAIT_MS', 20)  # Окно ожидания батча, мс
+CAPTION_QUEUE_SIZE = _int('CAPTION_QUEUE_SIZE', 256)  # Максимальная глубина очереди
+
+# Пул потоков для тяжёлых стадий инференса
+INFERENCE_WORKERS = _int('INFERENCE_WORKERS', 3)  # Потоков пула: по одному на параллельную стадию
+INFERENCE_QUEUE_SIZE = _int('INFERENCE_QUEUE_SIZE', 32)  # Максимум задач в работе и ожидании
+RETRY_AFTER_SECONDS = _int('RETRY_AFTER_SECONDS', 5)  # Заголовок Retry-After при перегрузке
+# Потоки torch внутри одной операции; по умолчанию ядра делятся между потоками пула
+TORCH_NUM_THREADS = _int('TORCH_NUM_THREADS', max(1, (os.cpu_count() or 1) // INFERENCE_WORKERS))
+
+# Модели
+BLIP_MODEL = os.getenv('BLIP_MODEL', 'Salesforce/blip-image-captioning-base')
+TRANSLATION_MODEL = os.getenv('TRANSLATION_MODEL', 'Helsinki-NLP/opus-mt-en-ru')
+YOLO_MODEL = os.getenv('YOLO_MODEL', 'yolov8n.pt')
+OCR_LANGUAGES = os.getenv('OCR_LANGUAGES', 'ru,en').split(',')
+
+# Кэш результатов инференса
+CACHE_MAX_ITEMS = _int('CACHE_MAX_ITEMS', 10000)  # Записей в памяти
+CACHE_MAX_BYTES = _int('CACHE_MAX_BYTES', 64 * 1024 * 1024)  # Объём кэша в памяти, байт
+CACHE_DB_PATH = os.getenv('CACHE_DB_PATH', 'inference_cache.sqlite3')  # Пустая строка отключает диск
+# Увеличивается вручную при изменении логики обработки, чтобы сбросить кэш
+CACHE_VERSION = os.getenv('CACHE_VERSION', '8')
+
+# Батчинг и кэширование перевода Marian
+TRANSLATION_BATCH_SIZE = _int('TRANSLATION_BATCH_SIZE', 32)
+TRANSLATION_BATCH_WAIT_MS = _float('TRANSLATION_BATCH_WAIT_MS', 10)
+TRANSLATION_QUEUE_SIZE = _int('TRANSLATION_QUEUE_SIZE', 1024)
+TRANSLATION_CACHE_SIZE = _int('TRANSLATION_CACHE_SIZE', 50000)  # Строк в LRU переводов
+
+# Детекция объектов YOLO
+DETECTION_CONFIDENCE = _float('DETECTION_CONFIDENCE', 0.25)  # Порог уверенности
+DETECTION_MAX_OBJECTS = _int('DETECTION_MAX_OBJECTS', 100)  # Максимум объектов на изображение
+
+# Исправление орфографии в тексте OCR
+SPELL_LANGUAGES = os.getenv('SPELL_LANGUAGES', 'ru,en').split(',')
+SPELL_MAX_EDIT_DISTANCE = _int('SPELL_MAX_EDIT_DISTANCE', 1)  # Больше — точнее, но индекс крупнее
+SPELL_PREFIX_LENGTH = _int('SPELL_PREFIX_LENGTH', 7)  # Длина префикса для индекса удалений
+SPELL_CACHE_SIZE = _int('SPELL_CACHE_SIZE', 100000)  # Слов в LRU исправлений
+
+# Состав сервиса и прогрев моделей
+ENABLED_STAGES = os.getenv('ENABLED_STAGES', 'caption,detection,ocr,embedding').split(',')  # Включённые стадии
+WARMUP_ON_STARTUP = os.getenv('WARMUP_ON_STARTUP', 'True') == 'True'  # Загружать модели в фоне при старте
+
+# Ревизии стадий для версий в ответе (model_versions), например "caption=2,ocr=1":
+# увеличиваются, чтобы пометить результаты стадии устаревшими без смены модели
+STAGE_REVISIONS = dict(
+    item.split('=', 1) for item in os.getenv('STAGE_REVISIONS', '').split(',') if '=' in item
+)
+
+# Бэкенд инференса: torch (fp32), quantized (int8) или onnx (ONNX Runtime)
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch')
+ONNX_CACHE_DIR = os.getenv('ONNX_CACHE_DIR', 'onnx_models')  # Куда сохраняются экспортированные модели
+
+# Пакетная загрузка /upload/batch/
+BATCH_MAX_ITEMS = _int('BATCH_MAX_ITEMS', 500)  # Максимум изображений в одном запросе
+BATCH_CONCURRENCY = _int('BATCH_CONCURRENCY', 8)  # Изображений одного запроса в работе одновременно
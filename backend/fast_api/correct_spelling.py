@@ -1,120 +1,487 @@
-from io import BytesIO
-import easyocr
+import asyncio
+import json
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from typing import List, Optional
 import cv2
 import numpy as np
 from PIL import Image
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import JSONResponse
-from spellchecker import SpellChecker
-from transformers import BlipProcessor, BlipForConditionalGeneration, MarianMTModel, MarianTokenizer
-from ultralytics import YOLO
-
-app = FastAPI()
-reader = easyocr.Reader(['ru', 'en'])
-# Загрузка моделей и процессоров
-blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-translation_tokenizer = MarianTokenizer.from_pretrained("Helsinki-NLP/opus-mt-en-ru")
-translation_model = MarianMTModel.from_pretrained("Helsinki-NLP/opus-mt-en-ru")
-yolo_model = YOLO("yolov8n.pt")
+from fastapi import FastAPI, File, UploadFile, Request, Body, HTTPException, Depends
+from fastapi.responses import JSONResponse, StreamingResponse
 
+import config
+from archives import ArchiveError, archive_members
+from batching import MicroBatcher, QueueFullError
+from cache import ResultCache, models_version
+from detection import ObjectDetector
+from embeddings import VisionEmbedder
+from options import InferenceOptions
+from pipeline import Pipeline
+from preprocess import ImageTooLargeError, prepare_image
+from registry import registry
+from translation import Translator
+from workers import InferenceExecutor, configure_torch_threads
 
-# Функция для исправления орфографии
-def correct_spelling(text, lang=None):
-    if not text or lang is None:
-        ru_chars = sum(1 for c in text if 'а' <= c.lower() <= 'я' or c.lower() == 'ё')
-        en_chars = sum(1 for c in text if 'a' <= c.lower() <= 'z')
+# Модели, необходимые каждой стадии
+STAGE_MODELS = {
+    "caption": ["embedder", "translator"],
+    "detection": ["detector"],
+    "ocr": ["easyocr", "spelling"],
+    "embedding": ["embedder"],
+}
+REQUIRED_MODELS = [name for stage in config.ENABLED_STAGES for name in STAGE_MODELS[stage]]
 
-        if ru_chars > en_chars:
-            lang = 'ru'
-        else:
-            lang = 'en'
 
-    try:
-        spell = SpellChecker(language=lang)
+def stage_version(stage, *parts):
+    """Версия стадии: модели и параметры, от которых зависит её результат, плюс ревизия."""
+    revision = config.STAGE_REVISIONS.get(stage)
+    version = "/".join(str(part) for part in parts)
+    return f"{version}@{revision}" if revision else version
 
-        words = text.split()
-        corrected_words = []
 
-        for word in words:
-            leading_punct = ""
-            trailing_punct = ""
+# Сохраняются вместе с результатом, чтобы после обновления моделей пересчитать только устаревшие стадии
+STAGE_VERSIONS = {
+    "caption": stage_version("caption", config.BLIP_MODEL, config.TRANSLATION_MODEL, config.INFERENCE_BACKEND),
+    "detection": stage_version(
+        "detection", config.YOLO_MODEL, config.TRANSLATION_MODEL, config.INFERENCE_BACKEND,
+        f"conf={config.DETECTION_CONFIDENCE}", f"max={config.DETECTION_MAX_OBJECTS}",
+    ),
+    "ocr": stage_version(
+        "ocr", "easyocr", ",".join(config.OCR_LANGUAGES), f"spell={config.SPELL_MAX_EDIT_DISTANCE}"
+    ),
+    "embedding": stage_version("embedding", config.BLIP_MODEL, config.INFERENCE_BACKEND),
+}
 
-            while word and not word[0].isalnum():
-                leading_punct += word[0]
-                word = word[1:]
 
-            while word and not word[-1].isalnum():
-                trailing_punct = word[-1] + trailing_punct
-                word = word[:-1]
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if config.WARMUP_ON_STARTUP:
+        # Прогрев идёт в фоне: сервис сразу принимает запросы, а /health/ сообщает о готовности
+        asyncio.get_running_loop().run_in_executor(None, registry.warm_up, REQUIRED_MODELS)
+    yield
 
-            if not word or any(c.isdigit() for c in word):
-                corrected_words.append(leading_punct + word + trailing_punct)
-                continue
 
-            if not spell.known([word]):
-                correction = spell.correction(word)
-                if correction:
-                    word = correction
+app = FastAPI(lifespan=lifespan)
+configure_torch_threads(config.TORCH_NUM_THREADS)
+inference_executor = InferenceExecutor(config.INFERENCE_WORKERS, config.INFERENCE_QUEUE_SIZE)
 
-            corrected_words.append(leading_punct + word + trailing_punct)
+result_cache = ResultCache(
+    models_version(
+        config.BLIP_MODEL,
+        config.TRANSLATION_MODEL,
+        config.YOLO_MODEL,
+        ",".join(config.OCR_LANGUAGES),
+        config.DETECTION_CONFIDENCE,
+        config.DETECTION_MAX_OBJECTS,
+        config.SPELL_MAX_EDIT_DISTANCE,
+        ",".join(config.ENABLED_STAGES),
+        config.INFERENCE_BACKEND,
+        *sorted(config.STAGE_REVISIONS.items()),
+        config.CACHE_VERSION,
+    ),
+    max_items=config.CACHE_MAX_ITEMS,
+    max_bytes=config.CACHE_MAX_BYTES,
+    db_path=config.CACHE_DB_PATH,
+)
 
-        return ' '.join(corrected_words)
-    except Exception as e:
-        print(f"Ошибка при исправлении орфографии: {e}")
-        return text
+registry.register("translator", lambda r: Translator(
+    *r.get("marian"),
+    cache_size=config.TRANSLATION_CACHE_SIZE,
+    max_batch_size=config.TRANSLATION_BATCH_SIZE,
+    max_wait_ms=config.TRANSLATION_BATCH_WAIT_MS,
+    max_queue_size=config.TRANSLATION_QUEUE_SIZE,
+    executor=inference_executor.pool,
+))
+registry.register("embedder", lambda r: VisionEmbedder(*r.get("blip")))
+registry.register("detector", lambda r: ObjectDetector(
+    r.get("yolo"),
+    r.get("translator").translate_batch,
+    confidence=config.DETECTION_CONFIDENCE,
+    max_objects=config.DETECTION_MAX_OBJECTS,
+))
+
+
+def generate_captions(items):
+    """Описания и эмбеддинги для батча ``(изображение, нужно ли описание)`` одним вызовом BLIP.
 
+    Если описание не нужно ни одному изображению батча, выполняется только
+    визуальный энкодер.
+    """
+    images = [image for image, _ in items]
+    captions, embeddings = registry.get("embedder").run(images, with_captions=any(want for _, want in items))
+    return [
+        (caption if want else None, [round(x, 5) for x in embedding.tolist()])
+        for (_, want), caption, embedding in zip(items, captions, embeddings)
+    ]
 
-# Функция для распознавания текста
-def translate_text(text: str) -> str:
-    tokens = translation_tokenizer(text, return_tensors="pt", padding=True)
-    out = translation_model.generate(**tokens)
-    return translation_tokenizer.decode(out[0], skip_special_tokens=True)
 
+caption_batcher = MicroBatcher(
+    generate_captions,
+    max_batch_size=config.CAPTION_BATCH_SIZE,
+    max_wait_ms=config.CAPTION_BATCH_WAIT_MS,
+    max_queue_size=config.CAPTION_QUEUE_SIZE,
+    executor=inference_executor.pool,
+)
 
-def extract_text_easyocr(image: Image.Image):
-    """Распознаёт текст на изображении с помощью EasyOCR."""
+
+# Функция для исправления орфографии
+def correct_spelling(text, lang=None):
     try:
-        # Преобразуем изображение из PIL в NumPy-массив
-        image_cv = np.array(image)
+        return registry.get("spelling").correct(text, lang)
+    except Exception as e:
+        print(f"Ошибка при исправлении орфографии: {e}")
+        return text
 
-        # Проверяем, если изображение в формате RGBA, конвертируем в RGB
-        if image_cv.shape[-1] == 4:
-            image_cv = cv2.cvtColor(image_cv, cv2.COLOR_RGBA2RGB)
 
-        # Преобразуем в чёрно-белый
-        gray = cv2.cvtColor(image_cv, cv2.COLOR_RGB2GRAY)
+def extract_text_easyocr(image, spelling=True, lang=None):
+    """Распознаёт текст на изображении с помощью EasyOCR.
+
+    ``image`` — ``PreparedImage`` или PIL-изображение.
+    """
+    try:
+        if isinstance(image, Image.Image):
+            # Преобразуем изображение из PIL в чёрно-белый NumPy-массив
+            gray = cv2.cvtColor(np.array(image.convert("RGB")), cv2.COLOR_RGB2GRAY)
+        else:
+            gray = image.ocr_input(config.OCR_MAX_SIDE)
 
         # Распознаём текст
-        results = reader.readtext(gray, detail=0)
+        results = registry.get("easyocr").readtext(gray, detail=0)
 
         if results:
-            corrected = correct_spelling(" ".join(results))  # Исправляем орфографию
+            if not spelling:
+                return " ".join(results)
+            corrected = correct_spelling(" ".join(results), lang)  # Исправляем орфографию
             return corrected
         else:
             return "Текст не найден"
     except Exception as e:
         return f"Ошибка распознавания: {e}"
 
+
+pipeline = Pipeline()
+
+
+def blip_result(img, options):
+    """Общий для стадий caption и embedding запрос к BLIP: энкодер выполняется один раз."""
+    task = img.memo.get("blip")
+    if task is None:
+        item = (img.caption_input(config.CAPTION_INPUT_SIZE), "caption" in options.stages)
+        task = img.memo["blip"] = asyncio.ensure_future(caption_batcher.submit(item))
+    return task
+
+
+@pipeline.stage("caption", enabled="caption" in config.ENABLED_STAGES)
+async def caption_stage(img, options):
+    caption, _ = await blip_result(img, options)
+    if not options.translate:
+        return caption
+    translator = await registry.aget("translator")
+    return await translator.translate(caption)
+
+
+@pipeline.stage("detection", enabled="detection" in config.ENABLED_STAGES)
+async def detection_stage(img, options):
+    detector = await registry.aget("detector")
+
+    def detect():
+        image, scale = img.detection_input(config.DETECTION_INPUT_SIZE)
+        return detector.detect(image, options.translate, scale)
+
+    return await inference_executor.run(detect)
+
+
+@pipeline.stage("embedding", enabled="embedding" in config.ENABLED_STAGES)
+async def embedding_stage(img, options):
+    _, embedding = await blip_result(img, options)
+    return embedding
+
+
+@pipeline.stage("ocr", enabled="ocr" in config.ENABLED_STAGES)
+async def ocr_stage(img, options):
+    return await inference_executor.run(extract_text_easyocr, img, options.spelling, options.text_lang)
+
+
+@app.exception_handler(ImageTooLargeError)
+async def image_too_large_handler(request: Request, exc: ImageTooLargeError):
+    return JSONResponse({"detail": str(exc)}, status_code=413)
+
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(
+        {"detail": str(exc)},
+        status_code=503,
+        headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)},
+    )
+
+
+def get_options(
+    stages: Optional[str] = None,
+    translate: bool = True,
+    spelling: bool = True,
+    text_lang: Optional[str] = None,
+):
+    """Параметры запроса: ``?stages=ocr&translate=false&text_lang=en``."""
+    selected = config.ENABLED_STAGES if stages is None else [s.strip() for s in stages.split(",") if s.strip()]
+    unknown = set(selected) - set(config.ENABLED_STAGES)
+    if unknown or not selected:
+        raise HTTPException(
+            400, f"Недоступные стадии: {', '.join(sorted(unknown)) or '-'}; доступны: {', '.join(config.ENABLED_STAGES)}"
+        )
+    if text_lang is not None and text_lang not in config.SPELL_LANGUAGES:
+        raise HTTPException(400, f"Язык текста должен быть одним из: {', '.join(config.SPELL_LANGUAGES)}")
+    return InferenceOptions(selected, translate=translate, spelling=spelling, text_lang=text_lang)
+
+
+def result_version(stage, options):
+    """Версия стадии для конкретного результата: с параметрами запроса, отличными от умолчаний."""
+    parts = options.version_options(stage)
+    return f"{STAGE_VERSIONS[stage]}+{','.join(parts)}" if parts else STAGE_VERSIONS[stage]
+
+
+def build_result(results, options):
+    """Собирает ответ сервиса из результатов стадий.
+
+    Поля пропущенных стадий равны ``null``, а их имена перечислены в ``skipped``.
+    """
+    detection = results.get("detection") or {"objects": None, "object_counts": None, "detected_objects": None}
+    return {
+        "description": results.get("caption"),
+        **detection,
+        "text": results.get("ocr"),
+        "embedding": results.get("embedding"),
+        "model_versions": {stage: result_version(stage, options) for stage in results},
+        "skipped": [stage for stage in STAGE_MODELS if stage not in results],
+    }
+
+
+async def cache_result(key, result):
+    # Ошибки OCR не кэшируем, чтобы повторная загрузка могла их исправить
+    if not (result["text"] or "").startswith("Ошибка распознавания"):
+        await asyncio.to_thread(result_cache.set, key, result)
+
+
+async def decode_image(data: bytes):
+    """Декодирует изображение вне цикла событий в общий буфер для всех стадий."""
+    return await asyncio.to_thread(prepare_image, data, config.PREPROCESS_MAX_SIDE, config.MAX_IMAGE_PIXELS)
+
+
+def cache_key(data: bytes, options):
+    return f"{result_cache.key(data)}:{options.cache_suffix()}"
+
+
+def _lookup(data: bytes, options):
+    key = cache_key(data, options)
+    return key, result_cache.get(key)
+
+
+async def lookup_cache(data: bytes, options):
+    """Ключ и результат из кэша; хэширование и чтение SQLite — вне цикла событий."""
+    return await asyncio.to_thread(_lookup, data, options)
+
+
+async def analyze_image(data: bytes, options):
+    """Обработка одного изображения выбранными стадиями с учётом кэша результатов."""
+    key, cached = await lookup_cache(data, options)
+    if cached is not None:
+        return {**cached, "cached": True}
+
+    # Изображение декодируется один раз, стадии выполняются параллельно
+    img = await decode_image(data)
+    results, timings = await pipeline.run(img, only=options.stages, options=options)
+    result = build_result(results, options)
+    await cache_result(key, result)
+    return {**result, "timings": timings, "cached": False}
+
+
+def format_event(event, payload, sse):
+    data = json.dumps(payload, ensure_ascii=False)
+    if sse:
+        return f"event: {event}\ndata: {data}\n\n"
+    return json.dumps({"event": event, **payload}, ensure_ascii=False) + "\n"
+
+
+async def stream_stages(data: bytes, sse: bool, options):
+    """Отдаёт результат каждой стадии по готовности, затем итоговую запись ``complete``."""
+    key, cached = await lookup_cache(data, options)
+    if cached is not None:
+        yield format_event("complete", {**cached, "cached": True}, sse)
+        return
+
+    results, timings = {}, {}
+    try:
+        img = await decode_image(data)
+        async for name, result, elapsed in pipeline.stream(img, only=options.stages, options=options):
+            results[name] = result
+            timings[name] = elapsed
+            yield format_event("stage", {"stage": name, "result": result, "elapsed_ms": elapsed}, sse)
+    except Exception as e:
+        yield format_event("error", {"error": str(e)}, sse)
+        return
+
+    result = build_result(results, options)
+    await cache_result(key, result)
+    yield format_event("complete", {**result, "timings": timings, "cached": False}, sse)
+
+
 @app.post("/upload/")
-async def process_image(image: UploadFile = File(...)):
-    img = Image.open(BytesIO(await image.read())).convert("RGB")
-    inputs = blip_processor(img, return_tensors="pt")
-    caption = blip_processor.decode(blip_model.generate(**inputs)[0], skip_special_tokens=True)
-    translated_caption = translate_text(caption)
-    results = yolo_model(img)
-    names = []
-    for res in results:
-        for box in res.boxes:
-            names.append(yolo_model.names[int(box.cls)])
-    detected_objects = translate_text(", ".join(sorted(set(names))))
-    # Обработка текста на изображении
-    text = extract_text_easyocr(img)
-    return JSONResponse({
-        "description": translated_caption,
-        "detected_objects": detected_objects,
-        "text": text
-    })
+async def process_image(
+    image: UploadFile = File(...),
+    stream: Optional[str] = None,
+    options: InferenceOptions = Depends(get_options),
+):
+    """Обработка изображения.
+
+    По умолчанию возвращает один JSON. С ``?stream=ndjson`` или ``?stream=sse``
+    результаты стадий отправляются по мере готовности, последней идёт
+    запись ``complete`` с полным ответом. Набор стадий и перевод задаются
+    параметрами ``stages``, ``translate``, ``spelling`` и ``text_lang``.
+    """
+    data = await image.read()
+    if stream is None:
+        return JSONResponse(await analyze_image(data, options))
+    if stream not in ("ndjson", "sse"):
+        raise HTTPException(400, "Параметр stream принимает значения ndjson или sse")
+
+    sse = stream == "sse"
+    return StreamingResponse(
+        stream_stages(data, sse, options),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_batch(items, options, cleanup=None):
+    """Обрабатывает изображения параллельно и отдаёт по строке NDJSON на каждое по готовности.
+
+    ``items`` — список ``(имя файла, функция чтения байтов)``. Одновременно в
+    работе не больше ``BATCH_CONCURRENCY`` изображений: этого хватает, чтобы
+    заполнять батчи BLIP и Marian, не переполняя очередь. Ошибка одного
+    изображения не прерывает обработку остальных.
+    """
+    semaphore = asyncio.Semaphore(config.BATCH_CONCURRENCY)
+
+    async def handle(index, filename, read):
+        async with semaphore:
+            try:
+                result = await analyze_image(await asyncio.to_thread(read), options)
+                return {"index": index, "filename": filename, **result}
+            except QueueFullError as e:
+                # Перегрузка, а не ошибка изображения: status как у ответа 503, клиент повторит позже
+                return {"index": index, "filename": filename, "error": str(e), "status": 503}
+            except Exception as e:
+                return {"index": index, "filename": filename, "error": str(e)}
+
+    tasks = [asyncio.ensure_future(handle(index, *item)) for index, item in enumerate(items)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield json.dumps(await task, ensure_ascii=False) + "\n"
+    finally:
+        # Клиент мог отключиться: незавершённые изображения больше не нужны
+        for task in tasks:
+            task.cancel()
+        if cleanup is not None:
+            cleanup()
+
+
+@app.post("/upload/batch/")
+async def process_batch(
+    images: List[UploadFile] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    options: InferenceOptions = Depends(get_options),
+):
+    """Пакетная обработка: несколько файлов ``images`` и/или zip/tar архив ``archive``.
+
+    Ответ — поток NDJSON, по строке на изображение в порядке готовности;
+    поле ``index`` указывает позицию изображения в запросе. Изображения, не
+    принятые из-за перегрузки, приходят с ``error`` и ``"status": 503``.
+    """
+    # Файлы формы закрываются до начала отправки потокового ответа, поэтому
+    # изображения читаются сразу, а архив копируется во временный файл сервиса
+    items = []
+    for image in images or []:
+        data = await image.read()
+        items.append((image.filename, lambda data=data: data))
+
+    spool = None
+    if archive is not None:
+        spool = tempfile.TemporaryFile()
+        await asyncio.to_thread(shutil.copyfileobj, archive.file, spool)
+        spool.seek(0)
+        try:
+            items += archive_members(spool, archive.filename or "")
+        except ArchiveError as e:
+            spool.close()
+            raise HTTPException(400, str(e))
+
+    error = None
+    if not items:
+        error = HTTPException(400, "Не передано ни одного изображения")
+    elif len(items) > config.BATCH_MAX_ITEMS:
+        error = HTTPException(413, f"Слишком много изображений: {len(items)} > {config.BATCH_MAX_ITEMS}")
+    if error is not None:
+        if spool is not None:
+            spool.close()
+        raise error
+
+    return StreamingResponse(
+        stream_batch(items, options, cleanup=spool.close if spool is not None else None),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.post("/translate/")
+async def translate_bulk(texts: List[str] = Body(...)):
+    """Переводит список строк за один вызов, например для переобработки."""
+    translator = await registry.aget("translator")
+    translations = await inference_executor.run(translator.translate_batch, texts)
+    return {"translations": translations}
+
+
+@app.post("/spelling/")
+async def correct_spelling_bulk(texts: List[str] = Body(...), lang: Optional[str] = None):
+    """Исправляет орфографию в списке строк OCR за один вызов."""
+    spelling_service = await registry.aget("spelling")
+    corrected = await inference_executor.run(spelling_service.correct_many, texts, lang)
+    return {"texts": corrected}
+
+
+@app.get("/health/")
+async def health():
+    """Готовность сервиса: 200, когда загружены модели всех включённых стадий."""
+    ready = registry.ready(REQUIRED_MODELS)
+    return JSONResponse(
+        {
+            "status": "ready" if ready else "loading",
+            "stages": config.ENABLED_STAGES,
+            "backend": config.INFERENCE_BACKEND,
+            "models": registry.status(),
+        },
+        status_code=200 if ready else 503,
+    )
+
+
+@app.get("/versions/")
+async def versions():
+    """Текущие версии включённых стадий: по ним клиенты находят устаревшие результаты."""
+    return {stage: STAGE_VERSIONS[stage] for stage in config.ENABLED_STAGES}
+
+
+@app.get("/metrics/")
+async def metrics():
+    data = {
+        "caption_batcher": caption_batcher.metrics(),
+        "inference_executor": inference_executor.metrics(),
+        "pipeline": pipeline.metrics(),
+        "result_cache": result_cache.metrics(),
+    }
+    for name in ("translator", "spelling"):
+        component = registry.loaded(name)
+        if component is not None:
+            data[name] = component.metrics()
+    return data
 
 
 if __name__ == "__main__":
@@ -0,0 +1,41 @@
+from collections import Counter
+
+
+class ObjectDetector:
+    """Детекция объектов YOLO со структурированным результатом.
+
+    Словарь классов YOLO фиксирован, поэтому русские названия переводятся
+    один раз при создании детектора, а не на каждый запрос.
+    """
+
+    def __init__(self, model, translate_batch, confidence=0.25, max_objects=100):
+        self.model = model
+        self.confidence = confidence
+        self.max_objects = max_objects
+        names = [model.names[i] for i in sorted(model.names)]
+        self.labels_ru = dict(zip(names, translate_batch(names)))
+
+    def detect(self, image, translate=True, scale=1.0):
+        """Возвращает найденные объекты, количество по классам и строку для совместимости.
+
+        С ``translate=False`` количество и строка строятся по английским названиям.
+        ``scale`` переводит рамки уменьшенного входа в координаты исходного изображения.
+        """
+        objects = []
+        for res in self.model(image, conf=self.confidence, max_det=self.max_objects, verbose=False):
+            boxes = res.boxes
+            for cls, conf, xyxy in zip(boxes.cls.tolist(), boxes.conf.tolist(), boxes.xyxy.tolist()):
+                label = self.model.names[int(cls)]
+                objects.append({
+                    "label": label,
+                    "label_ru": self.labels_ru.get(label, label),
+                    "confidence": round(conf, 4),
+                    "box": [round(v * scale, 1) for v in xyxy],
+                })
+
+        counts = Counter(obj["label_ru" if translate else "label"] for obj in objects)
+        return {
+            "objects": objects,
+            "object_counts": dict(counts),
+            "detected_objects": ", ".join(sorted(counts)),
+        }
@@ -0,0 +1,43 @@
+import threading
+
+import numpy as np
+
+
+class VisionEmbedder:
+    """Описания BLIP и эмбеддинги изображений за один проход визуального энкодера.
+
+    Энкодер и так выполняется при генерации описания, поэтому его выход
+    (``pooler_output``) перехватывается forward-хуком, а не считается второй
+    раз. Хук пишет в thread-local, так что параллельные вызовы из разных
+    потоков пула не смешивают результаты. Если описания не нужны,
+    вызывается только энкодер.
+    """
+
+    def __init__(self, processor, model):
+        self.processor = processor
+        self.model = model
+        self._local = threading.local()
+        model.vision_model.register_forward_hook(self._capture)
+
+    @property
+    def dim(self):
+        return self.model.config.vision_config.hidden_size
+
+    def _capture(self, module, inputs, output):
+        self._local.pooled = output[1]
+
+    def run(self, images, with_captions=True):
+        """Возвращает описания (или ``None``) и L2-нормированные эмбеддинги float32."""
+        import torch
+
+        inputs = self.processor(images=images, return_tensors="pt")
+        with torch.no_grad():
+            if with_captions:
+                out = self.model.generate(**inputs)
+                captions = self.processor.batch_decode(out, skip_special_tokens=True)
+            else:
+                self.model.vision_model(inputs["pixel_values"])
+                captions = [None] * len(images)
+        pooled = self._local.pooled.float().numpy()
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return captions, pooled / np.maximum(norms, 1e-12)
@@ -1,15 +1,12 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.responses import JSONResponse
-from transformers import BlipProcessor, BlipForConditionalGeneration
 from PIL import Image
 import io
 from googletrans import Translator
 
-app = FastAPI()
+from registry import registry
 
-# Load model and processor once during startup
-processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+app = FastAPI()
 
 # Создаём объект переводчика
 translator = Translator()
@@ -21,6 +18,7 @@ async def generate_description(image_data):
         image = Image.open(io.BytesIO(image_data)).convert("RGB")
 
         # Process and generate caption
+        processor, model = registry.get("blip")
         inputs = processor(image, return_tensors="pt")
         out = model.generate(**inputs)
         description = processor.decode(out[0], skip_special_tokens=True)
@@ -1,50 +1,88 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.responses import JSONResponse
-from transformers import BlipProcessor, BlipForConditionalGeneration, MarianMTModel, MarianTokenizer
-from ultralytics import YOLO
 from PIL import Image
 from io import BytesIO
 
+import config
+from batching import MicroBatcher, QueueFullError
+from registry import registry
+from workers import InferenceExecutor, configure_torch_threads
+
 app = FastAPI()
+configure_torch_threads(config.TORCH_NUM_THREADS)
+inference_executor = InferenceExecutor(config.INFERENCE_WORKERS, config.INFERENCE_QUEUE_SIZE)
+
+def generate_captions(images):
+    blip_processor, blip_model = registry.get("blip")
+    inputs = blip_processor(images=images, return_tensors="pt")
+    out = blip_model.generate(**inputs)
+    return blip_processor.batch_decode(out, skip_special_tokens=True)
 
-# Загрузка моделей и процессоров
-blip_processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-blip_model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
-translation_tokenizer = MarianTokenizer.from_pretrained("Helsinki-NLP/opus-mt-en-ru")
-translation_model = MarianMTModel.from_pretrained("Helsinki-NLP/opus-mt-en-ru")
-yolo_model = YOLO("yolov8n.pt")
+caption_batcher = MicroBatcher(
+    generate_captions,
+    max_batch_size=config.CAPTION_BATCH_SIZE,
+    max_wait_ms=config.CAPTION_BATCH_WAIT_MS,
+    max_queue_size=config.CAPTION_QUEUE_SIZE,
+    executor=inference_executor.pool,
+)
 
 def translate_text(text: str) -> str:
+    translation_tokenizer, translation_model = registry.get("marian")
     tokens = translation_tokenizer(text, return_tensors="pt", padding=True)
     out = translation_model.generate(**tokens)
     return translation_tokenizer.decode(out[0], skip_special_tokens=True)
 
+def detect_objects(image):
+    yolo_model = registry.get("yolo")
+    results = yolo_model(image)
+    names = []
+    for res in results:
+        for box in res.boxes:
+            names.append(yolo_model.names[int(box.cls)])
+    return sorted(set(names))
+
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(
+        {"detail": str(exc)},
+        status_code=503,
+        headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)},
+    )
+
 @app.post("/upload/")
 async def process_image(image: UploadFile = File(...)):
     try:
         img = Image.open(BytesIO(await image.read())).convert("RGB")
 
         # Генерация описания
-        inputs = blip_processor(img, return_tensors="pt")
-        caption = blip_processor.decode(blip_model.generate(**inputs)[0], skip_special_tokens=True)
-        translated_caption = translate_text(caption)
+        caption = await caption_batcher.submit(img)
+        translated_caption = await inference_executor.run(translate_text, caption)
 
         # Обнаружение объектов
-        results = yolo_model(img)
-        names = []
-        for res in results:
-            for box in res.boxes:
-                names.append(yolo_model.names[int(box.cls)])
-        detected_objects = translate_text(", ".join(sorted(set(names))))
+        names = await inference_executor.run(detect_objects, img)
+        detected_objects = await inference_executor.run(translate_text, ", ".join(names))
 
         return JSONResponse({
             "description": translated_caption,
             "detected_objects": detected_objects,
             "text": "Тут будет распознанный текст"
         })
+    except QueueFullError:
+        raise
     except Exception as e:
         raise HTTPException(500, f"Ошибка обработки изображения: {e}")
 
+@app.get("/health/")
+async def health():
+    return {"models": registry.status()}
+
+@app.get("/metrics/")
+async def metrics():
+    return {
+        "caption_batcher": caption_batcher.metrics(),
+        "inference_executor": inference_executor.metrics(),
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,34 @@
+class InferenceOptions:
+    """Параметры обработки, выбранные клиентом для конкретного запроса.
+
+    * ``stages`` — запускаемые стадии (по умолчанию все включённые);
+    * ``translate`` — переводить описание и объекты на русский;
+    * ``spelling`` — исправлять орфографию в тексте OCR;
+    * ``text_lang`` — язык текста для исправления орфографии (``None`` — определить).
+    """
+
+    def __init__(self, stages, translate=True, spelling=True, text_lang=None):
+        self.stages = tuple(stages)
+        self.translate = translate
+        self.spelling = spelling
+        self.text_lang = text_lang
+
+    def version_options(self, stage):
+        """Параметры, влияющие на результат стадии, если они отличаются от умолчаний.
+
+        Дописываются к версии стадии в ``model_versions``: такой результат не
+        совпадает с ``/versions/`` и считается устаревшим при пересчёте.
+        """
+        parts = []
+        if stage in ("caption", "detection") and not self.translate:
+            parts.append("translate=0")
+        if stage == "ocr":
+            if not self.spelling:
+                parts.append("spelling=0")
+            elif self.text_lang:
+                parts.append(f"lang={self.text_lang}")
+        return parts
+
+    def cache_suffix(self):
+        """Часть ключа кэша: разные параметры дают разные результаты."""
+        return f"{','.join(sorted(self.stages))}|t={int(self.translate)}|s={int(self.spelling)}|l={self.text_lang or ''}"
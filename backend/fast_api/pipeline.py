@@ -0,0 +1,68 @@
+import asyncio
+import time
+from collections import defaultdict
+
+
+class Pipeline:
+    """Запускает независимые стадии обработки изображения параллельно.
+
+    Стадия — асинхронная функция, принимающая декодированное изображение и
+    именованные параметры запроса. ``run`` возвращает словарь результатов по
+    имени стадии и время выполнения каждой стадии в миллисекундах. Параметр
+    ``only`` ограничивает набор запускаемых стадий.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._calls = defaultdict(int)
+        self._total_ms = defaultdict(float)
+
+    def stage(self, name, enabled=True):
+        """Декоратор, регистрирующий стадию под именем ``name``, если она включена."""
+        def decorator(fn):
+            if enabled:
+                self.stages[name] = fn
+            return fn
+        return decorator
+
+    def _selected(self, only):
+        return {name: fn for name, fn in self.stages.items() if only is None or name in only}
+
+    async def _timed(self, name, fn, image, context):
+        start = time.perf_counter()
+        result = await fn(image, **context)
+        elapsed = (time.perf_counter() - start) * 1000
+        self._calls[name] += 1
+        self._total_ms[name] += elapsed
+        return result, elapsed
+
+    async def run(self, image, only=None, **context):
+        stages = self._selected(only)
+        names = list(stages)
+        outcomes = await asyncio.gather(*(self._timed(name, stages[name], image, context) for name in names))
+        results = {name: result for name, (result, _) in zip(names, outcomes)}
+        timings = {name: round(elapsed, 1) for name, (_, elapsed) in zip(names, outcomes)}
+        return results, timings
+
+    async def stream(self, image, only=None, **context):
+        """Запускает стадии параллельно и отдаёт ``(имя, результат, мс)`` по мере готовности."""
+        tasks = {
+            asyncio.ensure_future(self._timed(name, fn, image, context)): name
+            for name, fn in self._selected(only).items()
+        }
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result, elapsed = task.result()
+                    yield tasks[task], result, round(elapsed, 1)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def metrics(self):
+        return {
+            name: {"calls": self._calls[name], "avg_ms": self._total_ms[name] / self._calls[name]}
+            for name in self._calls
+        }
@@ -0,0 +1,77 @@
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class ImageTooLargeError(ValueError):
+    """Изображение превышает допустимое число пикселей."""
+
+
+class PreparedImage:
+    """Изображение, декодированное один раз и общее для всех стадий.
+
+    Хранит один RGB-буфер рабочего разрешения, доступный только для чтения,
+    поэтому стадии могут работать с ним параллельно. Вход каждой модели
+    строится из него: сначала уменьшение, затем смена цветового пространства,
+    чтобы копировать как можно меньше данных.
+    """
+
+    def __init__(self, rgb, original_size):
+        rgb.flags.writeable = False
+        self.rgb = rgb
+        self.original_size = original_size
+        self.memo = {}  # Промежуточные результаты, общие для нескольких стадий
+
+    @property
+    def size(self):
+        height, width = self.rgb.shape[:2]
+        return width, height
+
+    def _fit(self, array, max_side):
+        """Уменьшает массив так, чтобы длинная сторона не превышала ``max_side``."""
+        height, width = array.shape[:2]
+        ratio = max_side / max(width, height)
+        if ratio >= 1:
+            return array
+        size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        return cv2.resize(array, size, interpolation=cv2.INTER_AREA)
+
+    def caption_input(self, size):
+        """Квадрат ``size``×``size`` RGB: процессор BLIP всё равно приводит вход к нему."""
+        return cv2.resize(self.rgb, (size, size), interpolation=cv2.INTER_AREA)
+
+    def detection_input(self, max_side):
+        """BGR-массив для YOLO и коэффициент пересчёта рамок в исходные координаты."""
+        small = self._fit(self.rgb, max_side)
+        scale = self.original_size[0] / small.shape[1]
+        return cv2.cvtColor(small, cv2.COLOR_RGB2BGR), scale
+
+    def ocr_input(self, max_side):
+        """Полутоновый массив для EasyOCR; уменьшается уже один канал."""
+        gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+        return self._fit(gray, max_side)
+
+
+def prepare_image(data: bytes, max_side: int, max_pixels: int):
+    """Декодирует изображение сразу в рабочем разрешении.
+
+    Размер проверяется по заголовку до декодирования. Для JPEG ``draft``
+    включает масштабирование в декодере (1/2–1/8), так что крупные снимки
+    не разворачиваются в память целиком; остальные форматы уменьшаются
+    после декодирования.
+    """
+    image = Image.open(BytesIO(data))
+    original_size = image.size
+    if original_size[0] * original_size[1] > max_pixels:
+        raise ImageTooLargeError(
+            f"Изображение {original_size[0]}x{original_size[1]} больше допустимых {max_pixels} пикселей"
+        )
+
+    image.draft("RGB", (max_side, max_side))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+    return PreparedImage(np.asarray(image), original_size)
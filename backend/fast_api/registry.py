@@ -0,0 +1,153 @@
+"""Общий реестр моделей для сервисов инференса.
+
+Модели загружаются при первом обращении или фоновым прогревом, а не при
+импорте модуля, поэтому сервис стартует быстро и держит в памяти только
+используемые модели.
+"""
+import asyncio
+import threading
+import time
+
+import backends
+import config
+
+
+class ModelRegistry:
+    """Ленивая загрузка моделей с прогревом и отчётом о готовности."""
+
+    def __init__(self):
+        self._loaders = {}
+        self._warmups = {}
+        self._instances = {}
+        self._locks = {}
+        self._status = {}
+        self._errors = {}
+        self._load_seconds = {}
+
+    def register(self, name, loader, warmup=None):
+        """Регистрирует модель: ``loader(registry)`` создаёт её, ``warmup(model)`` прогревает."""
+        self._loaders[name] = loader
+        self._warmups[name] = warmup
+        self._locks[name] = threading.Lock()
+        self._status[name] = "not_loaded"
+
+    def get(self, name):
+        """Возвращает модель, загружая её при первом обращении."""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self._locks[name]:
+            if name in self._instances:
+                return self._instances[name]
+            self._status[name] = "loading"
+            start = time.perf_counter()
+            try:
+                instance = self._loaders[name](self)
+                warmup = self._warmups[name]
+                if warmup is not None:
+                    # Пробный прогон, чтобы первый настоящий запрос не платил за аллокации
+                    warmup(instance)
+            except Exception as e:
+                self._status[name] = "failed"
+                self._errors[name] = str(e)
+                raise
+            self._load_seconds[name] = round(time.perf_counter() - start, 2)
+            self._instances[name] = instance
+            self._status[name] = "ready"
+            self._errors.pop(name, None)
+            return instance
+
+    async def aget(self, name):
+        """То же, что ``get``, но загрузка не блокирует цикл событий."""
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+        return await asyncio.to_thread(self.get, name)
+
+    def loaded(self, name):
+        """Возвращает модель, только если она уже загружена."""
+        return self._instances.get(name)
+
+    def warm_up(self, names):
+        """Загружает и прогревает перечисленные модели, не прерываясь на ошибках."""
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Не удалось загрузить модель {name}: {e}")
+
+    def ready(self, names):
+        return all(self._status.get(name) == "ready" for name in names)
+
+    def status(self):
+        return {
+            name: {
+                "status": status,
+                "load_seconds": self._load_seconds.get(name),
+                "error": self._errors.get(name),
+            }
+            for name, status in self._status.items()
+        }
+
+
+def _load_blip(registry):
+    return backends.load_blip(config.INFERENCE_BACKEND)
+
+
+def _warmup_blip(blip):
+    from PIL import Image
+
+    processor, model = blip
+    inputs = processor(images=Image.new("RGB", (64, 64)), return_tensors="pt")
+    model.generate(**inputs, max_new_tokens=2)
+
+
+def _load_marian(registry):
+    return backends.load_marian(config.INFERENCE_BACKEND)
+
+
+def _warmup_marian(marian):
+    tokenizer, model = marian
+    model.generate(**tokenizer(["warm up"], return_tensors="pt"), max_new_tokens=2)
+
+
+def _load_yolo(registry):
+    return backends.load_yolo(config.INFERENCE_BACKEND)
+
+
+def _warmup_yolo(model):
+    import numpy as np
+
+    model(np.zeros((64, 64, 3), dtype=np.uint8), verbose=False)
+
+
+def _load_easyocr(registry):
+    import easyocr
+
+    return easyocr.Reader(config.OCR_LANGUAGES)
+
+
+def _warmup_easyocr(reader):
+    import numpy as np
+
+    reader.readtext(np.zeros((32, 32), dtype=np.uint8), detail=0)
+
+
+def _load_spelling(registry):
+    from spelling import SpellingService
+
+    return SpellingService(
+        config.SPELL_LANGUAGES,
+        max_distance=config.SPELL_MAX_EDIT_DISTANCE,
+        prefix_length=config.SPELL_PREFIX_LENGTH,
+        cache_size=config.SPELL_CACHE_SIZE,
+    )
+
+
+registry = ModelRegistry()
+registry.register("blip", _load_blip, _warmup_blip)
+registry.register("marian", _load_marian, _warmup_marian)
+registry.register("yolo", _load_yolo, _warmup_yolo)
+registry.register("easyocr", _load_easyocr, _warmup_easyocr)
+registry.register("spelling", _load_spelling)
@@ -0,0 +1,144 @@
+from functools import lru_cache
+
+from spellchecker import SpellChecker
+
+
+def _deletes(word, max_distance):
+    """Все варианты слова с удалением до ``max_distance`` символов."""
+    result = set()
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))} - result
+        result |= frontier
+    return result
+
+
+def _edit_distance(a, b, max_distance):
+    """Расстояние Дамерау–Левенштейна (OSA) или ``max_distance + 1``, если больше."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    prev2 = None
+    prev = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > max_distance:
+            return max_distance + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+class SpellingCorrector:
+    """Исправление орфографии по индексу удалений (алгоритм SymSpell).
+
+    Индекс строится один раз по частотному словарю pyspellchecker. Поиск
+    кандидата — это несколько обращений к словарю вместо перебора всех
+    правок, как в ``SpellChecker.correction``. Уже исправленные слова
+    запоминаются в LRU.
+    """
+
+    def __init__(self, language, max_distance=1, prefix_length=7, cache_size=100000):
+        self.language = language
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.frequencies = dict(SpellChecker(language=language).word_frequency.dictionary)
+        self.index = {}
+        for word in self.frequencies:
+            prefix = word[:prefix_length]
+            for variant in _deletes(prefix, max_distance) | {prefix}:
+                self.index.setdefault(variant, []).append(word)
+        self.correct_word = lru_cache(maxsize=cache_size)(self._correct_word)
+
+    def _correct_word(self, word):
+        """Возвращает наиболее частое слово словаря в пределах ``max_distance``."""
+        lower = word.lower()
+        if lower in self.frequencies:
+            return word
+
+        prefix = lower[:self.prefix_length]
+        best, best_key = None, None
+        seen = set()
+        for variant in _deletes(prefix, self.max_distance) | {prefix}:
+            for candidate in self.index.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                distance = _edit_distance(lower, candidate, self.max_distance)
+                if distance > self.max_distance:
+                    continue
+                key = (distance, -self.frequencies[candidate])
+                if best_key is None or key < best_key:
+                    best, best_key = candidate, key
+
+        if best is None:
+            return word
+        if word.isupper():
+            return best.upper()
+        if word[0].isupper():
+            return best.capitalize()
+        return best
+
+    def correct(self, text):
+        """Исправляет слова в строке, сохраняя пунктуацию вокруг них."""
+        corrected_words = []
+        for word in text.split():
+            leading_punct = ""
+            trailing_punct = ""
+
+            while word and not word[0].isalnum():
+                leading_punct += word[0]
+                word = word[1:]
+
+            while word and not word[-1].isalnum():
+                trailing_punct = word[-1] + trailing_punct
+                word = word[:-1]
+
+            if word and not any(c.isdigit() for c in word):
+                word = self.correct_word(word)
+
+            corrected_words.append(leading_punct + word + trailing_punct)
+
+        return ' '.join(corrected_words)
+
+    def metrics(self):
+        info = self.correct_word.cache_info()
+        return {
+            "words": len(self.frequencies),
+            "index_size": len(self.index),
+            "cache_hits": info.hits,
+            "cache_misses": info.misses,
+            "cache_items": info.currsize,
+        }
+
+
+def detect_language(text):
+    """Определяет язык текста по преобладающему алфавиту."""
+    ru_chars = sum(1 for c in text if 'а' <= c.lower() <= 'я' or c.lower() == 'ё')
+    en_chars = sum(1 for c in text if 'a' <= c.lower() <= 'z')
+    return 'ru' if ru_chars > en_chars else 'en'
+
+
+class SpellingService:
+    """Набор долгоживущих корректоров, по одному на язык."""
+
+    def __init__(self, languages, **options):
+        self.correctors = {lang: SpellingCorrector(lang, **options) for lang in languages}
+
+    def correct(self, text, lang=None):
+        if not text:
+            return text
+        corrector = self.correctors.get(lang or detect_language(text))
+        if corrector is None:
+            return text
+        return corrector.correct(text)
+
+    def correct_many(self, texts, lang=None):
+        """Пакетное исправление множества строк OCR."""
+        return [self.correct(text, lang) for text in texts]
+
+    def metrics(self):
+        return {lang: corrector.metrics() for lang, corrector in self.correctors.items()}
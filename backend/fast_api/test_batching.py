@@ -0,0 +1,64 @@
+"""Тесты микро-батчинга: python -m unittest test_batching (из папки fast_api)."""
+import asyncio
+import unittest
+
+from batching import MicroBatcher, QueueFullError
+
+
+class MicroBatcherTests(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def double(self, items):
+        self.calls.append(list(items))
+        return [item * 2 for item in items]
+
+    def test_groups_concurrent_requests(self):
+        batcher = MicroBatcher(self.double, max_batch_size=4, max_wait_ms=50)
+
+        async def main():
+            return await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+
+        self.assertEqual(asyncio.run(main()), [i * 2 for i in range(10)])
+        self.assertEqual([len(batch) for batch in self.calls], [4, 4, 2])
+        metrics = batcher.metrics()
+        self.assertEqual((metrics["batches"], metrics["items"]), (3, 10))
+        self.assertAlmostEqual(metrics["avg_batch_size"], 10 / 3)
+
+    def test_partial_batch_after_wait(self):
+        batcher = MicroBatcher(self.double, max_batch_size=8, max_wait_ms=10)
+
+        async def main():
+            first = await batcher.submit(1)
+            second = await batcher.submit(2)
+            return first, second
+
+        self.assertEqual(asyncio.run(main()), (2, 4))
+        self.assertEqual(self.calls, [[1], [2]])  # Окно истекло — батч не ждёт заполнения
+
+    def test_error_reaches_every_caller(self):
+        def fail(items):
+            raise RuntimeError("модель упала")
+
+        batcher = MicroBatcher(fail, max_batch_size=4, max_wait_ms=10)
+
+        async def main():
+            return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertTrue(all(isinstance(r, RuntimeError) for r in results))
+
+    def test_queue_full(self):
+        batcher = MicroBatcher(self.double, max_batch_size=4, max_wait_ms=10, max_queue_size=2)
+
+        async def main():
+            return await asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True)
+
+        results = asyncio.run(main())
+        self.assertEqual(results[:2], [0, 2])
+        self.assertIsInstance(results[2], QueueFullError)
+        self.assertEqual(batcher.metrics()["rejected"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Тесты кэша результатов: python -m unittest test_cache (из папки fast_api)."""
+import os
+import tempfile
+import unittest
+
+from cache import ResultCache, models_version
+
+
+class ResultCacheTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.db_path = os.path.join(tmp.name, "cache.sqlite3")
+
+    def test_lru_by_items(self):
+        cache = ResultCache("v1", max_items=2)
+        cache.set("a", {"n": 1})
+        cache.set("b", {"n": 2})
+        cache.get("a")  # "a" становится самым свежим
+        cache.set("c", {"n": 3})
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), {"n": 1})
+        self.assertEqual(cache.metrics()["evictions"], 1)
+
+    def test_lru_by_bytes(self):
+        cache = ResultCache("v1", max_bytes=40)
+        cache.set("a", {"text": "x" * 20})
+        cache.set("b", {"text": "y" * 20})
+        metrics = cache.metrics()
+        self.assertEqual(metrics["items"], 1)
+        self.assertLessEqual(metrics["bytes"], 40)
+        self.assertIsNone(cache.get("a"))
+
+    def test_disk_survives_restart(self):
+        ResultCache("v1", db_path=self.db_path).set("a", {"n": 1})
+        cache = ResultCache("v1", db_path=self.db_path)
+        self.assertEqual(cache.get("a"), {"n": 1})
+        self.assertEqual(cache.get("a"), {"n": 1})
+        metrics = cache.metrics()
+        self.assertEqual((metrics["disk_hits"], metrics["memory_hits"]), (1, 1))
+
+    def test_new_version_invalidates(self):
+        ResultCache(models_version("det", 1), db_path=self.db_path).set("a", {"n": 1})
+        cache = ResultCache(models_version("det", 2), db_path=self.db_path)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.metrics()["misses"], 1)
+        self.assertEqual(cache._db.execute("SELECT COUNT(*) FROM results").fetchone()[0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+"""Тесты исправления орфографии: python -m unittest test_spelling (из папки fast_api)."""
+import unittest
+
+from spelling import SpellingCorrector, SpellingService, _edit_distance, detect_language
+
+
+class EditDistanceTests(unittest.TestCase):
+    def test_distance(self):
+        self.assertEqual(_edit_distance("кот", "кот", 2), 0)
+        self.assertEqual(_edit_distance("кот", "кто", 2), 1)  # Перестановка соседних букв
+        self.assertEqual(_edit_distance("кот", "кит", 2), 1)
+        self.assertEqual(_edit_distance("кот", "коты", 2), 1)
+        self.assertEqual(_edit_distance("ca", "abc", 3), 3)  # OSA: подстрока не правится дважды
+
+    def test_cutoff(self):
+        self.assertEqual(_edit_distance("кот", "собака", 1), 2)
+        self.assertEqual(_edit_distance("abcdef", "badcfe", 1), 2)
+
+
+class SpellingCorrectorTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.corrector = SpellingCorrector("en", max_distance=1)
+
+    def test_known_words_unchanged(self):
+        self.assertEqual(self.corrector.correct("the quick brown fox"), "the quick brown fox")
+
+    def test_corrections(self):
+        self.assertEqual(self.corrector.correct_word("wrold"), "world")  # Перестановка
+        self.assertEqual(self.corrector.correct_word("housse"), "house")  # Лишняя буква
+        self.assertEqual(self.corrector.correct_word("hous"), "house")  # Пропущенная буква
+
+    def test_case_and_punctuation(self):
+        self.assertEqual(self.corrector.correct("Wrold, (wrold) WROLD!"), "World, (world) WORLD!")
+
+    def test_skips_numbers_and_distant_words(self):
+        self.assertEqual(self.corrector.correct("2nd xqzvbn"), "2nd xqzvbn")
+
+    def test_cache(self):
+        self.corrector.correct_word.cache_clear()
+        self.corrector.correct("wrold wrold")
+        metrics = self.corrector.metrics()
+        self.assertEqual((metrics["cache_hits"], metrics["cache_misses"]), (1, 1))
+
+
+class SpellingServiceTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.service = SpellingService(["en"], max_distance=1)
+
+    def test_language_detection(self):
+        self.assertEqual(detect_language("Привет, world"), "ru")
+        self.assertEqual(detect_language("Hello, мир"), "en")
+
+    def test_correct(self):
+        self.assertEqual(self.service.correct("Helo wrold"), self.service.correct("Helo wrold", "en"))
+        self.assertEqual(self.service.correct("wrold"), "world")
+        self.assertEqual(self.service.correct("привет мр"), "привет мр")  # Корректора ru нет
+        self.assertEqual(self.service.correct(""), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Тесты пула инференса: python -m unittest test_workers (из папки fast_api)."""
+import asyncio
+import threading
+import unittest
+
+from batching import QueueFullError
+from workers import InferenceExecutor
+
+
+class InferenceExecutorTests(unittest.TestCase):
+    def setUp(self):
+        self.executor = InferenceExecutor(max_workers=1, max_pending=2)
+        self.addCleanup(self.executor.pool.shutdown)
+
+    def test_run(self):
+        self.assertEqual(asyncio.run(self.executor.run(pow, 2, 10)), 1024)
+        self.assertEqual(self.executor.metrics()["pending"], 0)
+        self.assertEqual(self.executor.metrics()["completed"], 1)
+
+    def test_admission_limit(self):
+        gate = threading.Event()
+
+        async def main():
+            tasks = [asyncio.ensure_future(self.executor.run(gate.wait)) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            with self.assertRaises(QueueFullError):
+                await self.executor.run(gate.wait)
+            gate.set()
+            await asyncio.gather(*tasks)
+
+        asyncio.run(main())
+        self.assertEqual(self.executor.metrics()["rejected"], 1)
+
+    def test_cancelled_caller_keeps_slot_until_thread_finishes(self):
+        gate = threading.Event()
+        finished = threading.Event()
+
+        def work():
+            gate.wait()
+            finished.set()
+
+        async def main():
+            task = asyncio.ensure_future(self.executor.run(work))
+            await asyncio.sleep(0.05)
+            task.cancel()  # Клиент отключился, а поток ещё работает
+            await asyncio.sleep(0.05)
+            self.assertEqual(self.executor.pending, 1)
+            gate.set()
+            await asyncio.to_thread(finished.wait)
+            await asyncio.sleep(0.05)
+            self.assertEqual(self.executor.pending, 0)
+
+        asyncio.run(main())
+
+
+if __name__ == "__main__":
+    unittest.main()
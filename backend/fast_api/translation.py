@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict
+
+from batching import MicroBatcher
+
+
+class Translator:
+    """Переводчик Marian с батчингом и LRU-мемоизацией.
+
+    Строки из разных стадий и запросов собираются ``MicroBatcher`` и
+    переводятся одним вызовом ``generate`` с паддингом. Уже переведённые
+    строки берутся из LRU и в модель не попадают.
+    """
+
+    def __init__(self, tokenizer, model, cache_size=50000, max_batch_size=32,
+                 max_wait_ms=10, max_queue_size=1024, executor=None):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.cache_size = cache_size
+        self.max_batch_size = max_batch_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.batcher = MicroBatcher(
+            self.translate_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            max_queue_size=max_queue_size,
+            executor=executor,
+        )
+
+    def _lookup(self, text, count_miss=True):
+        with self._lock:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return self._cache[text]
+            if count_miss:
+                self.misses += 1
+            return None
+
+    def _remember(self, text, translated):
+        with self._lock:
+            self._cache[text] = translated
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def translate_batch(self, texts):
+        """Синхронно переводит список строк одним вызовом модели."""
+        results = {}
+        pending = []
+        for text in dict.fromkeys(texts):
+            if not text.strip():
+                results[text] = text
+                continue
+            cached = self._lookup(text)
+            if cached is not None:
+                results[text] = cached
+            else:
+                pending.append(text)
+
+        # Большие списки (bulk API) режутся на батчи, чтобы не раздувать паддинг и память
+        for start in range(0, len(pending), self.max_batch_size):
+            chunk = pending[start:start + self.max_batch_size]
+            tokens = self.tokenizer(chunk, return_tensors="pt", padding=True, truncation=True)
+            out = self.model.generate(**tokens)
+            for text, translated in zip(chunk, self.tokenizer.batch_decode(out, skip_special_tokens=True)):
+                self._remember(text, translated)
+                results[text] = translated
+
+        return [results[text] for text in texts]
+
+    async def translate(self, text):
+        """Переводит одну строку, объединяя её в батч с другими запросами."""
+        if not text.strip():
+            return text
+        # Промах засчитается при обработке батча, здесь его не считаем
+        cached = self._lookup(text, count_miss=False)
+        if cached is not None:
+            return cached
+        return await self.batcher.submit(text)
+
+    def metrics(self):
+        lookups = self.hits + self.misses
+        return {
+            "cache_items": len(self._cache),
+            "cache_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "batcher": self.batcher.metrics(),
+        }
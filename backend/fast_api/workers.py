@@ -0,0 +1,66 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from batching import QueueFullError
+
+
+class InferenceExecutor:
+    """Пул потоков для тяжёлых стадий с ограниченной очередью допуска.
+
+    Одновременно в пуле (в работе и в ожидании) может находиться не более
+    ``max_pending`` задач; сверх этого ``run`` сразу бросает
+    ``QueueFullError``, чтобы запросы не копились бесконечно.
+    """
+
+    def __init__(self, max_workers=2, max_pending=32):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def _acquire(self):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFullError("Сервис перегружен, повторите запрос позже")
+            self.pending += 1
+
+    def _release(self):
+        with self._lock:
+            self.pending -= 1
+            self.completed += 1
+
+    async def run(self, fn, *args):
+        """Выполняет ``fn(*args)`` в пуле, не блокируя цикл событий.
+
+        Место в очереди освобождается, когда задача в пуле завершилась, а не
+        когда ожидающая корутина отменена: отмена не останавливает поток.
+        """
+        self._acquire()
+        try:
+            future = self.pool.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def metrics(self):
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+def configure_torch_threads(num_threads):
+    """Ограничивает число потоков torch, чтобы пул не перегружал ядра."""
+    import torch
+
+    torch.set_num_threads(num_threads)
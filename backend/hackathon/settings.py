@@ -141,8 +141,46 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
 }
+IMAGES_MAX_PAGE_SIZE = 1000  # Максимальный ?page_size= для /api/images/
 
-METADATA_API_URL = "http://127.0.0.1:8001/upload/"
+# Уменьшенные копии изображений: вид -> максимальный размер
+IMAGE_RENDITIONS = {
+    'thumbnail': (200, 200),
+    'preview': (800, 800),
+}
+RENDITION_QUALITY = 85
+RENDITION_CACHE_SECONDS = 7 * 24 * 3600  # Cache-Control: max-age для превью
+
+# Почти-дубликаты по перцептивному хэшу (расстояние Хэмминга между 64-битными dHash)
+PHASH_REUSE_DISTANCE = int(os.getenv('PHASH_REUSE_DISTANCE', 4))  # Порог переиспользования метаданных; -1 — выключено
+SIMILAR_DEFAULT_DISTANCE = 8  # Порог /api/images/{id}/similar/ по умолчанию
+SIMILAR_MAX_DISTANCE = 10  # Максимальный ?distance=: дальше поиск по индексу заметно медленнее
+PHASH_INDEX_REFRESH = 5  # Как часто догружать в индекс изображения из других процессов, с
+
+# Векторный поиск по эмбеддингам изображений (python manage.py build_embedding_index — режим IVF)
+EMBEDDINGS_DIR = os.getenv('EMBEDDINGS_DIR', os.path.join(BASE_DIR, "embeddings"))
+EMBEDDING_SEARCH_BLOCK = 65536  # Строк матрицы в одном блоке точного поиска
+EMBEDDING_IVF_MIN_ROWS = int(os.getenv('EMBEDDING_IVF_MIN_ROWS', 200000))  # С какого размера mode=auto выбирает IVF
+EMBEDDING_IVF_NPROBE = 8  # Сколько ближайших списков IVF просматривать по умолчанию
+EMBEDDING_INDEX_REFRESH = 5  # Как часто проверять изменения списков IVF, с
+
+# Сервис инференса: реплики через запятую, запросы идут на наименее загруженную
+INFERENCE_BACKENDS = [url.strip() for url in os.getenv('INFERENCE_BACKENDS', "http://127.0.0.1:8001").split(',') if url.strip()]
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', 60))  # Срок запроса к сервису инференса вместе с повторами, с
+INFERENCE_CONNECT_TIMEOUT = 3  # Таймаут установки соединения с репликой, с
+INFERENCE_RETRIES = int(os.getenv('INFERENCE_RETRIES', 2))  # Повторы на другой реплике при обрыве соединения, 502–504
+INFERENCE_RETRY_BACKOFF = 0.5  # Базовая задержка перед повтором (экспоненциальная со случайным разбросом), с
+INFERENCE_BREAKER_FAILURES = 3  # Ошибок подряд, после которых реплика временно исключается
+INFERENCE_BREAKER_RESET = 30  # Через сколько секунд исключённая реплика получает пробный запрос
+INFERENCE_POOL_SIZE = int(os.getenv('INFERENCE_POOL_SIZE', 16))  # Постоянных соединений на реплику
+
+# Очередь задач инференса (python manage.py process_jobs)
+INFERENCE_WORKER_CONCURRENCY = int(os.getenv('INFERENCE_WORKER_CONCURRENCY', 4))
+INFERENCE_JOB_MAX_ATTEMPTS = int(os.getenv('INFERENCE_JOB_MAX_ATTEMPTS', 5))
+INFERENCE_JOB_BACKOFF = 5  # Задержка перед первым повтором, с
+INFERENCE_JOB_MAX_BACKOFF = 600  # Максимальная задержка между повторами, с
+INFERENCE_JOB_STALE_AFTER = int(os.getenv('INFERENCE_JOB_STALE_AFTER', 600))  # Через сколько секунд задача «в работе» считается зависшей
+INFERENCE_JOB_REQUEUE_INTERVAL = 60  # Как часто воркер ищет зависшие задачи, с
 
 CORS_ORIGIN_ALLOW_ALL = True
 CORS_URLS_REGEX = r'^/api/.*$'